@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# lp_parser.py
+#
+# Compare reading a large INTEGRATE.LP (as from a long sweep) a line at a
+# time, as fast_dp used to, with the single pass of fast_dp.lp_parser, for
+# the error checks and mosaic spreads needed after INTEGRATE. Run as:
+#
+#   python benchmarks/lp_parser.py [size in MB] [repeats]
+from __future__ import annotations
+
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from fast_dp.lp_parser import LPFile, last_record
+
+block = """\
+ PROCESSING OF IMAGES      %(first)6d ...  %(last)6d
+ ****************************************************************************
+ REFLECTIONS ACCEPTED FOR REFINEMENT            1234
+ STANDARD DEVIATION OF SPOT    POSITION (PIXELS)     0.45
+ STANDARD DEVIATION OF SPINDLE POSITION (DEGREES)    0.03
+ CRYSTAL MOSAICITY (DEGREES)     0.%(mosaic)03d
+"""
+
+# the per image table making up most of a real INTEGRATE.LP
+image = "   %6d   0  1.000  1234  567   12   3  1234   55  0.081  0.03  0.45  3.2\n"
+
+
+def write_integrate_lp(filename, size):
+    """Write a synthetic INTEGRATE.LP of about size bytes."""
+    first = 1
+    with open(filename, "w") as fh:
+        fh.write(" ***** INTEGRATE *****\n")
+        while fh.tell() < size:
+            last = first + 99
+            fh.write(block % {"first": first, "last": last, "mosaic": first % 1000})
+            for j in range(first, last + 1):
+                fh.write(image % j)
+            first = last + 1
+
+
+def by_lines(filename):
+    """Check for errors and read the mosaic spreads as before."""
+    lastrecord = open(filename).readlines()[-1]
+    assert "!!! ERROR !!!" not in lastrecord
+    for record in open(filename).readlines():
+        if "!!! ERROR !!! AUTOMATIC DETERMINATION OF SPOT SIZE " in record:
+            raise RuntimeError(record)
+    mosaics = []
+    for record in open(filename):
+        if "CRYSTAL MOSAICITY (DEGREES)" in record:
+            mosaics.append(float(record.split()[-1]))
+    return mosaics
+
+
+def by_index(filename):
+    """Check for errors and read the mosaic spreads with lp_parser."""
+    assert "!!! ERROR !!!" not in last_record(filename)
+    with LPFile(filename) as lp:
+        assert not lp.errors()
+        return lp.mosaicities()
+
+
+def main():
+    size = float(sys.argv[1]) if len(sys.argv) > 1 else 200
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "INTEGRATE.LP")
+        write_integrate_lp(filename, int(size * 1024 * 1024))
+        print("INTEGRATE.LP: %.0f MB" % (os.path.getsize(filename) / 1024 / 1024))
+
+        assert by_lines(filename) == by_index(filename)
+
+        print("%-12s %8s %8s" % ("Method", "Median/s", "Min/s"))
+        for name, method in (("readlines", by_lines), ("lp_parser", by_index)):
+            times = []
+            for j in range(repeats):
+                t0 = time.perf_counter()
+                method(filename)
+                times.append(time.perf_counter() - t0)
+            print("%-12s %8.3f %8.3f" % (name, statistics.median(times), min(times)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# startup.py
+#
+# Measure how long the fast_dp and fast_rdp entry points take to import and
+# to get as far as printing the version, i.e. the fixed cost paid by every
+# job before any processing starts. Run as:
+#
+#   python benchmarks/startup.py [repeats]
+from __future__ import annotations
+
+import statistics
+import subprocess
+import sys
+import time
+
+commands = {
+    "import fast_dp.fast_dp": ["-c", "import fast_dp.fast_dp"],
+    "import fast_dp.fast_rdp": ["-c", "import fast_dp.fast_rdp"],
+    "fast_dp --version": [
+        "-c",
+        "from fast_dp.fast_dp import main; main()",
+        "--version",
+    ],
+    "fast_rdp --version": [
+        "-c",
+        "from fast_dp.fast_rdp import main; main()",
+        "--version",
+    ],
+}
+
+
+def time_command(arguments, repeats):
+    """Run python with arguments repeats times, returning the wall times."""
+    times = []
+    for j in range(repeats):
+        t0 = time.perf_counter()
+        subprocess.run(
+            [sys.executable] + arguments,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    # the interpreter itself, for reference
+    baseline = statistics.median(time_command(["-c", "pass"], repeats))
+
+    print("%-24s %8s %8s %8s" % ("Command", "Median/s", "Min/s", "Extra/s"))
+    print("%-24s %8.3f" % ("python -c pass", baseline))
+    for name, arguments in commands.items():
+        times = time_command(arguments, repeats)
+        median = statistics.median(times)
+        print("%-24s %8.3f %8.3f %8.3f" % (name, median, min(times), median - baseline))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,14 @@ import shutil
 
 from fast_dp.cell_spacegroup import spacegroup_to_lattice
 from fast_dp.logger import write
-from fast_dp.run_job import run_job
+from fast_dp.lp_parser import last_record
+from fast_dp.run_job import stream_job
+from fast_dp.step_cache import (
+    AUTOINDEX_ARTEFACTS,
+    restore_step,
+    step_key,
+    store_step,
+)
 from fast_dp.xds_reader import read_xds_idxref_lp
 
 # TODO add pytests for this method
@@ -97,15 +104,17 @@ def autoindex(xds_inp, input_cell=None):
 
     shutil.copyfile("AUTOINDEX.INP", "XDS.INP")
 
-    log = run_job("xds_par")
+    key = step_key("autoindex", "AUTOINDEX.INP", xds_inp)
 
-    with open("autoindex.log", "w") as fout:
-        fout.write("".join(log))
+    if restore_step(key):
+        write("Autoindexing results restored from cache")
+    else:
+        stream_job("xds_par", stage="autoindex", log_file="autoindex.log")
 
     # sequentially check for errors... XYCORR INIT COLSPOT IDXREF
 
     for step in ["XYCORR", "INIT", "COLSPOT", "IDXREF"]:
-        lastrecord = open("%s.LP" % step).readlines()[-1]
+        lastrecord = last_record("%s.LP" % step)
         if "!!! ERROR !!!" in lastrecord:
             raise RuntimeError(
                 "error in {}: {}".format(
@@ -113,6 +122,8 @@ def autoindex(xds_inp, input_cell=None):
                 )
             )
 
+    store_step(key, AUTOINDEX_ARTEFACTS)
+
     results = read_xds_idxref_lp("IDXREF.LP")
 
     # FIXME if input cell was given, verify that this is an allowed
@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+# batch.py
+#
+# Process a manifest of datasets with fast_dp under one budget of cores and
+# XDS jobs, rather than starting one fast_dp per sweep and letting them
+# compete for the machine. Each line of the manifest is one dataset:
+#
+#   [--priority N] [--name NAME] [fast_dp options] image
+#
+# e.g.
+#
+#   --priority 10 -j 2 -k 4 /dls/i04/data/thing_1_00001.cbf
+#   -a Se /dls/i04/data/other_1_master.h5
+#
+# Blank lines and lines starting # are ignored. Each dataset is processed
+# in its own working directory (NAME, by default from the order in the
+# manifest and the image name) by a separate fast_dp, given the options on
+# the fast_dp --batch command line first and then those from the manifest.
+# Datasets are started highest priority first, then in the order given, as
+# soon as the cores (jobs x cores per job) and XDS jobs they need are free,
+# letting a smaller dataset go ahead of one waiting for space. The results
+# and timings of all of them are written to fast_dp_batch.json.
+from __future__ import annotations
+
+import json
+import os
+import re
+import shlex
+import signal
+import subprocess
+import sys
+import time
+
+from fast_dp.logger import write
+
+# the options of fast_dp for the batch itself (all of which take a value),
+# to separate them from the defaults for the datasets
+batch_options = {"--batch": True, "--batch-cores": True, "--batch-jobs": True}
+
+
+def strip_options(arguments, options):
+    """Remove options (a dictionary of name: takes a value) from the list
+    of command line arguments.
+    """
+    result = []
+    arguments = iter(arguments)
+    for argument in arguments:
+        name = argument.split("=")[0]
+        if name in options:
+            if options[name] and "=" not in argument:
+                next(arguments, None)
+            continue
+        result.append(argument)
+    return result
+
+
+def _option(arguments, short, long, default=None):
+    """The value of the last of option -short or --long in arguments."""
+    value = default
+    for j, argument in enumerate(arguments):
+        if argument in (short, long) and j + 1 < len(arguments):
+            value = arguments[j + 1]
+        elif argument.startswith(long + "="):
+            value = argument.split("=", 1)[1]
+    return value
+
+
+def dataset_name(index, image):
+    stem = os.path.basename(image).split(".")[0]
+    stem = re.sub(r"(_master)?[_.]?[0-9]*$", "", stem) or stem
+    return "%03d_%s" % (index, stem)
+
+
+def parse_dataset(tokens, index, defaults=(), cores_per_job=4):
+    """Make a dataset from the tokens of one line of a manifest, returning
+    a dictionary of the image, the fast_dp arguments (defaults then those
+    given for the dataset), priority, name and number of jobs and cores per
+    job.
+    """
+    tokens = list(tokens)
+    if not tokens or tokens[-1].startswith("-"):
+        raise RuntimeError("no image given")
+    image = tokens.pop()
+
+    priority = int(_option(tokens, None, "--priority", 0))
+    name = _option(tokens, None, "--name")
+    arguments = list(defaults) + strip_options(
+        tokens, {"--priority": True, "--name": True}
+    )
+
+    jobs = int(_option(arguments, "-j", "--number-of-jobs", 1))
+    cores = int(_option(arguments, "-k", "--number-of-cores", cores_per_job))
+
+    return {
+        "index": index,
+        "name": name or dataset_name(index, image),
+        "image": image,
+        "priority": priority,
+        "arguments": arguments,
+        "jobs": max(1, jobs),
+        "cores": max(1, cores),
+    }
+
+
+def read_manifest(filename, defaults=(), cores_per_job=4):
+    """Read the datasets from the manifest, as parse_dataset makes them."""
+    datasets = []
+    with open(filename) as fh:
+        for lineno, line in enumerate(fh, start=1):
+            tokens = shlex.split(line, comments=True)
+            if not tokens:
+                continue
+            try:
+                dataset = parse_dataset(
+                    tokens, len(datasets) + 1, defaults, cores_per_job
+                )
+            except (RuntimeError, ValueError) as e:
+                raise RuntimeError("%s:%d: %s" % (filename, lineno, e))
+            datasets.append(dataset)
+
+    names = [dataset["name"] for dataset in datasets]
+    for name in names:
+        if names.count(name) > 1:
+            raise RuntimeError("dataset name %s used more than once" % name)
+
+    return datasets
+
+
+def fit_budget(dataset, max_cores, max_jobs):
+    """Shrink the request of a dataset which could never be met on its own
+    to the whole budget.
+    """
+    jobs = min(dataset["jobs"], max_jobs)
+    cores = min(dataset["cores"], max(1, max_cores // jobs))
+    if (jobs, cores) != (dataset["jobs"], dataset["cores"]):
+        write(
+            "%s: asks for %d x %d cores, using %d x %d"
+            % (dataset["name"], dataset["jobs"], dataset["cores"], jobs, cores)
+        )
+        dataset["jobs"], dataset["cores"] = jobs, cores
+
+
+def next_dataset(waiting, free_cores, free_jobs):
+    """The first of waiting (in priority order) which fits in what is free."""
+    for dataset in waiting:
+        if (
+            dataset["jobs"] * dataset["cores"] <= free_cores
+            and dataset["jobs"] <= free_jobs
+        ):
+            return dataset
+    return None
+
+
+def dataset_results(directory):
+    """The results of fast_dp from directory, and the error if it failed."""
+    results = None
+    error = None
+    try:
+        with open(os.path.join(directory, "fast_dp.json")) as fh:
+            results = json.load(fh)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open(os.path.join(directory, "fast_dp.log")) as fh:
+            for record in fh:
+                if record.startswith("Fast DP error:"):
+                    error = record.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return results, error
+
+
+def fast_dp_arguments(dataset):
+    """The fast_dp command line for dataset, with the jobs and cores from
+    the budget.
+    """
+    arguments = strip_options(
+        dataset["arguments"],
+        {"-j": True, "--number-of-jobs": True, "-k": True, "--number-of-cores": True},
+    )
+    return [
+        "-j",
+        str(dataset["jobs"]),
+        "-k",
+        str(dataset["cores"]),
+        *arguments,
+        os.path.abspath(dataset["image"]),
+    ]
+
+
+def finish_dataset(dataset, exit_status):
+    """Record the end of fast_dp for dataset, with its results."""
+    dataset["end"] = time.time()
+    dataset["wall_time"] = dataset["end"] - dataset["start"]
+    dataset["exit_status"] = exit_status
+    dataset["results"], dataset["error"] = dataset_results(dataset["directory"])
+    write(
+        "%s: %s after %.1fs"
+        % (
+            dataset["name"],
+            "failed (%s)" % dataset["error"] if exit_status else "finished",
+            dataset["wall_time"],
+        )
+    )
+
+
+def run_batch(
+    datasets,
+    max_cores,
+    max_jobs,
+    command=None,
+    summary="fast_dp_batch.json",
+    poll_interval=0.5,
+):
+    """Run fast_dp for each of the datasets from read_manifest, each in its
+    own working directory, keeping the cores and XDS jobs in use within
+    max_cores and max_jobs. Writes the outcome of each to summary and
+    returns the number which failed.
+    """
+    command = command or [sys.executable, "-m", "fast_dp.fast_dp"]
+
+    for dataset in datasets:
+        fit_budget(dataset, max_cores, max_jobs)
+
+    waiting = sorted(
+        datasets, key=lambda dataset: (-dataset["priority"], dataset["index"])
+    )
+    running = {}
+    finished = []
+    free_cores = max_cores
+    free_jobs = max_jobs
+
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        raise KeyboardInterrupt(signum)
+
+    previous = signal.signal(signal.SIGTERM, stop)
+
+    batch_start = time.time()
+
+    def finish(dataset, exit_status):
+        finish_dataset(dataset, exit_status)
+        finished.append(dataset)
+
+    try:
+        while waiting or running:
+            while True:
+                dataset = next_dataset(waiting, free_cores, free_jobs)
+                if dataset is None:
+                    break
+                waiting.remove(dataset)
+
+                directory = os.path.abspath(dataset["name"])
+                os.makedirs(directory, exist_ok=True)
+                dataset["directory"] = directory
+                dataset["command"] = command + fast_dp_arguments(dataset)
+                dataset["start"] = time.time()
+                dataset["queued"] = dataset["start"] - batch_start
+                with open(os.path.join(directory, "fast_dp.stdout"), "wb") as fh:
+                    try:
+                        popen = subprocess.Popen(
+                            dataset["command"],
+                            cwd=directory,
+                            stdin=subprocess.DEVNULL,
+                            stdout=fh,
+                            stderr=subprocess.STDOUT,
+                        )
+                    except OSError:
+                        finish(dataset, 127)
+                        continue
+
+                write(
+                    "%s: started with %d x %d cores"
+                    % (dataset["name"], dataset["jobs"], dataset["cores"])
+                )
+                free_cores -= dataset["jobs"] * dataset["cores"]
+                free_jobs -= dataset["jobs"]
+                running[popen.pid] = (popen, dataset)
+
+            time.sleep(poll_interval)
+
+            for pid, (popen, dataset) in list(running.items()):
+                exit_status = popen.poll()
+                if exit_status is None:
+                    continue
+                del running[pid]
+                free_cores += dataset["jobs"] * dataset["cores"]
+                free_jobs += dataset["jobs"]
+                finish(dataset, exit_status)
+
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+        # stop what is running - passing on the signal, for each fast_dp to
+        # stop its XDS jobs (in sessions of their own) - and record what was
+        # never started
+        for popen, dataset in running.values():
+            popen.send_signal(stopping[0] if stopping else signal.SIGTERM)
+        for popen, dataset in running.values():
+            finish(dataset, popen.wait())
+        for dataset in waiting:
+            dataset["exit_status"] = None
+            finished.append(dataset)
+
+        write_summary(finished, max_cores, max_jobs, batch_start, summary)
+
+    return sum(1 for dataset in finished if dataset["exit_status"])
+
+
+def write_summary(datasets, max_cores, max_jobs, batch_start, filename):
+    """Write the outcome of each dataset, in the order of the manifest, and
+    the use made of the budget to filename.
+    """
+    wall_time = time.time() - batch_start
+    core_time = sum(
+        dataset["jobs"] * dataset["cores"] * dataset.get("wall_time", 0.0)
+        for dataset in datasets
+    )
+
+    with open(filename, "w") as fh:
+        json.dump(
+            {
+                "max_cores": max_cores,
+                "max_jobs": max_jobs,
+                "wall_time": wall_time,
+                "utilisation": core_time / (max_cores * wall_time)
+                if wall_time
+                else 0.0,
+                "n_failed": sum(1 for dataset in datasets if dataset["exit_status"]),
+                "n_not_run": sum(
+                    1 for dataset in datasets if dataset["exit_status"] is None
+                ),
+                "datasets": sorted(datasets, key=lambda dataset: dataset["index"]),
+            },
+            fh,
+            indent=2,
+        )
@@ -0,0 +1,298 @@
+from __future__ import annotations
+
+import concurrent.futures
+import multiprocessing
+import os
+import shutil
+
+from fast_dp.cell_spacegroup import spacegroup_number_to_name
+from fast_dp.logger import write
+from fast_dp.merge import aimless_statistics, run_aimless
+from fast_dp.run_job import (
+    get_resource_usage,
+    merge_resource_usage,
+    reset_resource_usage,
+    stop_jobs_on_signal,
+)
+from fast_dp.scale import scale
+from fast_dp.step_cache import CORRECT_ARTEFACTS, set_cache_directory
+
+# files from integration which CORRECT reads - these are linked into each
+# sandbox rather than copied
+
+SHARED_FILES = [
+    "INTEGRATE.HKL",
+    "XPARM.XDS",
+    "X-CORRECTIONS.cbf",
+    "Y-CORRECTIONS.cbf",
+    "BKGINIT.cbf",
+    "BLANK.cbf",
+    "GAIN.cbf",
+    "BKGPIX.cbf",
+    "ABS.cbf",
+]
+
+
+def make_sandbox(directory, shared=SHARED_FILES):
+    """Create directory and link into it those of the shared files which
+    exist in the current working directory, so that XDS can be run there
+    without disturbing the main results.
+    """
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.makedirs(directory)
+
+    for filename in shared:
+        if not os.path.exists(filename):
+            continue
+        source = os.path.abspath(filename)
+        target = os.path.join(directory, filename)
+        try:
+            os.symlink(source, target)
+        except OSError:
+            shutil.copyfile(source, target)
+
+    return os.path.abspath(directory)
+
+
+def promote_sandbox(directory):
+    """Copy the scaling results from the sandbox directory into the current
+    working directory, as if CORRECT had been run here.
+    """
+    for filename in ["CORRECT.INP", "XDS.INP"] + CORRECT_ARTEFACTS:
+        if os.path.exists(os.path.join(directory, filename)):
+            shutil.copyfile(os.path.join(directory, filename), filename)
+
+
+def scale_in_sandbox(
+    directory,
+    unit_cell,
+    xds_inp,
+    space_group_number,
+    resolution_high=0.0,
+    merge=False,
+    cache_directory=None,
+):
+    """Run scale (and optionally Aimless) in the sandbox directory: this is
+    run in a worker process, so that each has its own working directory.
+    Returns a dictionary of the results, including any error.
+    """
+    os.chdir(directory)
+    set_cache_directory(cache_directory)
+    reset_resource_usage()
+
+    result = {"directory": directory, "space_group_number": space_group_number}
+
+    try:
+        unit_cell, space_group, nref, refined_beam = scale(
+            unit_cell, xds_inp, space_group_number, resolution_high
+        )
+        result["unit_cell"] = unit_cell
+        result["space_group"] = space_group
+        result["nref"] = nref
+        result["refined_beam"] = refined_beam
+
+        if merge:
+            result["scaling_statistics"] = aimless_statistics(run_aimless())[0]
+
+    except Exception as e:
+        result["error"] = str(e)
+
+    result["resource_usage"] = get_resource_usage()
+
+    return result
+
+
+def scale_candidates(
+    candidates,
+    xds_inp,
+    resolution_high=0.0,
+    merge=False,
+    cache_directory=None,
+    prefix="candidate",
+):
+    """Scale the data in each of the candidates (space group number, unit
+    cell) at the same time, each in a sandbox directory named from prefix
+    and the space group. Returns the results from scale_in_sandbox in the
+    same order as the candidates.
+    """
+    jobs = [
+        (
+            "%s_%d_sg%d" % (prefix, j + 1, space_group_number),
+            unit_cell,
+            space_group_number,
+            resolution_high,
+        )
+        for j, (space_group_number, unit_cell) in enumerate(candidates)
+    ]
+
+    return scale_in_sandboxes(
+        jobs, xds_inp, merge=merge, cache_directory=cache_directory
+    )
+
+
+def scale_in_sandboxes(
+    jobs, xds_inp, merge=False, cache_directory=None, max_workers=None
+):
+    """Run scale_in_sandbox for each of jobs (directory, unit cell, space
+    group number, high resolution limit), up to max_workers at a time (by
+    default all at once). Returns the results in the same order as jobs.
+    """
+    directories = [make_sandbox(job[0]) for job in jobs]
+
+    # spawned rather than forked, as this is called from the threads of
+    # run_stages and the workers change directory
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers or len(jobs),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=stop_jobs_on_signal,
+    ) as pool:
+        futures = [
+            pool.submit(
+                scale_in_sandbox,
+                directory,
+                unit_cell,
+                xds_inp,
+                space_group_number,
+                resolution_high,
+                merge,
+                cache_directory,
+            )
+            for directory, (_, unit_cell, space_group_number, resolution_high) in zip(
+                directories, jobs
+            )
+        ]
+        results = [future.result() for future in futures]
+
+    # the workers kept their own accounts of the programs they ran
+    for result in results:
+        merge_resource_usage(result.pop("resource_usage"))
+
+    return results
+
+
+def write_candidates(results):
+    """Print the scaling results for the candidates side by side."""
+    write(
+        "%3s %10s %6s %6s %6s %6s %6s %6s %8s %6s %6s %6s %6s"
+        % (
+            "#",
+            "Spacegroup",
+            "a",
+            "b",
+            "c",
+            "alpha",
+            "beta",
+            "gamma",
+            "Nref",
+            "Dmin",
+            "Rmerge",
+            "I/sig",
+            "CC1/2",
+        )
+    )
+    for j, result in enumerate(results):
+        name = spacegroup_number_to_name(result["space_group_number"])
+        if "error" in result:
+            write(
+                "%3d %10s failed: %s" % (j + 1, name.replace(" ", ""), result["error"])
+            )
+            continue
+        text = "%3d %10s %6.2f %6.2f %6.2f %6.2f %6.2f %6.2f %8d" % (
+            (j + 1, name.replace(" ", ""))
+            + tuple(result["unit_cell"])
+            + (result["nref"],)
+        )
+        if "scaling_statistics" in result:
+            overall = result["scaling_statistics"]["overall"]
+            text += " %6.2f %6.3f %6.2f %6.3f" % (
+                overall["res_lim_high"],
+                overall["r_merge"],
+                overall["mean_i_sig_i"],
+                overall["cc_half"],
+            )
+        write(text)
+
+
+def _speculate(connection, *args):
+    """Run scale_in_sandbox in a process of its own, sending the result
+    back through connection. Terminating the process stops CORRECT too.
+    """
+    stop_jobs_on_signal()
+    connection.send(scale_in_sandbox(*args))
+    connection.close()
+
+
+class SpeculativeScale:
+    """Scale in a sandbox in the background, in a pointgroup which is only a
+    guess (see likely_pointgroup), while the real decision is being made:
+    if the guess turns out to be right the results can be used directly,
+    otherwise they are discarded.
+    """
+
+    def __init__(
+        self,
+        unit_cell,
+        xds_inp,
+        space_group_number,
+        resolution_high=0.0,
+        cache_directory=None,
+        directory="speculative",
+    ):
+        self.unit_cell = tuple(unit_cell)
+        self.space_group_number = space_group_number
+        self.resolution_high = resolution_high
+
+        context = multiprocessing.get_context("spawn")
+        self._connection, connection = context.Pipe(duplex=False)
+        self._process = context.Process(
+            target=_speculate,
+            args=(
+                connection,
+                make_sandbox(directory),
+                unit_cell,
+                xds_inp,
+                space_group_number,
+                resolution_high,
+                False,
+                cache_directory,
+            ),
+            daemon=True,
+        )
+        self._process.start()
+        connection.close()
+
+    def matches(self, unit_cell, space_group_number, resolution_high):
+        return (self.unit_cell, self.space_group_number, self.resolution_high) == (
+            tuple(unit_cell),
+            space_group_number,
+            resolution_high,
+        )
+
+    def result(self):
+        """Wait for the scaling to finish and return the results, as from
+        scale_in_sandbox.
+        """
+        try:
+            result = self._connection.recv()
+        except EOFError:
+            result = {
+                "space_group_number": self.space_group_number,
+                "error": "exited with status %s" % self._process.exitcode,
+                "resource_usage": {},
+            }
+        self._connection.close()
+        self._process.join()
+        merge_resource_usage(result.pop("resource_usage"))
+        return result
+
+    def discard(self, timeout=10.0):
+        """Stop the scaling, and the CORRECT it is running, if it has not
+        already finished.
+        """
+        self._connection.close()
+        self._process.terminate()
+        self._process.join(timeout)
+        if self._process.is_alive():
+            self._process.kill()
+            self._process.join()
@@ -1,13 +1,12 @@
 from __future__ import annotations
 
-from cctbx import crystal, sgtbx, uctbx
-from cctbx.sgtbx.bravais_types import bravais_lattice
-
 
 def ersatz_pointgroup(spacegroup_name):
     """Guess the pointgroup for the spacegroup by mapping from short to
     long name, then taking 1st character from each block.
     """
+    from cctbx import sgtbx
+
     pg = (
         sgtbx.space_group_info(spacegroup_name)
         .group()
@@ -24,6 +23,9 @@ def spacegroup_to_lattice(input_spacegroup):
     the first letter of the cell type, changing to lowercase and then
     prepending it to the first letter of the spacegroup.
     """
+    from cctbx import sgtbx
+    from cctbx.sgtbx.bravais_types import bravais_lattice
+
     return str(bravais_lattice(group=sgtbx.space_group_info(input_spacegroup).group()))
 
 
@@ -31,6 +33,8 @@ def check_spacegroup_name(spacegroup_name):
     """Will return normalised name if spacegroup name is recognised,
     raise exception otherwise. For checking command-line options.
     """
+    from cctbx import sgtbx
+
     try:
         j = int(spacegroup_name)
         if j > 230 or j <= 0:
@@ -83,9 +87,18 @@ def constrain_cell(lattice_class, cell):
 
 def spacegroup_number_to_name(spg_num):
     """Convert a spacegroup number to a more readable name."""
+    from cctbx import sgtbx
+
     return sgtbx.space_group_info(number=spg_num).type().lookup_symbol()
 
 
+def spacegroup_name_to_number(spacegroup_name):
+    """Convert a spacegroup name to its number."""
+    from cctbx import sgtbx
+
+    return sgtbx.space_group_info(symbol=spacegroup_name).type().number()
+
+
 def lattice_to_spacegroup(lattice):
     """Converts a lattice to the spacegroup with the lowest symmetry
     possible for that lattice.
@@ -170,6 +183,8 @@ def generate_primitive_cell(unit_cell_constants, space_group_name):
     """For a given set of unit cell constants and space group, determine the
     corresponding primitive unit cell...
     """
+    from cctbx import crystal, sgtbx, uctbx
+
     uc = uctbx.unit_cell(unit_cell_constants)
     sg = sgtbx.space_group_info(space_group_name).group()
     cs = crystal.symmetry(unit_cell=uc, space_group=sg)
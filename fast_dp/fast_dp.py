@@ -19,18 +19,50 @@ from optparse import SUPPRESS_HELP, OptionParser
 import fast_dp
 import fast_dp.image_readers
 import fast_dp.output
-from fast_dp.autoindex import autoindex
+from fast_dp.autoindex import add_spot_range, autoindex
+from fast_dp.batch import batch_options, read_manifest, run_batch, strip_options
+from fast_dp.candidates import (
+    SpeculativeScale,
+    promote_sandbox,
+    scale_candidates,
+    write_candidates,
+)
 from fast_dp.cell_spacegroup import (
     check_spacegroup_name,
     check_split_cell,
     generate_primitive_cell,
 )
-from fast_dp.image_names import find_matching_images
+from fast_dp.follow import (
+    integrate_following,
+    set_follow_timeout,
+    wait_for_file,
+    wait_for_images,
+)
+from fast_dp.frame_stats import trim_images
+from fast_dp.image_names import image_index
 from fast_dp.integrate import integrate
-from fast_dp.logger import write
-from fast_dp.merge import merge
-from fast_dp.pointgroup import decide_pointgroup
-from fast_dp.scale import scale
+from fast_dp.logger import set_filename, write
+from fast_dp.merge import anomalous_signals, parse_aimless_log, run_aimless
+from fast_dp.metadata_cache import set_metadata_cache_directory
+from fast_dp.pointgroup import (
+    allowed_pointgroups,
+    likely_pointgroup,
+    p1_correct,
+    select_pointgroup,
+)
+from fast_dp.quick_stats import run_quick_stats
+from fast_dp.reflections import write_reflection_columns
+from fast_dp.registry import (
+    choose_layout,
+    detector_name,
+    predict_stages,
+    record_run,
+    set_registry,
+)
+from fast_dp.run_job import get_resource_usage, stop_jobs_on_signal
+from fast_dp.scale import scale, xdsstat
+from fast_dp.stages import Stage, completed_stages, run_stages
+from fast_dp.step_cache import get_cache_directory, set_cache_directory
 
 
 class FastDP:
@@ -81,6 +113,37 @@ class FastDP:
         self._nref = 0
         self._scaling_statistics = None
         self._refined_beam = (0, 0)
+        self._resource_usage = {}
+        self._aimless_summary = []
+        self._anomalous_signals = None
+
+        # pointgroups to try in parallel in scaling, and their results
+        self._n_candidates = 1
+        self._merge_candidates = False
+        self._candidates = []
+
+        # run the final CORRECT alongside pointless, guessing the pointgroup:
+        # this uses twice the cores for a while, so is only done if asked
+        self._speculate = False
+        self._speculation = None
+
+        # merging statistics straight from XDS_ASCII.HKL, ahead of Aimless
+        self._quick_stats = False
+
+        # leave dead or damaged images out of scaling, see frame_stats: the
+        # XDS input for CORRECT if different from that integrated
+        self._trim_images = True
+        self._correct_xds_inp = None
+
+        # process the images as they are written, integrating in chunks
+        self._follow = False
+        self._follow_chunk = 0
+
+        # predicted from earlier runs, see registry
+        self._predicted_integrate_time = None
+
+        # stages of process() which have finished, for --resume
+        self._completed_stages = []
 
     def set_n_jobs(self, n_jobs):
         self._n_jobs = n_jobs
@@ -91,6 +154,29 @@ class FastDP:
     def set_max_n_jobs(self, max_n_jobs):
         self._max_n_jobs = max_n_jobs
 
+    def set_follow(self, follow, chunk=0):
+        """Process while the images are being written, integrating in chunks
+        of chunk images (by default about 30 degrees).
+        """
+        self._follow = follow
+        self._follow_chunk = chunk
+
+    def set_trim_images(self, trim_images):
+        self._trim_images = trim_images
+
+    def set_quick_stats(self, quick_stats):
+        self._quick_stats = quick_stats
+
+    def set_speculate(self, speculate):
+        self._speculate = speculate
+
+    def set_n_candidates(self, n_candidates, merge=False):
+        """Scale in the top n_candidates allowed pointgroups concurrently,
+        merging each with Aimless too if merge is set.
+        """
+        self._n_candidates = n_candidates
+        self._merge_candidates = merge
+
     def set_execution_hosts(self, execution_hosts):
         self._execution_hosts = execution_hosts
         max_n_jobs = 0
@@ -121,8 +207,8 @@ class FastDP:
 
     def set_start_image(self, start_image):
         """Set the image to work from: in the majority of cases this will
-        be sufficient. This returns a list of image numbers which may be
-        missing.
+        be sufficient. See missing_images for checking the sequence is
+        complete.
         """
         assert self._start_image is None
 
@@ -139,16 +225,27 @@ class FastDP:
             self._start_image
         )
 
-        missing = []
-        # list image numbers which are missing from this sequence - iff ! h5
+    def missing_images(self):
+        """Return a list of the image numbers missing from this sequence
+        between the first and last images to process (none for HDF5).
+        """
         template = self._xds_inp["NAME_TEMPLATE_OF_DATA_FRAMES"]
-        if template.split(".")[-1] != "h5":
-            directory, template = os.path.split(template.replace("?", "#"))
-            matching = find_matching_images(template, directory)
-            every = set(range(min(matching), max(matching) + 1))
-            missing = sorted(every - set(matching))
+        if template.split(".")[-1] == "h5":
+            return []
+
+        directory, template = os.path.split(template.replace("?", "#"))
+        images = image_index(directory, template)
+        if not images:
+            return []
+
+        first = images.first
+        if self._first_image is not None:
+            first = max(first, self._first_image)
+        last = images.last
+        if self._last_image is not None:
+            last = min(last, self._last_image)
 
-        return missing
+        return images.missing(first, last)
 
     def set_beam(self, beam):
         """Set the beam centre, in mm, in the Mosflm reference frame."""
@@ -192,9 +289,9 @@ class FastDP:
             self._input_cell, self._input_spacegroup
         ).parameters()
 
-    def process(self):
-        """Main routine, chain together all of the steps imported from
-        autoindex, integrate, pointgroup, scale and merge.
+    def _prepare(self):
+        """Apply the image limits to the XDS input and decide the job
+        layout, writing out what will be processed.
         """
         write("Running on: %s" % str(os.getenv("HOSTNAME")).split(".")[0])
 
@@ -213,7 +310,10 @@ class FastDP:
             self._xds_inp["STARTING_ANGLE"] = str(osc_start)
             self._xds_inp["STARTING_FRAME"] = str(start)
 
-        if self._last_image is not None:
+        if self._follow and self._last_image is not None:
+            # the images up to the end may not have been written yet
+            end = self._last_image
+        elif self._last_image is not None:
             end = min(end, self._last_image)
 
         self._xds_inp["DATA_RANGE"] = f"{start} {end}"
@@ -231,13 +331,11 @@ class FastDP:
             n_jobs = int(round(frames / wedge))
             if self._max_n_jobs > 0 and n_jobs > self._max_n_jobs:
                 n_jobs = self._max_n_jobs
-            self.set_n_jobs(n_jobs)
+            self._choose_layout(frames, n_jobs)
 
         write("Number of jobs: %d" % self._n_jobs)
         write("Number of cores: %d" % self._n_cores)
 
-        step_time = time.time()
-
         write("Processing images: %d -> %d" % (start, end))
         osc_end = osc_start + (end - start + 1) * osc
         write(f"Rotation range: {osc_start:.2f} -> {osc_end:.2f}")
@@ -248,7 +346,146 @@ class FastDP:
         write("Wavelength: %.5f" % float(self._xds_inp["X-RAY_WAVELENGTH"]))
         write("Working in: %s" % os.getcwd())
 
+    def _choose_layout(self, frames, max_n_jobs):
+        """Choose the number of jobs (and cores per job, if not set) from the
+        history of earlier runs with this detector, or failing that use
+        max_n_jobs, i.e. one job per wedge of images. The history is of runs
+        on this machine alone, so is no guide with execution hosts.
+        """
+        if self._execution_hosts:
+            self.set_n_jobs(max_n_jobs)
+            return
+
+        layout = choose_layout(
+            detector_name(self._xds_inp),
+            frames,
+            max_n_jobs,
+            os.cpu_count() or 1,
+            n_cores=self._n_cores,
+        )
+        if layout is None:
+            self.set_n_jobs(max_n_jobs)
+            return
+
+        n_jobs, n_cores, predicted = layout
+        self.set_n_jobs(n_jobs)
+        self.set_n_cores(n_cores)
+        self._predicted_integrate_time = predicted
+
+    def plan(self):
+        """Print the job layout and predicted time for each stage, without
+        processing anything.
+        """
+        self._prepare()
+
+        start, end = map(int, self._xds_inp["DATA_RANGE"].split())
+        predicted = predict_stages(detector_name(self._xds_inp), end - start + 1)
+        if self._predicted_integrate_time is not None:
+            predicted["integrate"] = self._predicted_integrate_time
+
+        if not predicted:
+            write("No history for detector %s" % detector_name(self._xds_inp))
+            return
+
+        write("%20s %8s" % ("Stage", "Wall/s"))
+        for stage, wall_time in predicted.items():
+            write("%20s %8.1f" % (stage, wall_time))
+        write("%20s %8.1f" % ("Total", sum(predicted.values())))
+
+    def process(self):
+        """Main routine, chain together all of the steps imported from
+        autoindex, integrate, pointgroup, scale and merge.
+        """
+        self._prepare()
+
+        self._start_time = time.time()
+
+        # the pipeline as a graph: after CORRECT, xdsstat can run alongside
+        # merging, and the JSON and XML alongside one another
+
+        stages = [
+            Stage(
+                "autoindex",
+                self._run_autoindex,
+                outputs=["XPARM.XDS", "SPOT.XDS"],
+            ),
+            Stage(
+                "integrate",
+                self._run_integrate,
+                inputs=["XPARM.XDS"],
+                outputs=["INTEGRATE.HKL"],
+            ),
+            Stage(
+                "pointgroup",
+                self._run_pointgroup,
+                inputs=["INTEGRATE.HKL"],
+                outputs=["P1.LP", "XDS_P1.HKL", "pointless.xml"],
+            ),
+            Stage(
+                "scale",
+                self._run_scale,
+                inputs=["INTEGRATE.HKL"],
+                outputs=["XDS_ASCII.HKL", "GXPARM.XDS", "CORRECT.LP"],
+                after=["pointgroup"],
+            ),
+            Stage(
+                "xdsstat", xdsstat, inputs=["XDS_ASCII.HKL"], outputs=["xdsstat.log"]
+            ),
+            Stage(
+                "merge",
+                self._run_merge,
+                inputs=["XDS_ASCII.HKL"],
+                outputs=["fast_dp.mtz", "aimless.log"],
+            ),
+            Stage("anomalous", self._run_anomalous, inputs=["fast_dp.mtz"]),
+            # the column files are only a cache, so may not be written
+            Stage(
+                "columns",
+                write_reflection_columns,
+                inputs=["XDS_ASCII.HKL", "XDS_P1.HKL"],
+            ),
+            Stage("report", self._report, after=["merge", "anomalous", "xdsstat"]),
+            Stage("json", self._write_json, outputs=["fast_dp.json"], after=["report"]),
+            Stage("xml", self._write_xml, outputs=["fast_dp.xml"], after=["report"]),
+        ]
+
+        # the quick statistics are best effort, so there may be no file
+        if self._quick_stats:
+            stages.append(
+                Stage(
+                    "quick_stats",
+                    run_quick_stats,
+                    inputs=["XDS_ASCII.HKL"],
+                    after=["columns"],
+                )
+            )
+
+        # only trust the stages of an earlier run whose outputs are all there
+        self._completed_stages = completed_stages(stages, self._completed_stages)
+
+        run_stages(
+            stages,
+            completed=self._completed_stages,
+            on_complete=self._checkpoint,
+        )
+
+    def load_state(self, filename="fast_dp.state"):
+        """Reload the state written by an earlier run, to resume processing."""
+        with open(filename) as fh:
+            json_stuff = json.load(fh)
+
+        for prop in json_stuff:
+            setattr(self, prop, json_stuff[prop])
+
+    def _checkpoint(self, stage):
+        if stage not in self._completed_stages:
+            self._completed_stages.append(stage)
+        write_state(self)
+
+    def _run_autoindex(self):
         try:
+            if self._follow:
+                self._wait_for_spot_ranges()
             self._p1_unit_cell = autoindex(
                 self._xds_inp, input_cell=self._input_cell_p1
             )
@@ -256,45 +493,157 @@ class FastDP:
             write("Autoindexing failed")
             raise
 
+    def _wait_for_spot_ranges(self):
+        """Wait for the images autoindexing will use to be written."""
+        xds_inp = add_spot_range(copy.deepcopy(self._xds_inp))
+        last = max(
+            int(spot_range.split()[1])
+            for spot_range in xds_inp["SPOT_RANGE"]
+            + [self._xds_inp["BACKGROUND_RANGE"]]
+        )
+        write("Waiting for images up to %d" % last)
+        wait_for_images(self._xds_inp, last)
+
+    def _run_integrate(self):
+        self._correct_xds_inp = None
         try:
-            mosaics = integrate(
-                self._xds_inp,
-                self._p1_unit_cell,
-                self._resolution_low,
-                self._n_jobs,
-                self._n_cores,
-            )
+            if self._follow:
+                mosaics = self._integrate_following()
+            else:
+                mosaics = integrate(
+                    self._xds_inp,
+                    self._p1_unit_cell,
+                    self._resolution_low,
+                    self._n_jobs,
+                    self._n_cores,
+                )
             write("Mosaic spread: {:.2f} < {:.2f} < {:.2f}".format(*tuple(mosaics)))
         except RuntimeError:
             write("Integration failed")
             raise
 
+        # keeping the range integrated for the record, or to integrate again
+        if self._trim_images:
+            xds_inp = copy.deepcopy(self._xds_inp)
+            try:
+                if trim_images(xds_inp):
+                    self._correct_xds_inp = xds_inp
+            except (ImportError, KeyError, RuntimeError) as e:
+                write("Could not check the images for damage: %s" % e)
+
+    def _correct_inp(self):
+        """The XDS input for the CORRECT runs, leaving out any unusable
+        images found after integration.
+        """
+        return self._correct_xds_inp or self._xds_inp
+
+    def _integrate_following(self):
+        start, end = map(int, self._xds_inp["DATA_RANGE"].split())
+        osc = float(self._xds_inp["OSCILLATION_RANGE"])
+        chunk = self._follow_chunk or max(10, int(round(30.0 / osc)))
+
+        # share the jobs out between the chunks
+        n_jobs = max(1, int(round(self._n_jobs * chunk / (end - start + 1))))
+
+        return integrate_following(
+            self._xds_inp, self._resolution_low, n_jobs, self._n_cores, chunk
+        )
+
+    def _run_pointgroup(self):
         try:
-            metadata = copy.deepcopy(self._xds_inp)
+            metadata = copy.deepcopy(self._correct_inp())
 
-            cell, sg_num, resol = decide_pointgroup(
-                self._p1_unit_cell, metadata, input_spacegroup=self._input_spacegroup
-            )
-            self._unit_cell = cell
-            self._space_group_number = sg_num
+            results, resol = p1_correct(self._p1_unit_cell, metadata)
 
             if not self._resolution_high:
                 self._resolution_high = resol
+
+            if (
+                self._speculate
+                and self._n_candidates <= 1
+                and not self._input_spacegroup
+            ):
+                self._start_speculation(results)
+
+            cell, sg_num = select_pointgroup(
+                results, input_spacegroup=self._input_spacegroup
+            )
+            self._unit_cell = cell
+            self._space_group_number = sg_num
         except RuntimeError:
             write("Pointgroup determination failed")
             raise
 
-        try:
-            if self._params.get("atom", None):
-                self._xds_inp["FRIEDEL'S_LAW"] = "FALSE"
-            else:
-                self._xds_inp["FRIEDEL'S_LAW"] = "TRUE"
-            self._unit_cell, self._space_group, self._nref, beam_pixels = scale(
-                self._unit_cell,
-                self._xds_inp,
-                self._space_group_number,
-                self._resolution_high,
+    def _start_speculation(self, results):
+        """Start the final CORRECT in a sandbox, in the pointgroup pointless
+        is most likely to choose, while pointless is running.
+        """
+        space_group_number, unit_cell = likely_pointgroup(results)
+        xds_inp = copy.deepcopy(self._correct_inp())
+        self._set_friedels_law(xds_inp)
+        self._speculation = SpeculativeScale(
+            unit_cell,
+            xds_inp,
+            space_group_number,
+            self._resolution_high,
+            cache_directory=get_cache_directory(),
+        )
+
+    def _speculative_scale(self):
+        """Use the result of the speculative CORRECT if the guess was right,
+        else return None.
+        """
+        speculation = self._speculation
+        self._speculation = None
+
+        if not speculation.matches(
+            self._unit_cell, self._space_group_number, self._resolution_high
+        ):
+            write(
+                "Discarding speculative scaling in sg# %d"
+                % speculation.space_group_number
             )
+            speculation.discard()
+            return None
+
+        result = speculation.result()
+        if "error" in result:
+            write("Speculative scaling failed: %s" % result["error"])
+            return None
+
+        write("Using speculative scaling in sg# %d" % speculation.space_group_number)
+        promote_sandbox(result["directory"])
+
+        return (
+            result["unit_cell"],
+            result["space_group"],
+            result["nref"],
+            result["refined_beam"],
+        )
+
+    def _set_friedels_law(self, xds_inp):
+        if self._params.get("atom", None):
+            xds_inp["FRIEDEL'S_LAW"] = "FALSE"
+        else:
+            xds_inp["FRIEDEL'S_LAW"] = "TRUE"
+
+    def _run_scale(self):
+        try:
+            xds_inp = self._correct_inp()
+            self._set_friedels_law(xds_inp)
+            scaled = None
+            if self._speculation:
+                scaled = self._speculative_scale()
+            if scaled is None and self._n_candidates > 1 and not self._input_spacegroup:
+                scaled = self._scale_candidates()
+            elif scaled is None:
+                scaled = scale(
+                    self._unit_cell,
+                    xds_inp,
+                    self._space_group_number,
+                    self._resolution_high,
+                )
+            self._unit_cell, self._space_group, self._nref, beam_pixels = scaled
             self._refined_beam = (
                 beam_pixels[1] * float(self._xds_inp["QY"]),
                 beam_pixels[0] * float(self._xds_inp["QX"]),
@@ -303,12 +652,61 @@ class FastDP:
             write("Scaling failed")
             raise
 
+    def _scale_candidates(self):
+        """Scale in the chosen pointgroup and the next most likely allowed
+        ones at the same time, each in a sandbox, then promote the chosen
+        one (or the next most likely if that failed) to the main results.
+        """
+        candidates = [(self._space_group_number, self._unit_cell)]
+        for space_group_number, unit_cell in allowed_pointgroups():
+            if len(candidates) >= self._n_candidates:
+                break
+            if space_group_number != self._space_group_number:
+                candidates.append((space_group_number, unit_cell))
+
+        results = scale_candidates(
+            candidates,
+            self._correct_inp(),
+            self._resolution_high,
+            merge=self._merge_candidates,
+            cache_directory=get_cache_directory(),
+        )
+
+        write("Scaling candidates:")
+        write_candidates(results)
+        self._candidates = results
+
+        for result in results:
+            if "error" not in result:
+                break
+        else:
+            raise RuntimeError("scaling failed for all candidates")
+
+        write("Using results from: %s" % os.path.split(result["directory"])[-1])
+        promote_sandbox(result["directory"])
+
+        return (
+            result["unit_cell"],
+            result["space_group"],
+            result["nref"],
+            result["refined_beam"],
+        )
+
+    def _run_merge(self):
         try:
-            self._scaling_statistics = merge()
+            self._aimless_summary = run_aimless()
         except RuntimeError:
             write("Merging failed")
             raise
 
+    def _run_anomalous(self):
+        self._anomalous_signals = anomalous_signals("fast_dp.mtz")
+
+    def _report(self):
+        self._scaling_statistics = parse_aimless_log(
+            self._aimless_summary, anomalous=self._anomalous_signals
+        )
+
         write("Merging point group: %s" % self._space_group)
         write(
             "Unit cell: {:6.2f} {:6.2f} {:6.2f} {:6.2f} {:6.2f} {:6.2f}".format(
@@ -316,7 +714,7 @@ class FastDP:
             )
         )
 
-        duration = time.time() - step_time
+        duration = time.time() - self._start_time
         write(
             "Processing took %s (%d s) [%d reflections]"
             % (
@@ -327,16 +725,119 @@ class FastDP:
         )
         write("RPS: %.1f" % (float(self._nref) / duration))
 
-        # write out json and xml
-        for func in (fast_dp.output.write_json, fast_dp.output.write_ispyb_xml):
-            func(
-                self._commandline,
-                self._space_group,
-                self._unit_cell,
-                self._scaling_statistics,
-                self._start_image,
-                self._refined_beam,
-            )
+        self._resource_usage = get_resource_usage()
+        fast_dp.output.write_resource_usage(self._resource_usage)
+
+        # following, the time integrating includes waiting for the images,
+        # and with execution hosts it was not spent on this machine
+        if self._follow or self._execution_hosts:
+            return
+
+        start, end = map(int, self._xds_inp["DATA_RANGE"].split())
+        record_run(
+            detector_name(self._xds_inp),
+            end - start + 1,
+            self._n_jobs,
+            self._n_cores,
+            self._resource_usage,
+        )
+
+    def _write_json(self):
+        fast_dp.output.write_json(
+            self._commandline,
+            self._space_group,
+            self._unit_cell,
+            self._scaling_statistics,
+            self._start_image,
+            self._refined_beam,
+            resource_usage=self._resource_usage,
+            candidates=self._candidates or None,
+        )
+
+    def _write_xml(self):
+        fast_dp.output.write_ispyb_xml(
+            self._commandline,
+            self._space_group,
+            self._unit_cell,
+            self._scaling_statistics,
+            self._start_image,
+            self._refined_beam,
+        )
+
+
+def write_state(finst, filename="fast_dp.state"):
+    """Write the state of finst, replacing filename atomically so that an
+    interrupted run always leaves a complete file behind.
+    """
+    json_stuff = {}
+    for prop in dir(finst):
+        ignore = ["_speculation"]
+        if not prop.startswith("_") or prop.startswith("__"):
+            continue
+        if prop in ignore:
+            continue
+        if callable(getattr(finst, prop)):
+            continue
+        json_stuff[prop] = getattr(finst, prop)
+    with open(filename + ".tmp", "w") as fh:
+        json.dump(json_stuff, fh)
+    os.replace(filename + ".tmp", filename)
+
+
+def resume():
+    """Pick up an interrupted fast_dp run in the current directory from the
+    last checkpoint in fast_dp.state, repeating only the stages which did
+    not finish or whose output files have gone.
+    """
+    set_filename("fast_dp.log", append=True)
+    stop_jobs_on_signal()
+
+    try:
+        write("Fast_DP version %s" % fast_dp.__version__)
+        finst = FastDP()
+        finst.load_state()
+        if finst._completed_stages:
+            write("Resuming after: %s" % " ".join(finst._completed_stages))
+        finst.process()
+
+    except Exception as e:
+        with open("fast_dp.error", "w") as fh:
+            traceback.print_exc(file=fh)
+        write("Fast DP error: %s" % str(e))
+        sys.exit(1)
+
+    finally:
+        write_state(finst)
+
+
+def batch(manifest, arguments, max_cores, max_jobs):
+    """Process each of the datasets in manifest with the fast_dp options in
+    arguments as defaults, within max_cores cores and max_jobs XDS jobs.
+    """
+    set_filename("fast_dp_batch.log")
+
+    try:
+        write("Fast_DP version %s" % fast_dp.__version__)
+        datasets = read_manifest(
+            manifest,
+            defaults=strip_options(arguments, batch_options),
+            cores_per_job=min(4, max_cores),
+        )
+        write(
+            "Processing %d datasets with %d cores and %d XDS jobs"
+            % (len(datasets), max_cores, max_jobs)
+        )
+        n_failed = run_batch(datasets, max_cores, max_jobs)
+
+    except Exception as e:
+        with open("fast_dp_batch.error", "w") as fh:
+            traceback.print_exc(file=fh)
+        write("Fast DP error: %s" % str(e))
+        sys.exit(1)
+
+    if n_failed:
+        write("%d of %d datasets failed" % (n_failed, len(datasets)))
+        sys.exit(1)
 
 
 def main():
@@ -379,6 +880,16 @@ def main():
         dest="execution_hosts",
         help="names for execution hosts for forkxds",
     )
+    parser.add_option(
+        "--worker-spool",
+        dest="worker_spool",
+        help="Spool directory of fast_dp-worker agents to run forkxds tasks",
+    )
+    parser.add_option(
+        "--straggler-factor",
+        dest="straggler_factor",
+        help="Duplicate forkxds tasks taking this many times the median",
+    )
 
     parser.add_option(
         "-c",
@@ -414,6 +925,122 @@ def main():
         help="HDF5 reader library (i.e. neggia etc.)",
     )
 
+    parser.add_option(
+        "--no-metadata-cache",
+        dest="metadata_cache",
+        action="store_false",
+        default=True,
+        help="Always read the image metadata from the images",
+    )
+
+    parser.add_option(
+        "--scale-candidates",
+        dest="scale_candidates",
+        help="Number of most likely pointgroups to scale in parallel",
+    )
+    parser.add_option(
+        "--merge-candidates",
+        dest="merge_candidates",
+        action="store_true",
+        default=False,
+        help="Also merge each of the scaling candidates with Aimless",
+    )
+
+    parser.add_option(
+        "--speculate",
+        dest="speculate",
+        action="store_true",
+        default=False,
+        help="Start the final CORRECT before pointless has finished",
+    )
+
+    parser.add_option(
+        "--no-trim-images",
+        dest="trim_images",
+        action="store_false",
+        default=True,
+        help="Scale every image, even those which look dead or damaged",
+    )
+
+    parser.add_option(
+        "--quick-stats",
+        dest="quick_stats",
+        action="store_true",
+        default=False,
+        help="Compute merging statistics from XDS_ASCII.HKL before Aimless",
+    )
+
+    parser.add_option(
+        "--cache-directory",
+        dest="cache_directory",
+        help="Directory to cache autoindexing, integration and scaling results",
+    )
+    parser.add_option(
+        "--cache-size",
+        dest="cache_size",
+        default="10",
+        help="Maximum size of the results cache (GB)",
+    )
+
+    parser.add_option(
+        "--follow",
+        dest="follow",
+        action="store_true",
+        default=False,
+        help="Process while the images are being written (needs -N for CBF)",
+    )
+    parser.add_option(
+        "--follow-chunk",
+        dest="follow_chunk",
+        default="0",
+        help="Images to integrate at a time with --follow",
+    )
+    parser.add_option(
+        "--follow-timeout",
+        dest="follow_timeout",
+        default="600",
+        help="Seconds to wait for new images with --follow",
+    )
+
+    parser.add_option(
+        "--plan",
+        dest="plan",
+        action="store_true",
+        default=False,
+        help="Print the job layout and predicted times, then stop",
+    )
+    parser.add_option(
+        "--no-registry",
+        dest="registry",
+        action="store_false",
+        default=True,
+        help="Do not record this run, or use earlier runs to choose jobs",
+    )
+
+    parser.add_option(
+        "--resume",
+        dest="resume",
+        action="store_true",
+        default=False,
+        help="Resume an interrupted run in the current directory",
+    )
+
+    parser.add_option(
+        "--batch",
+        dest="batch",
+        help="Process each dataset listed in this manifest, see fast_dp.batch",
+    )
+    parser.add_option(
+        "--batch-cores",
+        dest="batch_cores",
+        help="Cores to share between the datasets with --batch (default all)",
+    )
+    parser.add_option(
+        "--batch-jobs",
+        dest="batch_jobs",
+        help="XDS jobs to run at once with --batch (default one per core)",
+    )
+
     parser.add_option(
         "--version",
         dest="version",
@@ -428,6 +1055,26 @@ def main():
         print("Fast_DP version %s" % fast_dp.__version__)
         sys.exit(0)
 
+    # XDS and the rest run in sessions of their own, so are not sent the
+    # signals fast_dp is
+    stop_jobs_on_signal()
+
+    if options.resume:
+        if args:
+            parser.error("--resume works from fast_dp.state: give no image")
+        resume()
+        return
+
+    if options.batch:
+        if args:
+            parser.error("--batch takes the images from the manifest: give none")
+        max_cores = int(options.batch_cores or os.cpu_count() or 1)
+        max_jobs = int(options.batch_jobs or max_cores)
+        if max_cores < 1 or max_jobs < 1:
+            parser.error("--batch-cores and --batch-jobs must be at least 1")
+        batch(options.batch, sys.argv[1:], max_cores, max_jobs)
+        return
+
     if len(args) != 1:
         parser.error("You must point to one image of the dataset to process")
 
@@ -448,12 +1095,36 @@ def main():
     if options.lib_name:
         fast_dp.image_readers.set_lib_name(options.lib_name)
 
+    if not options.metadata_cache:
+        set_metadata_cache_directory(None)
+
+    if not options.registry:
+        set_registry(None)
+
+    if options.worker_spool:
+        # picked up by fast_dp-forkxds, when XDS is set up to use it
+        os.environ["FORKXDS_SPOOL"] = os.path.abspath(options.worker_spool)
+
+    if options.straggler_factor:
+        os.environ["FORKXDS_STRAGGLER_FACTOR"] = options.straggler_factor
+
+    if options.cache_directory:
+        set_cache_directory(
+            options.cache_directory, int(float(options.cache_size) * 1024**3)
+        )
+
     try:
         write("Fast_DP version %s" % fast_dp.__version__)
         finst = FastDP()
         finst._commandline = commandline
         write("Starting image: %s" % image)
-        missing = finst.set_start_image(image)
+        if options.follow:
+            set_follow_timeout(float(options.follow_timeout))
+            wait_for_file(image)
+            if not image.endswith(".h5") and not options.last_image:
+                raise RuntimeError("--follow needs the last image (-N)")
+            finst.set_follow(True, chunk=int(options.follow_chunk))
+        finst.set_start_image(image)
         if options.beam:
             x, y = tuple(map(float, options.beam.split(",")))
             finst.set_beam((x, y))
@@ -484,16 +1155,29 @@ def main():
             n_cores = int(options.number_of_cores)
             finst.set_n_cores(n_cores)
 
+        if options.speculate:
+            finst.set_speculate(True)
+
+        if options.quick_stats:
+            finst.set_quick_stats(True)
+
+        if not options.trim_images:
+            finst.set_trim_images(False)
+
+        if options.scale_candidates:
+            finst.set_n_candidates(
+                int(options.scale_candidates), merge=options.merge_candidates
+            )
+
         if options.first_image:
             first_image = int(options.first_image)
-            missing = [m for m in missing if m >= first_image]
             finst.set_first_image(first_image)
 
         if options.last_image:
             last_image = int(options.last_image)
-            missing = [m for m in missing if m <= last_image]
             finst.set_last_image(last_image)
 
+        missing = [] if options.follow else finst.missing_images()
         if missing:
             raise RuntimeError("images missing: %s" % " ".join(map(str, missing)))
 
@@ -520,7 +1204,10 @@ def main():
             write("Set cell: {:.2f} {:.2f} {:.2f} {:.2f} {:.2f} {:.2f}".format(*cell))
             finst.set_input_cell(cell)
 
-        finst.process()
+        if options.plan:
+            finst.plan()
+        else:
+            finst.process()
 
     except Exception as e:
         with open("fast_dp.error", "w") as fh:
@@ -529,16 +1216,7 @@ def main():
         sys.exit(1)
 
     finally:
-        json_stuff = {}
-        for prop in dir(finst):
-            ignore = []
-            if not prop.startswith("_") or prop.startswith("__"):
-                continue
-            if prop in ignore:
-                continue
-            json_stuff[prop] = getattr(finst, prop)
-        with open("fast_dp.state", "w") as fh:
-            json.dump(json_stuff, fh)
+        write_state(finst)
 
 
 if __name__ == "__main__":
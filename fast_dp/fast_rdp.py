@@ -14,15 +14,26 @@ import traceback
 
 import fast_dp
 import fast_dp.output
+from fast_dp.candidates import scale_in_sandboxes, write_candidates
 from fast_dp.cell_spacegroup import (
     check_spacegroup_name,
     check_split_cell,
     generate_primitive_cell,
+    spacegroup_name_to_number,
 )
 from fast_dp.logger import set_filename, write
-from fast_dp.merge import merge
-from fast_dp.pointgroup import decide_pointgroup
-from fast_dp.scale import scale
+from fast_dp.merge import anomalous_signals, parse_aimless_log, run_aimless
+from fast_dp.pointgroup import (
+    p1_correct,
+    p1_correct_current,
+    reuse_p1_correct,
+    select_pointgroup,
+)
+from fast_dp.quick_stats import run_quick_stats
+from fast_dp.reflections import write_reflection_columns
+from fast_dp.run_job import get_resource_usage, stop_jobs_on_signal
+from fast_dp.scale import scale, xdsstat
+from fast_dp.stages import Stage, run_stages
 
 set_filename("fast_rdp.log")
 
@@ -34,6 +45,9 @@ class FastRDP:
     """
 
     def __init__(self) -> None:
+        # as for the original run, unless set there or on the command line
+        self._quick_stats = False
+
         with open("fast_dp.state") as fh:
             json_stuff = json.load(fh)
 
@@ -45,6 +59,15 @@ class FastRDP:
                 continue
             setattr(self, prop, json_stuff[prop])
 
+        # only CORRECT is run again, so leave out the images fast_dp did
+        if getattr(self, "_correct_xds_inp", None):
+            self._xds_inp = self._correct_xds_inp
+
+        # values to try in parallel in place of a single reprocessing
+        self._resolution_sweep = []
+        self._spacegroup_sweep = []
+        self._sweep_workers = 4
+
     def set_first_image(self, first_image):
         self._first_image = first_image
 
@@ -65,6 +88,18 @@ class FastRDP:
         else:
             self._params["atom"] = atom
 
+    def set_quick_stats(self, quick_stats):
+        self._quick_stats = quick_stats
+
+    def set_resolution_sweep(self, resolutions):
+        self._resolution_sweep = resolutions
+
+    def set_spacegroup_sweep(self, spacegroups):
+        self._spacegroup_sweep = spacegroups
+
+    def set_sweep_workers(self, sweep_workers):
+        self._sweep_workers = sweep_workers
+
     # N.B. these two methods assume that the input unit cell etc.
     # has already been tested at the option parsing stage...
 
@@ -110,8 +145,6 @@ class FastRDP:
 
         self._xds_inp["DATA_RANGE"] = f"{start} {end}"
 
-        step_time = time.time()
-
         write("Processing images: %d -> %d" % (start, end))
 
         osc_end = osc_start + (end - start + 1) * osc
@@ -153,11 +186,79 @@ class FastRDP:
                 )
             )
 
+        # the P1 CORRECT and pointless only depend on the frames and geometry,
+        # so if only the resolution, atom or symmetry have changed the
+        # previous results can be used again
+
+        self._reuse_p1_correct = p1_correct_current(self._p1_unit_cell, self._xds_inp)
+        if self._reuse_p1_correct:
+            write("Reusing P1 scaling and pointless results")
+
+        self._start_time = time.time()
+
+        pointgroup = Stage(
+            "pointgroup",
+            self._run_pointgroup,
+            inputs=["INTEGRATE.HKL"],
+            outputs=["P1.LP", "XDS_P1.HKL", "pointless.xml"],
+        )
+
+        if self._resolution_sweep or self._spacegroup_sweep:
+            run_stages(
+                [pointgroup, Stage("sweep", self._run_sweep, after=["pointgroup"])]
+            )
+            return
+
+        run_stages(
+            [
+                pointgroup,
+                Stage(
+                    "scale",
+                    self._run_scale,
+                    inputs=["INTEGRATE.HKL"],
+                    outputs=["XDS_ASCII.HKL", "GXPARM.XDS", "CORRECT.LP"],
+                    after=["pointgroup"],
+                ),
+                Stage("xdsstat", xdsstat, inputs=["XDS_ASCII.HKL"]),
+                Stage(
+                    "merge",
+                    self._run_merge,
+                    inputs=["XDS_ASCII.HKL"],
+                    outputs=["fast_rdp.mtz", "aimless_rerun.log"],
+                ),
+                Stage("anomalous", self._run_anomalous, inputs=["fast_rdp.mtz"]),
+                # the column files are only a cache, so may not be written
+                Stage(
+                    "columns",
+                    write_reflection_columns,
+                    inputs=["XDS_ASCII.HKL", "XDS_P1.HKL"],
+                ),
+                Stage(
+                    "quick_stats",
+                    self._run_quick_stats,
+                    inputs=["XDS_ASCII.HKL"],
+                    after=["columns"],
+                ),
+                Stage("report", self._report, after=["merge", "anomalous", "xdsstat"]),
+                Stage("json", self._write_json, after=["report"]),
+                Stage("xml", self._write_xml, after=["report"]),
+            ]
+        )
+
+    def _run_pointgroup(self):
         try:
-            metadata = copy.deepcopy(self._xds_inp)
+            if self._reuse_p1_correct:
+                results, resol = reuse_p1_correct()
+            else:
+                metadata = copy.deepcopy(self._xds_inp)
+                results, resol = p1_correct(self._p1_unit_cell, metadata)
 
-            cell, sg_num, resol = decide_pointgroup(
-                self._p1_unit_cell, metadata, input_spacegroup=self._input_spacegroup
+            self._p1_results = results
+
+            cell, sg_num = select_pointgroup(
+                results,
+                input_spacegroup=self._input_spacegroup,
+                run_pointless=not self._reuse_p1_correct,
             )
             self._unit_cell = cell
             self._space_group_number = sg_num
@@ -169,11 +270,15 @@ class FastRDP:
             write("Pointgroup determination failed")
             raise
 
+    def _set_friedels_law(self):
+        if self._params.get("atom", None):
+            self._xds_inp["FRIEDEL'S_LAW"] = "FALSE"
+        else:
+            self._xds_inp["FRIEDEL'S_LAW"] = "TRUE"
+
+    def _run_scale(self):
         try:
-            if self._params.get("atom", None):
-                self._xds_inp["FRIEDEL'S_LAW"] = "FALSE"
-            else:
-                self._xds_inp["FRIEDEL'S_LAW"] = "TRUE"
+            self._set_friedels_law()
             self._unit_cell, self._space_group, self._nref, beam_pixels = scale(
                 self._unit_cell,
                 self._xds_inp,
@@ -189,14 +294,101 @@ class FastRDP:
             write("Scaling failed")
             raise
 
+    def _run_sweep(self):
+        """Scale and merge for each of the values in the sweep at the same
+        time, each in its own directory, then write out a comparison table
+        and the results for each as fast_rdp.json in the directory.
+        """
+        self._set_friedels_law()
+
+        jobs = []
+        for resolution_high in self._resolution_sweep:
+            jobs.append(
+                (
+                    "sweep_r%.2f" % resolution_high,
+                    self._unit_cell,
+                    self._space_group_number,
+                    resolution_high,
+                )
+            )
+        for spacegroup in self._spacegroup_sweep:
+            # the space group only has to fit a pointgroup pointless found,
+            # but is scaled as itself, not that pointgroup
+            try:
+                unit_cell, _ = select_pointgroup(
+                    self._p1_results,
+                    input_spacegroup=spacegroup,
+                    run_pointless=False,
+                    strict=True,
+                )
+            except RuntimeError as e:
+                write("Not sweeping %s: %s" % (spacegroup, e))
+                continue
+            jobs.append(
+                (
+                    "sweep_%s" % spacegroup.replace(" ", ""),
+                    unit_cell,
+                    spacegroup_name_to_number(spacegroup),
+                    self._resolution_high,
+                )
+            )
+
+        if not jobs:
+            raise RuntimeError("no spacegroup in the sweep fits the lattice")
+
+        results = scale_in_sandboxes(
+            jobs, self._xds_inp, merge=True, max_workers=self._sweep_workers
+        )
+
+        write_candidates(results)
+
+        for result in results:
+            if "error" in result:
+                continue
+            beam_pixels = result["refined_beam"]
+            refined_beam = (
+                beam_pixels[1] * float(self._xds_inp["QY"]),
+                beam_pixels[0] * float(self._xds_inp["QX"]),
+            )
+            fast_dp.output.write_json(
+                self._commandline,
+                result["space_group"],
+                result["unit_cell"],
+                result["scaling_statistics"],
+                self._start_image,
+                refined_beam,
+                filename=os.path.join(result["directory"], "fast_rdp.json"),
+            )
+
+        duration = time.time() - self._start_time
+        write(
+            "Reprocessing took %s (%d s)"
+            % (time.strftime("%Hh %Mm %Ss", time.gmtime(duration)), duration)
+        )
+
+        fast_dp.output.write_resource_usage(get_resource_usage())
+
+    def _run_merge(self):
         try:
-            self._scaling_statistics = merge(
+            self._aimless_summary = run_aimless(
                 hklout="fast_rdp.mtz", aimless_log="aimless_rerun.log"
             )
         except RuntimeError:
             write("Merging failed")
             raise
 
+    def _run_quick_stats(self):
+        if self._quick_stats:
+            run_quick_stats()
+
+    def _run_anomalous(self):
+        self._anomalous_signals = anomalous_signals("fast_rdp.mtz")
+
+    def _report(self):
+        self._scaling_statistics = parse_aimless_log(
+            self._aimless_summary, anomalous=self._anomalous_signals
+        )
+
         write("Merging point group: %s" % self._space_group)
         write(
             "Unit cell: {:6.2f} {:6.2f} {:6.2f} {:6.2f} {:6.2f} {:6.2f}".format(
@@ -204,7 +396,7 @@ class FastRDP:
             )
         )
 
-        duration = time.time() - step_time
+        duration = time.time() - self._start_time
         write(
             "Reprocessing took %s (%d s) [%d reflections]"
             % (
@@ -214,20 +406,31 @@ class FastRDP:
             )
         )
 
-        # write out json and xml
-        for func, filename in [
-            (fast_dp.output.write_json, "fast_rdp.json"),
-            (fast_dp.output.write_ispyb_xml, "fast_rdp.xml"),
-        ]:
-            func(
-                self._commandline,
-                self._space_group,
-                self._unit_cell,
-                self._scaling_statistics,
-                self._start_image,
-                self._refined_beam,
-                filename=filename,
-            )
+        self._resource_usage = get_resource_usage()
+        fast_dp.output.write_resource_usage(self._resource_usage)
+
+    def _write_json(self):
+        fast_dp.output.write_json(
+            self._commandline,
+            self._space_group,
+            self._unit_cell,
+            self._scaling_statistics,
+            self._start_image,
+            self._refined_beam,
+            filename="fast_rdp.json",
+            resource_usage=self._resource_usage,
+        )
+
+    def _write_xml(self):
+        fast_dp.output.write_ispyb_xml(
+            self._commandline,
+            self._space_group,
+            self._unit_cell,
+            self._scaling_statistics,
+            self._start_image,
+            self._refined_beam,
+            filename="fast_rdp.xml",
+        )
 
 
 def main():
@@ -267,6 +470,31 @@ def main():
         "-R", "--resolution-low", dest="resolution_low", help="Low resolution limit"
     )
 
+    parser.add_option(
+        "--resolution-sweep",
+        dest="resolution_sweep",
+        help="High resolution limits to compare, e.g. 1.6,1.8,2.0",
+    )
+    parser.add_option(
+        "--spacegroup-sweep",
+        dest="spacegroup_sweep",
+        help="Spacegroups to compare, e.g. P222,P212121",
+    )
+    parser.add_option(
+        "--sweep-workers",
+        dest="sweep_workers",
+        default="4",
+        help="Number of sweep values to process at once",
+    )
+
+    parser.add_option(
+        "--quick-stats",
+        dest="quick_stats",
+        action="store_true",
+        default=False,
+        help="Compute merging statistics from XDS_ASCII.HKL before Aimless",
+    )
+
     parser.add_option(
         "--version",
         dest="version",
@@ -300,6 +528,8 @@ def main():
     else:
         from_dir = None
 
+    stop_jobs_on_signal()
+
     try:
         write("Fast_RDP version %s" % fast_dp.__version__)
         fast_rdp = FastRDP()
@@ -342,6 +572,28 @@ def main():
             write("Set cell: {:.2f} {:.2f} {:.2f} {:.2f} {:.2f} {:.2f}".format(*cell))
             fast_rdp.set_input_cell(cell)
 
+        if options.resolution_sweep:
+            if options.resolution_high:
+                raise RuntimeError("cannot use -r with --resolution-sweep")
+            fast_rdp.set_resolution_sweep(
+                [float(r) for r in options.resolution_sweep.split(",")]
+            )
+
+        if options.spacegroup_sweep:
+            if options.spacegroup:
+                raise RuntimeError("cannot use -s with --spacegroup-sweep")
+            fast_rdp.set_spacegroup_sweep(
+                [
+                    check_spacegroup_name(spacegroup)
+                    for spacegroup in options.spacegroup_sweep.split(",")
+                ]
+            )
+
+        fast_rdp.set_sweep_workers(int(options.sweep_workers))
+
+        if options.quick_stats:
+            fast_rdp.set_quick_stats(True)
+
         fast_rdp.reprocess()
 
     except Exception as e:
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import concurrent.futures
+import os
+import time
+
+from fast_dp.candidates import make_sandbox
+from fast_dp.image_names import image_index
+from fast_dp.integrate import defpix, integrate_chunk, merge_integrate_hkl
+from fast_dp.logger import write
+
+# processing while the images are still being written: images are
+# assumed complete once they appear, as detector file writers write to a
+# temporary name and rename
+
+__poll_interval = 1.0
+__timeout = 600.0
+
+
+def set_follow_timeout(timeout, poll_interval=1.0):
+    """Give up if no new images appear for timeout seconds, looking every
+    poll_interval seconds.
+    """
+    global __timeout, __poll_interval
+    __timeout = timeout
+    __poll_interval = poll_interval
+
+
+def _hdf5_images(master):
+    """Count the images in the data files of master which have been written
+    so far.
+    """
+    try:
+        import h5py
+    except ImportError:
+        raise RuntimeError("following HDF5 data needs h5py")
+
+    images = 0
+    with h5py.File(master, "r") as fin:
+        data = fin["/entry/data"]
+        for name in sorted(data):
+            link = data.get(name, getlink=True)
+            if isinstance(link, h5py.ExternalLink) and not os.path.exists(
+                os.path.join(os.path.dirname(master), link.filename)
+            ):
+                break
+            try:
+                images += data[name].shape[0]
+            except (KeyError, OSError):
+                break
+
+    return images
+
+
+def images_available(xds_inp):
+    """Return the last image number up to which every image from the start
+    of DATA_RANGE is on disk.
+    """
+    template = xds_inp["NAME_TEMPLATE_OF_DATA_FRAMES"]
+    start = int(xds_inp["DATA_RANGE"].split()[0])
+
+    if template.endswith(".h5"):
+        return start - 1 + _hdf5_images(template)
+
+    directory, template = os.path.split(template.replace("?", "#"))
+    images = image_index(directory, template, refresh=True)
+    if not images:
+        return start - 1
+
+    return images.contiguous(start)
+
+
+def wait_for_images(xds_inp, last):
+    """Wait until all of the images up to last are on disk, raising a
+    RuntimeError if none arrive for the timeout. Returns the last image
+    available, which may be beyond last.
+    """
+    available = images_available(xds_inp)
+    progress = time.time()
+
+    while available < last:
+        if time.time() - progress > __timeout:
+            raise RuntimeError(
+                "timed out waiting for image %d (have up to %d)" % (last, available)
+            )
+        time.sleep(__poll_interval)
+        now_available = images_available(xds_inp)
+        if now_available > available:
+            available = now_available
+            progress = time.time()
+
+    return available
+
+
+def wait_for_file(filename):
+    """Wait for filename to appear, e.g. the first image or master file."""
+    progress = time.time()
+    while not os.path.exists(filename):
+        if time.time() - progress > __timeout:
+            raise RuntimeError("timed out waiting for %s" % filename)
+        time.sleep(__poll_interval)
+
+
+def integrate_following(
+    xds_inp, resolution_low, n_jobs, n_processors, chunk, max_workers=2
+):
+    """Integrate DATA_RANGE in chunks of images, starting each as soon as
+    its images have been written and running up to max_workers at once,
+    then join the results as if they had been integrated together. Needs
+    the results of autoindexing in the working directory. Returns the
+    minimum, mean and maximum mosaic spread.
+    """
+    start, end = map(int, xds_inp["DATA_RANGE"].split())
+
+    defpix(xds_inp, resolution_low, n_processors)
+
+    chunks = []
+    first = start
+    while first <= end:
+        last = min(first + chunk - 1, end)
+        # fold a short last chunk into the one before
+        if end - last < chunk // 2:
+            last = end
+        chunks.append((first, last))
+        first = last + 1
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = []
+        for first, last in chunks:
+            wait_for_images(xds_inp, last)
+            write("Integrating images %d -> %d" % (first, last))
+            directory = make_sandbox("integrate_%d_%d" % (first, last))
+            futures.append(
+                pool.submit(
+                    integrate_chunk,
+                    xds_inp,
+                    resolution_low,
+                    n_jobs,
+                    n_processors,
+                    first,
+                    last,
+                    directory,
+                )
+            )
+        mosaics = []
+        for future in futures:
+            mosaics.extend(future.result())
+
+    directories = ["integrate_%d_%d" % (first, last) for first, last in chunks]
+
+    merge_integrate_hkl(
+        [os.path.join(directory, "INTEGRATE.HKL") for directory in directories],
+        start,
+        end,
+    )
+
+    with open("INTEGRATE.LP", "w") as fout:
+        for directory in directories:
+            with open(os.path.join(directory, "INTEGRATE.LP")) as fin:
+                fout.write(fin.read())
+
+    return min(mosaics), sum(mosaics) / len(mosaics), max(mosaics)
@@ -0,0 +1,521 @@
+#!/usr/bin/env python
+# forkxds.py
+#
+# A replacement for the forkxds script which XDS calls to run the COLSPOT
+# and INTEGRATE tasks in parallel, as
+#
+#   forkxds ntask maxcpu main [rhosts]
+#
+# running the tasks in a pool of slots - by default sized to the cores on
+# this machine, else host:N gives N slots on host - with each task handed
+# to whichever slot is next free, so a slow host takes fewer tasks. Tasks
+# run locally are pinned to their own set of maxcpu cores, within one NUMA
+# node where possible, others run over ssh as before. The time taken and
+# exit status of each are recorded in forkxds_main.json. Installed as
+# fast_dp-forkxds: link this to forkxds somewhere ahead of the XDS
+# installation in the PATH to use it. Options passed through environment:
+#
+# FORKXDS_MAX_TASKS - run at most this many tasks at once
+# FORKXDS_MEMORY_LIMIT - limit the address space of local tasks, in MB
+# FORKXDS_RSH - command to run tasks on other hosts, default ssh -x
+# FORKXDS_SPOOL - hand the tasks to the fast_dp-worker agents serving this
+#                 spool directory instead (see worker_pool.py)
+# FORKXDS_SPOOL_TIMEOUT - run tasks not taken by an agent in this many
+#                         seconds here, default 60
+# FORKXDS_RETRIES - run a failed task again up to this many times, default 2
+# FORKXDS_STRAGGLER_FACTOR - once all tasks are started, duplicate any
+#                            taking this many times the median, and keep
+#                            the first copy to finish
+from __future__ import annotations
+
+import glob
+import json
+import os
+import resource
+import shlex
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from fast_dp.lp_parser import lp_error
+
+
+def parse_cpulist(cpulist):
+    """Parse a Linux cpu list e.g. 0-3,8-11 to a list of cpu numbers."""
+    cpus = []
+    for token in cpulist.strip().split(","):
+        if not token:
+            continue
+        if "-" in token:
+            first, last = map(int, token.split("-"))
+            cpus.extend(range(first, last + 1))
+        else:
+            cpus.append(int(token))
+    return cpus
+
+
+def numa_nodes(available):
+    """Group the available cpus by NUMA node, as far as the topology is
+    visible in /sys, else as one node.
+    """
+    nodes = []
+    for node in sorted(
+        glob.glob("/sys/devices/system/node/node[0-9]*"),
+        key=lambda node: int(node.split("node")[-1]),
+    ):
+        try:
+            with open(os.path.join(node, "cpulist")) as fh:
+                cpus = [cpu for cpu in parse_cpulist(fh.read()) if cpu in available]
+        except OSError:
+            continue
+        if cpus:
+            nodes.append(cpus)
+
+    # any not accounted for, or no topology at all
+    seen = {cpu for node in nodes for cpu in node}
+    rest = sorted(cpu for cpu in available if cpu not in seen)
+    if rest:
+        nodes.append(rest)
+
+    return nodes
+
+
+def cpu_slots(nodes, maxcpu):
+    """Divide the cpus in nodes into disjoint sets of maxcpu, each within
+    one node where possible, with the remainders from each node pooled.
+    """
+    slots = []
+    spare = []
+    for node in nodes:
+        for j in range(0, len(node) - maxcpu + 1, maxcpu):
+            slots.append(node[j : j + maxcpu])
+        spare.extend(node[len(node) - len(node) % maxcpu :])
+    for j in range(0, len(spare) - maxcpu + 1, maxcpu):
+        slots.append(spare[j : j + maxcpu])
+
+    # fewer cores than asked for per task: run one task on all of them
+    if not slots:
+        slots.append(sorted(cpu for node in nodes for cpu in node))
+
+    return slots
+
+
+def is_local(host):
+    """Whether host is this machine, so tasks can be run without ssh."""
+    hostname = socket.gethostname()
+    return host in ("localhost", hostname, hostname.split(".")[0])
+
+
+def local_slots(maxcpu):
+    """The sets of cpus on this machine to run tasks on."""
+    if hasattr(os, "sched_getaffinity"):
+        available = set(os.sched_getaffinity(0))
+        return cpu_slots(numa_nodes(available), max(1, maxcpu))
+    return [None] * max(1, (os.cpu_count() or 1) // max(1, maxcpu))
+
+
+def host_slots(hosts, maxcpu):
+    """Parse hosts as host or host:N for N slots on host, as for
+    CLUSTER_NODES, returning a list of (host, cpus): host None for this
+    machine, where cpus are those to pin the task to. With no hosts this
+    machine has one slot per maxcpu cores. The slots are ordered round the
+    hosts, so the first tasks are spread out over all of them.
+    """
+    cpus = local_slots(maxcpu)
+
+    if not hosts:
+        return [(None, slot) for slot in cpus]
+
+    per_host = []
+    for token in hosts:
+        host, _, n = token.partition(":")
+        if is_local(host):
+            per_host.append(
+                [(None, cpus.pop(0) if cpus else None) for j in range(int(n or 1))]
+            )
+        else:
+            per_host.append([(host, None)] * int(n or 1))
+
+    slots = []
+    for j in range(max(map(len, per_host))):
+        slots.extend(host[j] for host in per_host if j < len(host))
+    return slots
+
+
+def preexec(cpus, memory_limit=0):
+    """Return a function to pin a task to cpus and limit its memory (MB)."""
+
+    def setup():
+        if cpus is not None:
+            os.sched_setaffinity(0, cpus)
+        if memory_limit:
+            limit = memory_limit * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    return setup
+
+
+# the files read by the tasks of each step, by the program XDS runs for it
+_task_inputs = {
+    "mcolspot": [
+        "XDS.INP",
+        "X-CORRECTIONS.cbf",
+        "Y-CORRECTIONS.cbf",
+        "BKGINIT.cbf",
+        "BLANK.cbf",
+        "GAIN.cbf",
+    ],
+    "mintegrate": [
+        "XDS.INP",
+        "XPARM.XDS",
+        "X-CORRECTIONS.cbf",
+        "Y-CORRECTIONS.cbf",
+        "BKGPIX.cbf",
+        "BLANK.cbf",
+        "GAIN.cbf",
+    ],
+}
+
+
+def task_error(task, directory=None):
+    """The error the log of task (LP_nn.tmp) in directory ends in, if any:
+    an XDS task may fail without a nonzero exit status.
+    """
+    return lp_error(os.path.join(directory or os.getcwd(), "LP_%02d.tmp" % task))
+
+
+def _task_input(main, name):
+    """Whether the tasks of main read the file name, assuming any file may
+    be read by a program other than those of XDS.
+    """
+    for program, inputs in _task_inputs.items():
+        if os.path.basename(main).startswith(program):
+            return name in inputs
+    return True
+
+
+def _scratch_copy(task, since, main):
+    """Make a directory to run a duplicate of task of main in, with copies
+    of the files it reads from the working directory from before the tasks
+    started, so that it does not overwrite the output of the original.
+    Returns the directory and the modification times of the files copied.
+    """
+    directory = tempfile.mkdtemp(prefix=".forkxds_%d_" % task, dir=os.getcwd())
+    copied = {}
+    for entry in os.scandir(os.getcwd()):
+        if (
+            entry.is_file()
+            and entry.stat().st_mtime < since
+            and _task_input(main, entry.name)
+        ):
+            shutil.copy2(entry.path, directory)
+            copied[entry.name] = entry.stat().st_mtime
+    return directory, copied
+
+
+def _adopt_outputs(directory, copied):
+    """Move the files written by a duplicate task into the working
+    directory, then remove its scratch directory.
+    """
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.stat().st_mtime != copied.get(entry.name):
+            os.replace(entry.path, entry.name)
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def run_tasks(
+    ntask,
+    maxcpu,
+    main,
+    hosts=(),
+    max_tasks=0,
+    memory_limit=0,
+    tasks=None,
+    straggler_factor=0.0,
+    retries=0,
+    poll_interval=0.05,
+):
+    """Run tasks 1 to ntask of main (or just those in tasks), each given its
+    task number on stdin, handing each to the next free slot (see
+    host_slots). Once all are started, any task taking longer than
+    straggler_factor times the median of those finished is duplicated on a
+    free slot - on another host if possible - and the first to finish kept.
+    Returns a list of dictionaries of the task, host, cpus, start time,
+    wall, user and system times, exit status and any error ending its log,
+    and for a duplicated task the host of the original and of the duplicate
+    and which finished first. A task which fails or whose log ends in an
+    error is run again, on another host if possible, up to retries times,
+    with the number of retries recorded as retried.
+    """
+    executable = shutil.which(main) or main
+    since = time.time()
+
+    slots = host_slots(hosts, maxcpu)
+    if max_tasks:
+        slots = slots[:max_tasks]
+
+    env = dict(os.environ, OMP_NUM_THREADS=str(maxcpu))
+    rsh = shlex.split(os.environ.get("FORKXDS_RSH", "ssh -x"))
+
+    def command(host, directory):
+        if host is None:
+            return [executable]
+        # pass LD_LIBRARY_PATH across for e.g. the HDF5 plugin
+        return rsh + [
+            host,
+            "cd %s && LD_LIBRARY_PATH=%s %s"
+            % (
+                shlex.quote(directory),
+                shlex.quote(os.environ.get("LD_LIBRARY_PATH", "")),
+                shlex.quote(executable),
+            ),
+        ]
+
+    def launch(task, slot, scratch=None):
+        host, cpus = slot
+        popen = subprocess.Popen(
+            command(host, scratch[0] if scratch else os.getcwd()),
+            cwd=scratch[0] if scratch else None,
+            stdin=subprocess.PIPE,
+            env=env,
+            preexec_fn=preexec(cpus, memory_limit) if host is None else None,
+        )
+        running[popen.pid] = {
+            "popen": popen,
+            "task": task,
+            "slot": slot,
+            "start": time.time(),
+            "scratch": scratch,
+        }
+        popen.stdin.write(b"%d\n" % task)
+        popen.stdin.close()
+
+    def stragglers():
+        times = sorted(result["wall_time"] for result in results.values())
+        if not times:
+            return
+        median = times[len(times) // 2]
+        now = time.time()
+        for entry in list(running.values()):
+            task = entry["task"]
+            if not slots or task in duplicated:
+                continue
+            if now - entry["start"] < straggler_factor * median:
+                continue
+            # prefer a slot on another host to the one which is slow
+            host = entry["slot"][0]
+            slot = next((s for s in slots if s[0] != host), slots[0])
+            slots.remove(slot)
+            duplicated[task] = {
+                "original_host": host or socket.gethostname(),
+                "duplicate_host": slot[0] or socket.gethostname(),
+            }
+            launch(task, slot, _scratch_copy(task, since, main))
+
+    def kill(task):
+        for entry in running.values():
+            if entry["task"] == task:
+                try:
+                    entry["popen"].send_signal(signal.SIGTERM)
+                except OSError:
+                    pass
+
+    pending = list(tasks or range(1, ntask + 1))
+    running = {}
+    results = {}
+    duplicated = {}
+    adopt = {}
+    retried = {}
+    failed_on = {}
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for entry in running.values():
+            try:
+                entry["popen"].send_signal(signal.SIGTERM)
+            except OSError:
+                pass
+
+    previous = {
+        signum: signal.signal(signum, stop)
+        for signum in (signal.SIGINT, signal.SIGTERM)
+    }
+
+    try:
+        while running or (pending and not stopping):
+            while pending and slots and not stopping:
+                task = pending.pop(0)
+                slot = next((s for s in slots if s[0] != failed_on.get(task)), slots[0])
+                slots.remove(slot)
+                launch(task, slot)
+
+            if straggler_factor and not pending and slots and not stopping:
+                stragglers()
+
+            pid, status, rusage = os.wait4(-1, os.WNOHANG)
+            if pid == 0:
+                time.sleep(poll_interval)
+                continue
+            if pid not in running:
+                continue
+            entry = running.pop(pid)
+            slots.append(entry["slot"])
+            task = entry["task"]
+            exit_status = os.waitstatus_to_exitcode(status)
+            entry["popen"].returncode = exit_status
+            error = task_error(task, entry["scratch"][0] if entry["scratch"] else None)
+            others = [e for e in running.values() if e["task"] == task]
+
+            if task in results or ((exit_status or error) and others):
+                # the other copy finished first, or may yet succeed
+                if entry["scratch"]:
+                    shutil.rmtree(entry["scratch"][0], ignore_errors=True)
+                if task in adopt and not others:
+                    _adopt_outputs(*adopt.pop(task))
+                continue
+
+            if (
+                (exit_status or error)
+                and not stopping
+                and retried.get(task, 0) < retries
+            ):
+                # most likely the node, so try again elsewhere
+                if entry["scratch"]:
+                    shutil.rmtree(entry["scratch"][0], ignore_errors=True)
+                retried[task] = retried.get(task, 0) + 1
+                failed_on[task] = entry["slot"][0]
+                pending.insert(0, task)
+                continue
+
+            results[task] = {
+                "task": task,
+                "host": entry["slot"][0] or socket.gethostname(),
+                "cpus": entry["slot"][1],
+                "start": entry["start"],
+                "wall_time": time.time() - entry["start"],
+                "user_time": rusage.ru_utime,
+                "system_time": rusage.ru_stime,
+                "exit_status": exit_status,
+            }
+            if error:
+                results[task]["error"] = error
+            if task in retried:
+                results[task]["retried"] = retried[task]
+            if task in duplicated:
+                results[task]["duplicate"] = dict(
+                    duplicated[task],
+                    winner="duplicate" if entry["scratch"] else "original",
+                )
+            if entry["scratch"]:
+                # take the outputs once the original is no longer writing
+                if others:
+                    adopt[task] = entry["scratch"]
+                else:
+                    _adopt_outputs(*entry["scratch"])
+            kill(task)
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+
+    if stopping:
+        raise KeyboardInterrupt(stopping[0])
+
+    return [results[task] for task in sorted(results)]
+
+
+def write_results(main, results, filename=None):
+    """Write the per task results as JSON and a summary to stdout."""
+    filename = filename or "forkxds_%s.json" % os.path.basename(main)
+    with open(filename, "w") as fh:
+        json.dump(results, fh, indent=2)
+
+    for result in results:
+        print(
+            "forkxds: %s task %d on %s cpus %s: %.1fs wall %.1fs user exit %d%s%s%s"
+            % (
+                os.path.basename(main),
+                result["task"],
+                result["host"],
+                ",".join(map(str, result["cpus"] or [])) or "any",
+                result["wall_time"],
+                result["user_time"],
+                result["exit_status"],
+                " queued %.2fs" % result["latency"] if "latency" in result else "",
+                " after %d retries" % result["retried"] if "retried" in result else "",
+                " error: %s" % result["error"] if "error" in result else "",
+            ),
+            flush=True,
+        )
+        if "duplicate" in result:
+            print(
+                "forkxds: task %d was slow on %s, duplicated on %s: %s first"
+                % (
+                    result["task"],
+                    result["duplicate"]["original_host"],
+                    result["duplicate"]["duplicate_host"],
+                    result["duplicate"]["winner"],
+                ),
+                flush=True,
+            )
+
+    # to trace stragglers to hosts
+    per_host = {}
+    for result in results:
+        per_host.setdefault(result["host"], []).append(result["wall_time"])
+    for host in sorted(per_host):
+        times = per_host[host]
+        print(
+            "forkxds: %s ran %d tasks, mean %.1fs max %.1fs"
+            % (host, len(times), sum(times) / len(times), max(times)),
+            flush=True,
+        )
+
+
+def main():
+    """Main routine for fast_dp-forkxds."""
+    if len(sys.argv) < 4:
+        sys.exit("usage: forkxds ntask maxcpu main [rhosts]")
+
+    ntask, maxcpu, program = int(sys.argv[1]), int(sys.argv[2]), sys.argv[3]
+
+    try:
+        if os.environ.get("FORKXDS_SPOOL"):
+            from fast_dp.worker_pool import submit_tasks
+
+            results = submit_tasks(
+                os.environ["FORKXDS_SPOOL"],
+                ntask,
+                maxcpu,
+                program,
+                timeout=float(os.environ.get("FORKXDS_SPOOL_TIMEOUT", 60)),
+                retries=int(os.environ.get("FORKXDS_RETRIES", 2)),
+            )
+        else:
+            results = run_tasks(
+                ntask,
+                maxcpu,
+                program,
+                hosts=sys.argv[4:],
+                max_tasks=int(os.environ.get("FORKXDS_MAX_TASKS", 0)),
+                memory_limit=int(os.environ.get("FORKXDS_MEMORY_LIMIT", 0)),
+                retries=int(os.environ.get("FORKXDS_RETRIES", 2)),
+                straggler_factor=float(os.environ.get("FORKXDS_STRAGGLER_FACTOR", 0)),
+            )
+    except KeyboardInterrupt as e:
+        signum = e.args[0] if e.args else signal.SIGINT
+        sys.exit(128 + signum)
+
+    write_results(program, results)
+
+    # a task may have failed with its log ending in an error but exit 0
+    if any(result["exit_status"] or result.get("error") for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
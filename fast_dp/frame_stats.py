@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import json
+
+from fast_dp.logger import write
+from fast_dp.reflections import read_xds_hkl
+
+# per image statistics from INTEGRATE.HKL, to find images which should not
+# be scaled - dead after a beam dump or a shutter failure (few reflections)
+# or damaged (I/sigma well below the rest) - and leave them out of CORRECT
+# with DATA_RANGE (at the ends) or EXCLUDE_DATA_RANGE (in the middle)
+
+
+def frame_statistics(integrate_hkl="INTEGRATE.HKL", data_range=None):
+    """Return the number of reflections, mean I/sigma and scale (mean
+    intensity relative to the median over the images) for each image in
+    data_range (else that in the header) as a dictionary of numpy arrays,
+    with the image numbers as "image".
+    """
+    import numpy
+
+    header, columns = read_xds_hkl(integrate_hkl)
+    start, end = map(int, (data_range or header["DATA_RANGE"]).split())
+
+    image = numpy.floor(columns["ZCAL"]).astype(numpy.int64) + 1
+    keep = (image >= start) & (image <= end) & (columns["SIGMA"] > 0)
+    index = image[keep] - start
+    intensity = columns["IOBS"][keep]
+    sigma = columns["SIGMA"][keep]
+    n_images = end - start + 1
+
+    count = numpy.bincount(index, minlength=n_images)
+    n = numpy.maximum(count, 1)
+    i_sig_i = numpy.bincount(index, intensity / sigma, minlength=n_images) / n
+    mean_i = numpy.bincount(index, intensity, minlength=n_images) / n
+    median = numpy.median(mean_i[count > 0]) if count.any() else 0.0
+
+    return {
+        "image": numpy.arange(start, end + 1),
+        "n_reflections": count,
+        "i_sig_i": i_sig_i,
+        "scale": mean_i / median if median > 0 else numpy.zeros(n_images),
+    }
+
+
+def unusable_images(statistics, min_reflections=0.25, min_i_sig_i=0.25, window=5):
+    """Flag the images with fewer than min_reflections of the median number
+    of reflections per image, or with the median I/sigma of the window
+    images around them below min_i_sig_i of the median over all images, as
+    a numpy boolean array.
+    """
+    import numpy
+
+    count = statistics["n_reflections"]
+    i_sig_i = statistics["i_sig_i"]
+
+    # damage is gradual, so take the running median to ignore the noise from
+    # image to image while keeping the edge where it starts
+    window = max(1, min(window, len(i_sig_i)))
+    padded = numpy.pad(i_sig_i, (window // 2, window - 1 - window // 2), mode="edge")
+    smoothed = numpy.median(
+        numpy.lib.stride_tricks.sliding_window_view(padded, window), axis=1
+    )
+
+    return (count < min_reflections * numpy.median(count)) | (
+        smoothed < min_i_sig_i * numpy.median(i_sig_i)
+    )
+
+
+def trim_ranges(images, unusable):
+    """Turn the flags from unusable_images into the first and last images
+    to keep and a list of (first, last) ranges to exclude between them, or
+    None if there are no images to keep.
+    """
+    good = [int(image) for image, bad in zip(images, unusable) if not bad]
+    if not good:
+        return None
+
+    exclude = []
+    for image, bad in zip(images, unusable):
+        image = int(image)
+        if not bad or image < good[0] or image > good[-1]:
+            continue
+        if exclude and exclude[-1][1] == image - 1:
+            exclude[-1] = (exclude[-1][0], image)
+        else:
+            exclude.append((image, image))
+
+    return good[0], good[-1], exclude
+
+
+def trim_images(xds_inp, integrate_hkl="INTEGRATE.HKL", max_fraction=0.5):
+    """Find the unusable images in integrate_hkl and leave them out of the
+    later steps by changing DATA_RANGE and EXCLUDE_DATA_RANGE in xds_inp,
+    unless more than max_fraction of the images would go, which suggests
+    the data are just weak. Writes the statistics to frame_statistics.json
+    and returns True if xds_inp was changed.
+    """
+    statistics = frame_statistics(integrate_hkl, xds_inp["DATA_RANGE"])
+    unusable = unusable_images(statistics)
+
+    with open("frame_statistics.json", "w") as fh:
+        json.dump(
+            {
+                name: values.tolist()
+                for name, values in dict(statistics, unusable=unusable).items()
+            },
+            fh,
+        )
+
+    n_unusable = int(unusable.sum())
+    if not n_unusable:
+        return False
+    if n_unusable > max_fraction * len(unusable):
+        write(
+            "%d of %d images look unusable: keeping all" % (n_unusable, len(unusable))
+        )
+        return False
+
+    first, last, exclude = trim_ranges(statistics["image"], unusable)
+
+    start, end = map(int, xds_inp["DATA_RANGE"].split())
+    if (first, last) != (start, end):
+        write("Using images %d to %d" % (first, last))
+        xds_inp["DATA_RANGE"] = "%d %d" % (first, last)
+    if exclude:
+        for excluded in exclude:
+            write("Excluding images %d to %d" % excluded)
+        existing = xds_inp.get("EXCLUDE_DATA_RANGE", [])
+        if not isinstance(existing, list):
+            existing = [existing]
+        xds_inp["EXCLUDE_DATA_RANGE"] = existing + ["%d %d" % e for e in exclude]
+
+    return True
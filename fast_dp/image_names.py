@@ -1,75 +1,54 @@
 from __future__ import annotations
 
+import bisect
 import math
 import os
 import re
-import string
+import threading
 
+# the patterns for image names in the order I want to test them, with the
+# format strings to put the file name back together
 
-def image2template(filename):
-    """Return a template to match this filename."""
+_patterns = [
+    (re.compile(r"([^\.]*)\.([0-9]+)\Z"), "%s.%s%s"),
+    (re.compile(r"(.*)_([0-9]*)\.(.*)"), "%s_%s.%s"),
+    (re.compile(r"(.*?)([0-9]*)\.(.*)"), "%s%s.%s"),
+]
+
+
+def _match(filename):
     # check that the file name doesn't contain anything mysterious
     if filename.count("#"):
         raise RuntimeError("# characters in filename")
 
-    # the patterns in the order I want to test them
-
-    pattern_keys = [
-        r"([^\.]*)\.([0-9]+)\Z",
-        r"(.*)_([0-9]*)\.(.*)",
-        r"(.*?)([0-9]*)\.(.*)",
-    ]
-
-    # patterns is a dictionary of possible regular expressions with
-    # the format strings to put the file name back together
-
-    patterns = {
-        r"([^\.]*)\.([0-9]+)\Z": "%s.%s%s",
-        r"(.*)_([0-9]*)\.(.*)": "%s_%s.%s",
-        r"(.*?)([0-9]*)\.(.*)": "%s%s.%s",
-    }
-
-    for pattern in pattern_keys:
-        match = re.match(pattern, filename)
-
+    for pattern, format in _patterns:
+        match = pattern.match(filename)
         if match:
-            prefix = match.group(1)
-            number = match.group(2)
-            try:
-                exten = match.group(3)
-            except IndexError:
-                exten = ""
-
-            for digit in string.digits:
-                number = number.replace(digit, "#")
-
-            return patterns[pattern] % (prefix, number, exten)
+            return match, format
 
     raise RuntimeError("filename %s not understood as a template" % filename)
 
 
-def image2image(filename):
-    """Return an integer for the template to match this filename."""
-    # check that the file name doesn't contain anything mysterious
-    if filename.count("#"):
-        raise RuntimeError("# characters in filename")
+def _template(match, format):
+    prefix = match.group(1)
+    number = match.group(2)
+    try:
+        exten = match.group(3)
+    except IndexError:
+        exten = ""
 
-    # the patterns in the order I want to test them
+    return format % (prefix, "#" * len(number), exten)
 
-    pattern_keys = [
-        r"([^\.]*)\.([0-9]+)\Z",
-        r"(.*)_([0-9]*)\.(.*)",
-        r"(.*?)([0-9]*)\.(.*)",
-    ]
 
-    for pattern in pattern_keys:
-        match = re.compile(pattern).match(filename)
+def image2template(filename):
+    """Return a template to match this filename."""
+    return _template(*_match(filename))
 
-        if match:
-            number = match.group(2)
-            return int(number)
 
-    raise RuntimeError("filename %s not understood as a template" % filename)
+def image2image(filename):
+    """Return an integer for the template to match this filename."""
+    match, format = _match(filename)
+    return int(match.group(2))
 
 
 def image2template_directory(filename):
@@ -86,35 +65,143 @@ def image2template_directory(filename):
     return template, directory
 
 
-def find_matching_images(template, directory):
-    """Find images which match the input template in the directory
-    provided.
+class FrameSet:
+    """The image numbers present for one template, as the sorted runs of
+    consecutive numbers, so that looking for gaps costs one step per gap
+    and the numbers themselves may be as large as they like.
     """
-    files = os.listdir(directory)
 
-    # to turn the template to a regular expression want to replace
-    # however many #'s with EXACTLY the same number of [0-9] tokens,
-    # e.g. ### -> ([0-9]{3})
+    def __init__(self) -> None:
+        self._firsts = []
+        self._lasts = []
+        self._count = 0
+
+    @property
+    def first(self):
+        return self._firsts[0] if self._firsts else None
+
+    @property
+    def last(self):
+        return self._lasts[-1] if self._lasts else None
+
+    def _run(self, number):
+        """The index of the run starting at or before number, or -1."""
+        return bisect.bisect_right(self._firsts, number) - 1
+
+    def add(self, number):
+        j = self._run(number)
+        if j >= 0 and number <= self._lasts[j]:
+            return
+        self._count += 1
+        after = j >= 0 and self._lasts[j] == number - 1
+        before = j + 1 < len(self._firsts) and self._firsts[j + 1] == number + 1
+        if after and before:
+            self._lasts[j] = self._lasts.pop(j + 1)
+            del self._firsts[j + 1]
+        elif after:
+            self._lasts[j] = number
+        elif before:
+            self._firsts[j + 1] = number
+        else:
+            self._firsts.insert(j + 1, number)
+            self._lasts.insert(j + 1, number)
+
+    def __contains__(self, number):
+        j = self._run(number)
+        return j >= 0 and number <= self._lasts[j]
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for first, last in zip(self._firsts, self._lasts):
+            yield from range(first, last + 1)
+
+    def contiguous(self, first):
+        """Return the last image number in the unbroken run of images
+        starting from first, or first - 1 if first is not present.
+        """
+        j = self._run(first)
+        if j >= 0 and first <= self._lasts[j]:
+            return self._lasts[j]
+        return first - 1
+
+    def missing(self, first=None, last=None):
+        """List the image numbers from first to last (by default the first
+        and last present) which are not present.
+        """
+        if self.first is None:
+            return []
+        first = self.first if first is None else first
+        last = self.last if last is None else last
+
+        missing = []
+        number = first
+        for run_first, run_last in zip(self._firsts, self._lasts):
+            if run_first > last:
+                break
+            if run_first > number:
+                missing.extend(range(number, run_first))
+            number = max(number, run_last + 1)
+        missing.extend(range(number, last + 1))
+
+        return missing
+
+
+def _template_regexp(template):
+    """A regular expression matching the names for template, with the image
+    number as group 1: the #'s are replaced with EXACTLY the same number of
+    digits, e.g. ### -> ([0-9]{3}), and the rest escaped to cope with file
+    templates with special characters in them, such as "+" - fix to a
+    problem reported by Joel B.
+    """
+    length = template.count("#")
+    return re.compile(
+        re.escape(template).replace("\\#" * length, "([0-9]{%d})" % length)
+    )
 
-    # change 30/may/2008 - now escape the template in this search to cope with
-    # file templates with special characters in them, such as "+" -
-    # fix to a problem reported by Joel B.
 
-    length = template.count("#")
-    regexp_text = re.escape(template).replace("\\#" * length, "([0-9]{%d})" % length)
-    regexp = re.compile(regexp_text)
+# indices of the templates looked at so far, by directory and template, with
+# the modification time of the directory when each was read - reused until
+# the directory changes
 
-    images = []
+_indices = {}
+_indices_lock = threading.Lock()
 
-    for f in files:
-        match = regexp.match(f)
 
-        if match:
-            images.append(int(match.group(1)))
+def image_index(directory, template, refresh=False):
+    """Find the images in directory matching template in one pass, as a
+    FrameSet. The result is reused within the process until the directory
+    is modified, or refresh is set.
+    """
+    directory = os.path.abspath(directory)
+    mtime = os.stat(directory).st_mtime_ns
+
+    with _indices_lock:
+        if not refresh and (directory, template) in _indices:
+            cached_mtime, frames = _indices[directory, template]
+            if cached_mtime == mtime:
+                return frames
+
+    regexp = _template_regexp(template)
+    frames = FrameSet()
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            match = regexp.fullmatch(entry.name)
+            if match:
+                frames.add(int(match.group(1)))
+
+    with _indices_lock:
+        _indices[directory, template] = (mtime, frames)
+
+    return frames
 
-    images.sort()
 
-    return images
+def find_matching_images(template, directory):
+    """Find images which match the input template in the directory
+    provided.
+    """
+    return list(image_index(directory, template))
 
 
 def template_directory_number2image(template, directory, number):
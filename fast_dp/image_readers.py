@@ -3,9 +3,8 @@ from __future__ import annotations
 import os
 import time
 
-from dxtbx.model.experiment_list import ExperimentListFactory
-
 from fast_dp.image_names import image2template_directory
+from fast_dp.metadata_cache import load_metadata, metadata_key, save_metadata
 
 
 def check_file_readable(filename):
@@ -316,10 +315,19 @@ def read_image_metadata_dxtbx(image):
     """Read the image header and send back the resulting metadata in a
     dictionary. Read this using dxtbx - for a sequence of images use the
     first image in the sequence to derive the metadata, for HDF5 files
-    just get on an read.
+    just get on an read. The results are cached, see metadata_cache.
     """
     check_file_readable(image)
 
+    library = find_hdf5_lib(lib_name=__lib_name) if image.endswith(".h5") else ""
+    key = metadata_key(image, library)
+    params = load_metadata(key)
+    if params is not None:
+        return params
+
+    from dxtbx.model.experiment_list import ExperimentListFactory
+    from dxtbx.serialize.xds import to_xds
+
     if image.endswith(".h5"):
         # XDS can literally only handle master files called (prefix)_master.h5
         assert "master" in image
@@ -331,8 +339,6 @@ def read_image_metadata_dxtbx(image):
             [full_template], allow_incomplete_sweeps=True
         )[0]
 
-    from dxtbx.serialize.xds import to_xds
-
     XDS_INP = to_xds(expt.imageset).XDS_INP()
     params = XDS_INP_to_dict(XDS_INP)
 
@@ -341,6 +347,8 @@ def read_image_metadata_dxtbx(image):
         if name in params:
             del params[name]
 
+    save_metadata(key, params)
+
     return params
 
 
@@ -1,19 +1,27 @@
 from __future__ import annotations
 
 import contextlib
+import glob
+import json
 import os
 import shutil
 
 from fast_dp.autoindex import segment_text
-from fast_dp.run_job import run_job
-
-
-def integrate(xds_inp, p1_unit_cell, resolution_low, n_jobs, n_processors):
-    """Peform the integration with a triclinic basis."""
-    assert xds_inp
-    assert p1_unit_cell
-
-    with open("INTEGRATE.INP", "w") as fout:
+from fast_dp.logger import write
+from fast_dp.lp_parser import LPFile, check_lp_error
+from fast_dp.run_job import stream_job
+from fast_dp.step_cache import (
+    INTEGRATE_ARTEFACTS,
+    restore_step,
+    step_key,
+    store_step,
+)
+
+
+def write_integrate_inp(
+    filename, xds_inp, resolution_low, n_jobs, n_processors, job="DEFPIX INTEGRATE"
+):
+    with open(filename, "w") as fout:
         for k in sorted(xds_inp):
             if "SEGMENT" in k:
                 continue
@@ -25,7 +33,7 @@ def integrate(xds_inp, p1_unit_cell, resolution_low, n_jobs, n_processors):
                 fout.write(f"{k}={v}\n")
 
         fout.write("REFINE(INTEGRATE)= POSITION BEAM ORIENTATION CELL\n")
-        fout.write("JOB=DEFPIX INTEGRATE\n")
+        fout.write("JOB=%s\n" % job)
         fout.write("%s\n" % segment_text(xds_inp))
 
         if n_processors:
@@ -34,47 +42,86 @@ def integrate(xds_inp, p1_unit_cell, resolution_low, n_jobs, n_processors):
             fout.write("MAXIMUM_NUMBER_OF_JOBS=%d\n" % n_jobs)
         fout.write("INCLUDE_RESOLUTION_RANGE= %f 0.0\n" % resolution_low)
 
+
+def failed_tasks(working_directory=None):
+    """Find the INTEGRATE tasks which failed even after being retried, from
+    the record written by fast_dp-forkxds (if that was used to run them).
+    """
+    failed = []
+    for filename in glob.glob(
+        os.path.join(working_directory or os.getcwd(), "forkxds_mintegrate*.json")
+    ):
+        with contextlib.suppress(OSError, ValueError), open(filename) as fh:
+            failed.extend(
+                task
+                for task in json.load(fh)
+                if task["exit_status"] or task.get("error")
+            )
+    return failed
+
+
+def cluster_error():
+    """The error for INTEGRATE tasks failing, naming them if possible."""
+    failed = failed_tasks()
+    if not failed:
+        return RuntimeError("integration error: cluster error")
+    return RuntimeError(
+        "integration error: cluster error in task%s %s"
+        % (
+            "s" if len(failed) > 1 else "",
+            ", ".join("%d on %s" % (task["task"], task["host"]) for task in failed),
+        )
+    )
+
+
+def read_mosaics(integrate_lp="INTEGRATE.LP"):
+    """Get the mosaic spread for each block of images from INTEGRATE.LP."""
+    with LPFile(integrate_lp) as lp:
+        return lp.mosaicities()
+
+
+def _check_integrate_errors(lp, step="INTEGRATE"):
+    """Raise a RuntimeError for the errors in the log lp which mean the
+    integration cannot be trusted.
+    """
+    for error in lp.errors():
+        if error.startswith("AUTOMATIC DETERMINATION OF SPOT SIZE "):
+            raise RuntimeError(f"error in {step}: {error.lower()}")
+        elif error.startswith("CANNOT OPEN OR READ FILE LP_01.tmp"):
+            raise cluster_error()
+
+
+def integrate(xds_inp, p1_unit_cell, resolution_low, n_jobs, n_processors):
+    """Peform the integration with a triclinic basis."""
+    assert xds_inp
+    assert p1_unit_cell
+
+    write_integrate_inp("INTEGRATE.INP", xds_inp, resolution_low, n_jobs, n_processors)
+
     shutil.copyfile("INTEGRATE.INP", "XDS.INP")
 
-    run_job("xds_par")
+    key = step_key("integrate", "INTEGRATE.INP", xds_inp, depends=["XPARM.XDS"])
+
+    if restore_step(key):
+        write("Integration results restored from cache")
+    else:
+        stream_job("xds_par", stage="integrate")
 
     # FIXME need to check that all was hunky-dory in here!
 
     for step in ["DEFPIX", "INTEGRATE"]:
-        if not os.path.exists("%s.LP" % step):
-            continue
-        lastrecord = open("%s.LP" % step).readlines()[-1]
-        if "!!! ERROR !!!" in lastrecord:
-            raise RuntimeError(
-                "error in {}: {}".format(
-                    step, lastrecord.replace("!!! ERROR !!!", "").strip().lower()
-                )
-            )
+        check_lp_error(step)
 
     if not os.path.exists("INTEGRATE.LP"):
-        step = "INTEGRATE"
-        for record in open("LP_01.tmp").readlines():
-            if "!!! ERROR !!! AUTOMATIC DETERMINATION OF SPOT SIZE " in record:
-                raise RuntimeError(
-                    "error in {}: {}".format(
-                        step, record.replace("!!! ERROR !!!", "").strip().lower()
-                    )
-                )
-            elif "!!! ERROR !!! CANNOT OPEN OR READ FILE LP_01.tmp" in record:
-                raise RuntimeError("integration error: cluster error")
-
-    # check for some specific errors
-
-    for step in ["INTEGRATE"]:
-        for record in open("%s.LP" % step).readlines():
-            if "!!! ERROR !!! AUTOMATIC DETERMINATION OF SPOT SIZE " in record:
-                raise RuntimeError(
-                    "error in {}: {}".format(
-                        step, record.replace("!!! ERROR !!!", "").strip().lower()
-                    )
-                )
-            elif "!!! ERROR !!! CANNOT OPEN OR READ FILE LP_01.tmp" in record:
-                raise RuntimeError("integration error: cluster error")
+        with LPFile("LP_01.tmp") as lp:
+            _check_integrate_errors(lp)
+
+    # check for some specific errors, and get the mosaic spread ranges from
+    # the same pass through the log
+
+    with LPFile("INTEGRATE.LP") as lp:
+        _check_integrate_errors(lp)
+        mosaics = lp.mosaicities()
 
     # if all was ok, look in the working directory for files named
     # forkintegrate_job.o341858 &c. and remove them. - N.B. this is site
@@ -85,14 +132,62 @@ def integrate(xds_inp, p1_unit_cell, resolution_low, n_jobs, n_processors):
             with contextlib.suppress(Exception):
                 os.remove(f)
 
-    # get the mosaic spread ranges
-
-    mosaics = []
-
-    for record in open("INTEGRATE.LP"):
-        if "CRYSTAL MOSAICITY (DEGREES)" in record:
-            mosaics.append(float(record.split()[-1]))
+    store_step(key, INTEGRATE_ARTEFACTS)
 
     mosaic = sum(mosaics) / len(mosaics)
 
     return min(mosaics), mosaic, max(mosaics)
+
+
+def defpix(xds_inp, resolution_low, n_processors):
+    """Run DEFPIX alone, ahead of integrating the images in chunks."""
+    write_integrate_inp(
+        "DEFPIX.INP", xds_inp, resolution_low, 0, n_processors, "DEFPIX"
+    )
+    shutil.copyfile("DEFPIX.INP", "XDS.INP")
+    stream_job("xds_par", stage="DEFPIX")
+    check_lp_error("DEFPIX")
+
+
+def integrate_chunk(
+    xds_inp, resolution_low, n_jobs, n_processors, start, end, directory
+):
+    """Integrate images start to end in directory, which should already
+    hold the results of autoindexing and DEFPIX (see
+    candidates.make_sandbox). Returns the mosaic spreads.
+    """
+    xds_inp = dict(xds_inp)
+    xds_inp["DATA_RANGE"] = "%d %d" % (start, end)
+
+    write_integrate_inp(
+        os.path.join(directory, "XDS.INP"),
+        xds_inp,
+        resolution_low,
+        n_jobs,
+        n_processors,
+        "INTEGRATE",
+    )
+
+    stream_job("xds_par", working_directory=directory, stage="integrate")
+    check_lp_error("INTEGRATE", working_directory=directory)
+
+    return read_mosaics(os.path.join(directory, "INTEGRATE.LP"))
+
+
+def merge_integrate_hkl(filenames, start, end, hklout="INTEGRATE.HKL"):
+    """Join the INTEGRATE.HKL files from integrating consecutive chunks of
+    images into one, as XDS does for the results of parallel jobs: the
+    header from the first with DATA_RANGE start to end, then all of the
+    reflections.
+    """
+    with open(hklout, "w") as fout:
+        for j, filename in enumerate(filenames):
+            with open(filename) as fin:
+                for record in fin:
+                    if record.startswith("!"):
+                        if j > 0 or record.startswith("!END_OF_DATA"):
+                            continue
+                        if record.startswith("!DATA_RANGE="):
+                            record = "!DATA_RANGE=%6d%6d\n" % (start, end)
+                    fout.write(record)
+        fout.write("!END_OF_DATA\n")
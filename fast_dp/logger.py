@@ -7,9 +7,15 @@ class _writer:
     def __init__(self) -> None:
         self._fout = None
         self._filename = "fast_dp.log"
+        self._mode = "w"
 
-    def set_filename(self, filename):
+    def set_filename(self, filename, append=False):
+        # e.g. in a worker forked from fast_dp-service, which has its own log
+        if self._fout:
+            self._fout.close()
+            self._fout = None
         self._filename = filename
+        self._mode = "a" if append else "w"
 
     def __del__(self) -> None:
         if self._fout:
@@ -21,14 +27,15 @@ class _writer:
 
     def write(self, record):
         if not self._fout:
-            self._fout = open(self._filename, "w")
+            self._fout = open(self._filename, self._mode)
 
         self._fout.write("%s\n" % record)
-        print(record)
+        self._fout.flush()
+        print(record, flush=True)
 
 
 write = _writer()
 
 
-def set_filename(filename):
-    write.set_filename(filename)
+def set_filename(filename, append=False):
+    write.set_filename(filename, append=append)
@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import mmap
+import os
+
+# reading the XDS log (LP) files without reading them into memory: the file
+# is memory mapped and searched for each kind of record of interest only
+# when first asked for, remembering where each is, from which the results
+# are read - so INTEGRATE.LP from a long sweep need never be split into
+# lines, and checking for an error only reads the end of the file
+
+ERROR = b"!!! ERROR !!!"
+MOSAICITY = b"CRYSTAL MOSAICITY (DEGREES)"
+DIRECT_BEAM = b"DETECTOR COORDINATES (PIXELS) OF DIRECT BEAM"
+RESOLUTION_TABLE = b"RESOLUTION RANGE  I/Sigma  Chi^2  R-FACTOR  R-FACTOR"
+SPACE_GROUP_NUMBER = b"SPACE_GROUP_NUMBER="
+UNIT_CELL_CONSTANTS = b"UNIT_CELL_CONSTANTS="
+ACCEPTED_OBSERVATIONS = b"NUMBER OF ACCEPTED OBSERVATIONS"
+
+# the lattice table rows start " * ", the rest can be anywhere in a record
+LATTICE = b"\n * "
+
+
+def last_record(filename, block=4096):
+    """Return the last record of filename, reading only the end of it."""
+    with open(filename, "rb") as fh:
+        fh.seek(0, os.SEEK_END)
+        size = fh.tell()
+        tail = b""
+        while True:
+            start = max(0, size - len(tail) - block)
+            fh.seek(start)
+            tail = fh.read(size - start)
+            records = tail.rstrip(b"\n").split(b"\n")
+            if len(records) > 1 or start == 0:
+                return records[-1].decode("latin-1")
+
+
+def lp_error(lp):
+    """Return the error the log file lp ends in, or None."""
+    if not os.path.exists(lp):
+        return None
+    lastrecord = last_record(lp)
+    if "!!! ERROR !!!" in lastrecord:
+        return lastrecord.replace("!!! ERROR !!!", "").strip().lower()
+    return None
+
+
+def check_lp_error(step, working_directory=None):
+    """Raise a RuntimeError if the log file for step ends in an error."""
+    error = lp_error(os.path.join(working_directory or os.getcwd(), "%s.LP" % step))
+    if error:
+        raise RuntimeError(f"error in {step}: {error}")
+
+
+class LPFile:
+    """An XDS log file, searched for each kind of record as needed. Use as
+    a context manager, or close when done.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as fh:
+            try:
+                self._data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty files cannot be mapped
+                self._data = b""
+
+        self._index = {}
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _record(self, offset):
+        start = self._data.rfind(b"\n", 0, offset) + 1
+        end = self._data.find(b"\n", offset)
+        if end < 0:
+            end = len(self._data)
+        return self._data[start:end].decode("latin-1"), end + 1
+
+    def _offsets(self, marker):
+        """Where marker is found, searching for it the first time."""
+        if marker not in self._index:
+            offsets = []
+            offset = self._data.find(marker)
+            while offset >= 0:
+                offsets.append(offset + 1 if marker.startswith(b"\n") else offset)
+                offset = self._data.find(marker, offset + len(marker))
+            if marker.startswith(b"\n") and self._data[: len(marker) - 1] == marker[1:]:
+                offsets.insert(0, 0)
+            self._index[marker] = offsets
+        return self._index[marker]
+
+    def records(self, marker):
+        """All of the records containing marker, in order."""
+        return [self._record(offset)[0] for offset in self._offsets(marker)]
+
+    def records_after(self, marker, skip=0):
+        """The records following the first containing marker, after
+        skipping skip of them.
+        """
+        offsets = self._offsets(marker)
+        if not offsets:
+            return
+        _, offset = self._record(offsets[0])
+        while offset < len(self._data):
+            record, offset = self._record(offset)
+            if skip:
+                skip -= 1
+                continue
+            yield record
+
+    def errors(self):
+        """The text of every error reported."""
+        return [
+            record.replace("!!! ERROR !!!", "").strip()
+            for record in self.records(ERROR)
+        ]
+
+    def mosaicities(self):
+        """The mosaic spread for each block of images, from INTEGRATE.LP."""
+        return [float(record.split()[-1]) for record in self.records(MOSAICITY)]
+
+    def direct_beam(self):
+        """The last refined direct beam position, in pixels, or None."""
+        records = self.records(DIRECT_BEAM)
+        if not records:
+            return None
+        return tuple(map(float, records[-1].split()[-2:]))
+
+    def lattices(self):
+        """The rows of the table of possible lattices from IDXREF or CORRECT
+        as (lattice character, penalty, cell) tuples.
+        """
+        lattices = []
+        for record in self.records(LATTICE):
+            tokens = record.split()
+            lattices.append(
+                (tokens[2], float(tokens[3]), tuple(map(float, tokens[4:10])))
+            )
+        return lattices
+
+    def resolution_table(self):
+        """The rows of the table of I/sigma etc. by resolution from
+        CORRECT.LP, as lists of the fields (some of which are percentages),
+        or None if there is no table.
+        """
+        if not self._offsets(RESOLUTION_TABLE):
+            return None
+        rows = []
+        for record in self.records_after(RESOLUTION_TABLE, skip=2):
+            if "--------" in record:
+                break
+            rows.append(record.split())
+        return rows
+
+    def space_group_number(self):
+        """The last space group number given, or 0 if it cannot be read."""
+        records = self.records(SPACE_GROUP_NUMBER)
+        if not records:
+            return None
+        try:
+            return int(records[-1].split()[-1])
+        except ValueError:
+            return 0
+
+    def unit_cell(self):
+        """The last unit cell constants given (other than those used)."""
+        records = [
+            record
+            for record in self.records(UNIT_CELL_CONSTANTS)
+            if "used" not in record
+        ]
+        if not records:
+            return None
+        return tuple(map(float, records[-1].split()[-6:]))
+
+    def accepted_observations(self):
+        records = self.records(ACCEPTED_OBSERVATIONS)
+        return int(records[-1].split()[-1]) if records else 0
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from fast_dp.logger import write
-from fast_dp.run_job import run_job
+from fast_dp.run_job import stream_job
 
 
 def anomalous_signals(hklin):
@@ -35,9 +35,22 @@ def merge(hklout="fast_dp.mtz", aimless_log="aimless.log"):
     statistics - this will use pointless for the reflection file format
     mashing.
     """
-    run_job("pointless", ["-c", "xdsin", "XDS_ASCII.HKL", "hklout", "xds_sorted.mtz"])
+    return parse_aimless_log(run_aimless(hklout, aimless_log), hklin=hklout)
 
-    log = run_job(
+
+def run_aimless(hklout="fast_dp.mtz", aimless_log="aimless.log"):
+    """Run pointless and Aimless as for merge, returning the summary records
+    from the Aimless log which parse_aimless_log needs.
+    """
+    stream_job(
+        "pointless",
+        ["-c", "xdsin", "XDS_ASCII.HKL", "hklout", "xds_sorted.mtz"],
+        stage="pointless conversion",
+    )
+
+    summary = _aimless_summary()
+
+    stream_job(
         "aimless",
         ["hklin", "xds_sorted.mtz", "hklout", hklout, "xmlout", "aimless.xml"],
         [
@@ -49,21 +62,56 @@ def merge(hklout="fast_dp.mtz", aimless_log="aimless.log"):
             "output unmerged",
             "sdcorrection norefine full 1 0 0",
         ],
+        stage="aimless",
+        log_file=aimless_log,
+        handlers=[_check_aimless_error, summary],
     )
 
-    with open(aimless_log, "w") as fout:
-        for record in log:
-            fout.write(record)
+    return summary.records
 
-    # check for errors
-    for record in log:
-        if "!!!! No data !!!!" in record:
-            raise RuntimeError("aimless complains no data")
 
-    return parse_aimless_log(log)
+def _check_aimless_error(record):
+    if "!!!! No data !!!!" in record:
+        raise RuntimeError("aimless complains no data")
+
+
+class _aimless_summary:
+    """Keep only the records from the Aimless log which parse_aimless_log
+    needs, as they go past.
+    """
+
+    keys = (
+        "Low resolution limit  ",
+        "High resolution limit  ",
+        "Rmerge  (within I+/I-)  ",
+        "Rmeas (all I+ & I-) ",
+        "Mean((I)/sd(I))  ",
+        "Completeness  ",
+        "Multiplicity  ",
+        "Anomalous completeness  ",
+        "Anomalous multiplicity  ",
+        "Mid-Slope of Anom Normal Probability  ",
+        "Total number of observations",
+        "Total number unique",
+        "DelAnom correlation between half-sets",
+        "Mn(I) half-set correlation CC(1/2)",
+    )
+
+    def __init__(self) -> None:
+        self.records = []
 
+    def __call__(self, record):
+        for key in self.keys:
+            if key in record:
+                self.records.append(record)
+                break
 
-def parse_aimless_log(log):
+
+def aimless_statistics(log):
+    """Parse the merging statistics from the Aimless log, returning them as
+    a dictionary by resolution shell along with the mid-slope of the
+    anomalous normal probability plot.
+    """
     for record in log:
         if "Low resolution limit  " in record:
             lres = tuple(map(float, record.split()[-3:]))
@@ -113,8 +161,39 @@ def parse_aimless_log(log):
         for index, shell in enumerate(("overall", "innerShell", "outerShell"))
     }
 
+    return scaling_statistics, slope
+
+
+def parse_aimless_log(log, hklin="fast_dp.mtz", anomalous=None):
+    """Parse the merging statistics from the Aimless log and write them out,
+    along with the anomalous signals from hklin - these may be passed in as
+    anomalous if they have already been computed.
+    """
+    scaling_statistics, slope = aimless_statistics(log)
+
+    def column(name):
+        return tuple(
+            scaling_statistics[shell][name]
+            for shell in ("overall", "innerShell", "outerShell")
+        )
+
+    lres = column("res_lim_low")
+    hres = column("res_lim_high")
+    rmerge = column("r_merge")
+    isigma = column("mean_i_sig_i")
+    comp = column("completeness")
+    mult = column("multiplicity")
+    cchalf = column("cc_half")
+    acomp = column("anom_completeness")
+    amult = column("anom_multiplicity")
+    ccanom = column("cc_anom")
+    nref = column("n_tot_obs")
+    nuniq = column("n_tot_unique_obs")
+
     # compute some additional results
-    df_f, di_sigdi = anomalous_signals("fast_dp.mtz")
+    if anomalous is None:
+        anomalous = anomalous_signals(hklin)
+    df_f, di_sigdi = anomalous
 
     # print out the results...
     write(80 * "-")
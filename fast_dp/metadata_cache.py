@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+
+import fast_dp
+from fast_dp.image_names import image2template_directory
+
+# the image metadata as read by dxtbx, kept on disk so that repeat runs on
+# the same data need not read the images again - entries are keyed on the
+# template, the identity (inode, size, mtime) of the master file (or first
+# image) and of the directory holding it, so that adding frames or
+# rewriting the master file invalidates them, and the HDF5 reader library
+
+__metadata_cache_directory = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser(os.path.join("~", ".cache"))),
+    "fast_dp",
+    "metadata",
+)
+
+
+def set_metadata_cache_directory(metadata_cache_directory):
+    """Keep the image metadata in metadata_cache_directory, or nowhere if
+    this is None.
+    """
+    global __metadata_cache_directory
+    __metadata_cache_directory = metadata_cache_directory
+
+
+def get_metadata_cache_directory():
+    return __metadata_cache_directory
+
+
+def _identity(filename):
+    stat = os.stat(filename)
+    return "%d %d %d" % (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def metadata_key(image, library=""):
+    """The cache key for the metadata read from image with the HDF5 reader
+    library.
+    """
+    image = os.path.abspath(image)
+
+    if image.endswith(".h5"):
+        template = image
+    else:
+        template, directory = image2template_directory(image)
+        template = os.path.join(directory, template)
+
+    return json.dumps(
+        [
+            fast_dp.__version__,
+            template,
+            library,
+            _identity(image),
+            _identity(os.path.dirname(image)),
+        ]
+    )
+
+
+def _entry(key):
+    return os.path.join(
+        __metadata_cache_directory, hashlib.sha256(key.encode()).hexdigest() + ".json"
+    )
+
+
+def load_metadata(key):
+    """Return the metadata saved for key, or None."""
+    if not __metadata_cache_directory:
+        return None
+
+    try:
+        with open(_entry(key)) as fh:
+            entry = json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+    if entry.get("key") != key:
+        return None
+
+    return entry["metadata"]
+
+
+def save_metadata(key, metadata):
+    """Save metadata under key - failing to do so is not an error, as the
+    cache may well be somewhere read only.
+    """
+    if not __metadata_cache_directory:
+        return
+
+    entry = _entry(key)
+    partial = f"{entry}.{os.getpid()}"
+
+    try:
+        os.makedirs(__metadata_cache_directory, exist_ok=True)
+        with open(partial, "w") as fh:
+            json.dump({"key": key, "metadata": metadata}, fh)
+        os.replace(partial, entry)
+    except OSError:
+        if os.path.exists(partial):
+            os.remove(partial)
@@ -4,6 +4,8 @@ import json
 import os
 from importlib.resources import files
 
+from fast_dp.logger import write
+
 
 def write_json(
     commandline,
@@ -13,17 +15,25 @@ def write_json(
     start_image,
     refined_beam,
     filename="fast_dp.json",
+    resource_usage=None,
+    candidates=None,
 ):
     """Write out nice JSON for downstream processing."""
+    results = {
+        "commandline": commandline,
+        "refined_beam": refined_beam,
+        "spacegroup": spacegroup,
+        "unit_cell": unit_cell,
+        "scaling_statistics": scaling_statistics,
+    }
+    if resource_usage is not None:
+        results["resource_usage"] = resource_usage
+    if candidates is not None:
+        results["candidates"] = candidates
+
     with open(filename, "w") as fh:
         json.dump(
-            {
-                "commandline": commandline,
-                "refined_beam": refined_beam,
-                "spacegroup": spacegroup,
-                "unit_cell": unit_cell,
-                "scaling_statistics": scaling_statistics,
-            },
+            results,
             fh,
             sort_keys=True,
             indent=2,
@@ -31,6 +41,26 @@ def write_json(
         )
 
 
+def write_resource_usage(resource_usage):
+    """Print the time and resources used by the external programs, by stage."""
+    write(
+        "%20s %6s %8s %8s %8s %8s"
+        % ("Stage", "Calls", "Wall/s", "User/s", "Sys/s", "RSS/MB")
+    )
+    for stage, usage in resource_usage.items():
+        write(
+            "%20s %6d %8.1f %8.1f %8.1f %8.1f"
+            % (
+                stage,
+                usage["calls"],
+                usage["wall_time"],
+                usage["user_time"],
+                usage["system_time"],
+                usage["max_rss_kb"] / 1024.0,
+            )
+        )
+
+
 def get_ispyb_template():
     """Read the ispyb.xml template from the package resources."""
     template_path = files("fast_dp") / "templates" / "ispyb.xml"
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import os
 import shutil
 
 from fast_dp.autoindex import segment_text
@@ -11,10 +12,63 @@ from fast_dp.cell_spacegroup import (
 )
 from fast_dp.logger import write
 from fast_dp.pointless_reader import read_pointless_xml
-from fast_dp.run_job import run_job
+from fast_dp.run_job import stream_job
+from fast_dp.step_cache import (
+    CORRECT_ARTEFACTS,
+    restore_step,
+    step_key,
+    store_step,
+)
 from fast_dp.xds_reader import read_correct_lp_get_resolution, read_xds_idxref_lp
 
 
+def allowed_pointgroups(pointless_xml="pointless.xml", correct_lp="P1.LP"):
+    """Return the pointgroups suggested by pointless, most likely first, for
+    which XDS found a corresponding lattice in the P1 CORRECT run, as a list
+    of (space group number, unit cell).
+    """
+    results = read_xds_idxref_lp(correct_lp)
+
+    allowed = []
+    for lattice, space_group_number in read_pointless_xml(pointless_xml):
+        if lattice_to_spacegroup(lattice) in results:
+            unit_cell = results[lattice_to_spacegroup(lattice)][1]
+            allowed.append((space_group_number, unit_cell))
+
+    return allowed
+
+
+# the highest symmetry chiral spacegroup for each lattice, keyed on the
+# lowest symmetry one as used by read_xds_idxref_lp
+
+_highest_symmetry = {
+    1: 1,
+    3: 3,
+    5: 5,
+    16: 16,
+    21: 21,
+    22: 22,
+    23: 23,
+    75: 89,
+    79: 97,
+    143: 177,
+    146: 155,
+    195: 207,
+    196: 209,
+    197: 211,
+}
+
+
+def likely_pointgroup(results):
+    """Guess the pointgroup pointless will choose from the lattices XDS
+    found acceptable (results from read_xds_idxref_lp): take the highest
+    symmetry pointgroup of the highest symmetry lattice. Returns the space
+    group number and unit cell.
+    """
+    lattice = max(r for r in results if isinstance(r, int))
+    return _highest_symmetry[lattice], results[lattice][1]
+
+
 def decide_pointgroup(p1_unit_cell, xds_inp, input_spacegroup=None):
     """Run POINTLESS to get the list of allowed pointgroups (N.B. will
     insist on triclinic symmetry for this scaling step) then run
@@ -22,6 +76,18 @@ def decide_pointgroup(p1_unit_cell, xds_inp, input_spacegroup=None):
     best pointgroup to use. Then return the correct pointgroup and
     cell.
     """
+    results, resolution_high = p1_correct(p1_unit_cell, xds_inp)
+    unit_cell, space_group_number = select_pointgroup(
+        results, input_spacegroup=input_spacegroup
+    )
+
+    return unit_cell, space_group_number, resolution_high
+
+
+def p1_inp(p1_unit_cell, xds_inp):
+    """The text of the input for CORRECT in P1, limiting DATA_RANGE in
+    xds_inp to at most 360 degrees.
+    """
     assert p1_unit_cell
 
     start, end = map(int, xds_inp["DATA_RANGE"].split())
@@ -30,31 +96,76 @@ def decide_pointgroup(p1_unit_cell, xds_inp, input_spacegroup=None):
         end = start + int(round(360.0 / osc))
         xds_inp["DATA_RANGE"] = "%d %d" % (start, end)
 
-    with open("P1.INP", "w") as fout:
-        for k in sorted(xds_inp):
-            if "SEGMENT" in k:
-                continue
-            v = xds_inp[k]
-            if isinstance(v, list):
-                for _v in v:
-                    fout.write(f"{k}={_v}\n")
-            else:
-                fout.write(f"{k}={v}\n")
+    text = ""
+    for k in sorted(xds_inp):
+        if "SEGMENT" in k:
+            continue
+        v = xds_inp[k]
+        if isinstance(v, list):
+            for _v in v:
+                text += f"{k}={_v}\n"
+        else:
+            text += f"{k}={v}\n"
+
+    text += "SPACE_GROUP_NUMBER=1\n"
+    text += "UNIT_CELL_CONSTANTS={:f} {:f} {:f} {:f} {:f} {:f}\n".format(
+        *tuple(p1_unit_cell)
+    )
 
-        fout.write("SPACE_GROUP_NUMBER=1\n")
-        fout.write(
-            "UNIT_CELL_CONSTANTS={:f} {:f} {:f} {:f} {:f} {:f}\n".format(
-                *tuple(p1_unit_cell)
-            )
-        )
+    text += "JOB=CORRECT\n"
+    text += "REFINE(CORRECT)=CELL AXIS ORIENTATION POSITION BEAM\n"
+    text += "%s\n" % segment_text(xds_inp)
+
+    return text
+
+
+def p1_correct_current(p1_unit_cell, xds_inp):
+    """Check whether the P1 CORRECT and pointless results already on disk
+    (P1.LP, XDS_P1.HKL, pointless.xml) came from the same input as would be
+    used now, so can be reused. Friedel's law is ignored as it changes
+    neither the lattice nor the pointgroup.
+    """
+    for filename in ("P1.INP", "P1.LP", "XDS_P1.HKL", "pointless.xml"):
+        if not os.path.exists(filename):
+            return False
+
+    def relevant(text):
+        return [
+            record
+            for record in text.split("\n")
+            if not record.startswith("FRIEDEL'S_LAW=")
+        ]
+
+    with open("P1.INP") as fh:
+        previous = fh.read()
+
+    return relevant(previous) == relevant(p1_inp(p1_unit_cell, dict(xds_inp)))
+
+
+def reuse_p1_correct():
+    """Read back the results of an earlier p1_correct from P1.LP."""
+    results = read_xds_idxref_lp("P1.LP")
+    resolution_high = read_correct_lp_get_resolution("P1.LP")
 
-        fout.write("JOB=CORRECT\n")
-        fout.write("REFINE(CORRECT)=CELL AXIS ORIENTATION POSITION BEAM\n")
-        fout.write("%s\n" % segment_text(xds_inp))
+    return results, resolution_high
+
+
+def p1_correct(p1_unit_cell, xds_inp):
+    """Run CORRECT in P1, returning the lattices XDS finds acceptable and an
+    estimate of the resolution limit.
+    """
+    with open("P1.INP", "w") as fout:
+        fout.write(p1_inp(p1_unit_cell, xds_inp))
 
     shutil.copyfile("P1.INP", "XDS.INP")
 
-    run_job("xds_par")
+    key = step_key("p1_correct", "P1.INP", xds_inp, depends=["INTEGRATE.HKL"])
+
+    if restore_step(key):
+        write("P1 scaling results restored from cache")
+    else:
+        stream_job("xds_par", stage="P1 CORRECT")
+        store_step(key, CORRECT_ARTEFACTS)
 
     shutil.copyfile("CORRECT.LP", "P1.LP")
 
@@ -66,6 +177,22 @@ def decide_pointgroup(p1_unit_cell, xds_inp, input_spacegroup=None):
 
     resolution_high = read_correct_lp_get_resolution("CORRECT.LP")
 
+    # also save the P1 XDS_ASCII.HKL file see
+    # http://trac.diamond.ac.uk/scientific_software/ticket/1106
+
+    shutil.copyfile("XDS_ASCII.HKL", "XDS_P1.HKL")
+
+    return results, resolution_high
+
+
+def select_pointgroup(results, input_spacegroup=None, run_pointless=True, strict=False):
+    """Run pointless on the P1 reflections from p1_correct, and return the
+    unit cell and space group number of the most likely pointgroup allowed
+    by the lattices in results (or matching input_spacegroup). If
+    run_pointless is False the existing pointless.xml is used. If strict,
+    an input_spacegroup with no indexing solution is an error rather than
+    ignored.
+    """
     # run pointless, get the list of suggested lattices and pointgroups
     # FIXME should use the program manager for this... yes, this will
     # check that the executable is available too!
@@ -73,18 +200,14 @@ def decide_pointgroup(p1_unit_cell, xds_inp, input_spacegroup=None):
     xdsin = "XDS_ASCII.HKL"
     xmlout = "pointless.xml"
 
-    pointless_log = run_job(
-        "pointless",
-        arguments=["xdsin", xdsin, "xmlout", xmlout],
-        stdin=["systematicabsences off"],
-    )
-
-    fout = open("pointless.log", "w")
-
-    for record in pointless_log:
-        fout.write(record)
-
-    fout.close()
+    if run_pointless:
+        stream_job(
+            "pointless",
+            arguments=["xdsin", xdsin, "xmlout", xmlout],
+            stdin=["systematicabsences off"],
+            stage="pointless",
+            log_file="pointless.log",
+        )
 
     # now read the XML file
 
@@ -114,6 +237,10 @@ def decide_pointgroup(p1_unit_cell, xds_inp, input_spacegroup=None):
                 break
 
         if not sg_accepted:
+            if strict:
+                raise RuntimeError(
+                    "no indexing solution for spacegroup %s" % input_spacegroup
+                )
             write(
                 "No indexing solution for spacegroup %s so ignoring" % input_spacegroup
             )
@@ -137,9 +264,4 @@ def decide_pointgroup(p1_unit_cell, xds_inp, input_spacegroup=None):
     # this should probably be a proper check...
     assert space_group_number
 
-    # also save the P1 XDS_ASCII.HKL file see
-    # http://trac.diamond.ac.uk/scientific_software/ticket/1106
-
-    shutil.copyfile("XDS_ASCII.HKL", "XDS_P1.HKL")
-
-    return unit_cell, space_group_number, resolution_high
+    return unit_cell, space_group_number
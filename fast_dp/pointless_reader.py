@@ -2,8 +2,6 @@ from __future__ import annotations
 
 import xml.dom.minidom
 
-from cctbx import sgtbx
-
 from fast_dp.cell_spacegroup import lauegroup_to_lattice
 
 
@@ -12,6 +10,8 @@ def read_pointless_xml(pointless_xml_file):
     numbers in order of likelihood, corresponding to the pointgroup of the
     data.
     """
+    from cctbx import sgtbx
+
     dom = xml.dom.minidom.parse(pointless_xml_file)
 
     scorelist = dom.getElementsByTagName("LaueGroupScoreList")[0]
@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+import json
+import math
+
+from fast_dp.logger import write
+from fast_dp.reflections import load_reflections
+
+# merging statistics computed directly from XDS_ASCII.HKL as soon as
+# CORRECT has finished, to give a first look at the data while pointless
+# and Aimless are still running: the reflections are gathered into unique
+# groups (merging I+ and I-) by the largest of their equivalent indices,
+# then everything else is sums over the groups
+
+
+def symmetry_rotations(space_group_number):
+    """The rotation matrices of the space group, as a numpy array."""
+    import numpy
+    from cctbx import sgtbx
+
+    group = sgtbx.space_group_info(number=space_group_number).group()
+    return numpy.array(
+        [numpy.reshape(op.r().as_double(), (3, 3)) for op in group.smx()]
+    )
+
+
+def possible_d_spacings(unit_cell, space_group_number, d_min, d_max):
+    """The resolution of every unique reflection which could be measured."""
+    from cctbx import crystal, miller, sgtbx
+
+    symmetry = crystal.symmetry(
+        unit_cell=tuple(unit_cell),
+        space_group_info=sgtbx.space_group_info(number=space_group_number),
+    )
+    possible = miller.build_set(
+        symmetry, anomalous_flag=False, d_min=d_min, d_max=d_max
+    )
+    return possible.d_spacings().data().as_numpy_array()
+
+
+def inverse_d_squared(hkl, unit_cell):
+    """1 / d^2 for each of the indices hkl from the reciprocal metric."""
+    import numpy
+
+    a, b, c, alpha, beta, gamma = unit_cell
+    ca, cb, cg = (math.cos(math.radians(angle)) for angle in (alpha, beta, gamma))
+    metric = numpy.array(
+        [
+            [a * a, a * b * cg, a * c * cb],
+            [a * b * cg, b * b, b * c * ca],
+            [a * c * cb, b * c * ca, c * c],
+        ]
+    )
+    return numpy.einsum("ij,jk,ik->i", hkl, numpy.linalg.inv(metric), hkl)
+
+
+def merging_statistics(
+    hkl, intensity, sigma, unit_cell, rotations, possible=None, n_bins=10
+):
+    """Compute the merging statistics of the unmerged reflections, overall
+    and in n_bins shells equally spaced in 1/d^2, as a list of dictionaries
+    with the same keys as merge.aimless_statistics. Completeness needs the
+    resolution of every possible reflection, else is reported as zero.
+    """
+    import numpy
+
+    keep = sigma > 0
+    hkl = numpy.rint(hkl[keep]).astype(numpy.int64)
+    intensity = intensity[keep]
+    sigma = sigma[keep]
+    if not len(hkl):
+        raise RuntimeError("no reflections to merge")
+
+    # the largest equivalent index under the pointgroup and inversion
+    offset = 1 + int(numpy.abs(hkl).max())
+    size = 2 * offset + 1
+    key = None
+    for rotation in numpy.rint(rotations).astype(numpy.int64):
+        equivalent = hkl @ rotation
+        for sign in (1, -1):
+            e = sign * equivalent + offset
+            k = (e[:, 0] * size + e[:, 1]) * size + e[:, 2]
+            key = k if key is None else numpy.maximum(key, k)
+
+    _, group, n = numpy.unique(key, return_inverse=True, return_counts=True)
+    group = group.ravel()
+    n_groups = len(n)
+
+    def total(values, mask=None):
+        if mask is None:
+            return numpy.bincount(group, values, minlength=n_groups)
+        return numpy.bincount(group[mask], values[mask], minlength=n_groups)
+
+    s = numpy.zeros(n_groups)
+    s[group] = inverse_d_squared(hkl, unit_cell)
+
+    mean = total(intensity) / n
+    deviation = total(numpy.abs(intensity - mean[group]))
+    weight = 1.0 / (sigma * sigma)
+    i_sig_i = (total(weight * intensity) / total(weight)) * numpy.sqrt(total(weight))
+
+    # CC 1/2 from a random but reproducible division of the observations
+    half = numpy.random.default_rng(0).integers(0, 2, len(intensity)).astype(bool)
+    n_1 = total(numpy.ones(len(intensity)), half)
+    n_2 = n - n_1
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        mean_1 = total(intensity, half) / n_1
+        mean_2 = total(intensity, ~half) / n_2
+    paired = (n_1 > 0) & (n_2 > 0)
+
+    edges = numpy.linspace(s.min(), s.max(), n_bins + 1)
+    shell = numpy.clip(numpy.searchsorted(edges, s, side="right") - 1, 0, n_bins - 1)
+
+    if possible is not None:
+        possible_s = 1.0 / (possible * possible)
+        possible_s = possible_s[(possible_s >= edges[0]) & (possible_s <= edges[-1])]
+        possible_shell = numpy.clip(
+            numpy.searchsorted(edges, possible_s, side="right") - 1, 0, n_bins - 1
+        )
+
+    def statistics(selected, possible_count):
+        multiple = selected & (n > 1)
+        denominator = total(intensity)[multiple].sum()
+        pairs = selected & paired
+        cc_half = 0.0
+        if pairs.sum() > 2:
+            cc_half = float(numpy.corrcoef(mean_1[pairs], mean_2[pairs])[0, 1])
+        d = 1.0 / numpy.sqrt(s[selected])
+        return {
+            "cc_half": cc_half,
+            "completeness": 100.0 * selected.sum() / possible_count
+            if possible_count
+            else 0.0,
+            "mean_i_sig_i": float(i_sig_i[selected].mean()),
+            "multiplicity": float(n[selected].sum() / selected.sum()),
+            "n_tot_obs": int(n[selected].sum()),
+            "n_tot_unique_obs": int(selected.sum()),
+            "r_meas_all_iplusi_minus": float(
+                (numpy.sqrt(n / numpy.maximum(n - 1, 1)) * deviation)[multiple].sum()
+                / denominator
+            )
+            if denominator
+            else 0.0,
+            "r_merge": float(deviation[multiple].sum() / denominator)
+            if denominator
+            else 0.0,
+            "res_lim_high": float(d.min()),
+            "res_lim_low": float(d.max()),
+        }
+
+    shells = []
+    for j in range(n_bins):
+        selected = shell == j
+        if selected.any():
+            count = (possible_shell == j).sum() if possible is not None else 0
+            shells.append(statistics(selected, count))
+
+    overall = statistics(
+        numpy.ones(n_groups, dtype=bool), len(possible_s) if possible is not None else 0
+    )
+
+    return [overall] + shells
+
+
+def quick_stats(hklin="XDS_ASCII.HKL", n_bins=10):
+    """Compute the merging statistics for hklin (from its column file if
+    there is one), returning them by shell as merge.aimless_statistics
+    does, with all of the shells as "shells".
+    """
+    header, columns = load_reflections(hklin)
+
+    import numpy
+
+    unit_cell = tuple(map(float, header["UNIT_CELL_CONSTANTS"].split()))
+    space_group_number = int(header["SPACE_GROUP_NUMBER"])
+    hkl = numpy.stack([columns["H"], columns["K"], columns["L"]], axis=1).astype(
+        numpy.float64
+    )
+
+    s = inverse_d_squared(hkl, unit_cell)
+    s = s[s > 0]
+    possible = possible_d_spacings(
+        unit_cell,
+        space_group_number,
+        0.999 / math.sqrt(s.max()),
+        1.001 / math.sqrt(s.min()),
+    )
+
+    results = merging_statistics(
+        hkl,
+        numpy.asarray(columns["IOBS"], dtype=numpy.float64),
+        numpy.asarray(columns["SIGMA"], dtype=numpy.float64),
+        unit_cell,
+        symmetry_rotations(space_group_number),
+        possible=possible,
+        n_bins=n_bins,
+    )
+
+    return {
+        "overall": results[0],
+        "innerShell": results[1],
+        "outerShell": results[-1],
+        "shells": results[1:],
+    }
+
+
+def write_quick_stats(statistics, filename="quick_stats.json"):
+    """Write out the statistics from quick_stats to the log, as
+    merge.parse_aimless_log does, and as JSON to filename.
+    """
+    with open(filename, "w") as fh:
+        json.dump(statistics, fh, indent=2)
+
+    def column(name):
+        return tuple(
+            statistics[shell][name] for shell in ("overall", "innerShell", "outerShell")
+        )
+
+    write(80 * "-")
+    write("Quick statistics from XDS_ASCII.HKL (final numbers from Aimless)")
+    write(
+        "%20s " % "Low resolution"
+        + "{:6.2f} {:6.2f} {:6.2f}".format(*column("res_lim_low"))
+    )
+    write(
+        "%20s " % "High resolution"
+        + "{:6.2f} {:6.2f} {:6.2f}".format(*column("res_lim_high"))
+    )
+    write("%20s " % "Rmerge" + "{:6.3f} {:6.3f} {:6.3f}".format(*column("r_merge")))
+    write(
+        "%20s " % "Rmeas"
+        + "{:6.3f} {:6.3f} {:6.3f}".format(*column("r_meas_all_iplusi_minus"))
+    )
+    write(
+        "%20s " % "I/sigma" + "{:6.2f} {:6.2f} {:6.2f}".format(*column("mean_i_sig_i"))
+    )
+    write(
+        "%20s " % "Completeness"
+        + "{:6.1f} {:6.1f} {:6.1f}".format(*column("completeness"))
+    )
+    write(
+        "%20s " % "Multiplicity"
+        + "{:6.1f} {:6.1f} {:6.1f}".format(*column("multiplicity"))
+    )
+    write("%20s " % "CC 1/2" + "{:6.3f} {:6.3f} {:6.3f}".format(*column("cc_half")))
+    write("%20s " % "Nrefl" + "%6d %6d %6d" % column("n_tot_obs"))
+    write("%20s " % "Nunique" + "%6d %6d %6d" % column("n_tot_unique_obs"))
+    write(80 * "-")
+
+
+def run_quick_stats(hklin="XDS_ASCII.HKL"):
+    """Compute and write out the quick statistics, reporting rather than
+    failing if they cannot be computed, as Aimless gives the final numbers.
+    """
+    try:
+        write_quick_stats(quick_stats(hklin))
+    except (ImportError, KeyError, RuntimeError) as e:
+        write("Quick statistics failed: %s" % e)
@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import re
+import struct
+
+from fast_dp.logger import write
+
+# reading the reflection files written by XDS (INTEGRATE.HKL, XDS_ASCII.HKL
+# and friends) straight into numpy arrays: the file is memory mapped and
+# the block of numbers between the header and !END_OF_DATA converted in one
+# call, rather than record by record in Python - and a binary columnar
+# copy of the essential columns alongside (XDS_ASCII.HKL -> XDS_ASCII.cols)
+# which can be memory mapped directly, so the text need only be parsed once
+
+_magic = b"FDPCOLS1"
+
+_sidecar_columns = (
+    ("H", "<i4"),
+    ("K", "<i4"),
+    ("L", "<i4"),
+    ("IOBS", "<f4"),
+    ("SIGMA", "<f4"),
+    ("XD", "<f4"),
+    ("YD", "<f4"),
+    ("ZD", "<f4"),
+    ("BATCH", "<i4"),
+)
+
+_keyword = re.compile(r"([A-Z][A-Z0-9_'()]*)=\s*(.*?)\s*(?=[A-Z][A-Z0-9_'()]*=|$)")
+
+
+def _column_names(header_lines, n_items):
+    """The names of the columns, from the !ITEM_X=n records of XDS_ASCII.HKL
+    or the !H,K,L,... list of INTEGRATE.HKL.
+    """
+    names = {}
+    listed = []
+    for line in header_lines:
+        if line.startswith("!ITEM_"):
+            name, column = line[6:].split("=")
+            names[int(column) - 1] = name.strip()
+        elif line.startswith("!H,K,L") or (listed and "," in line and "=" not in line):
+            listed.extend(name.strip() for name in line[1:].split(",") if name.strip())
+
+    if not names:
+        names = dict(enumerate(listed))
+
+    names = [names.get(j, "ITEM_%d" % (j + 1)) for j in range(n_items)]
+    return ["SIGMA" if name == "SIGMA(IOBS)" else name for name in names]
+
+
+def read_xds_hkl(filename="XDS_ASCII.HKL"):
+    """Read an XDS reflection file, returning the header keywords as a
+    dictionary of strings and the data as a dictionary of numpy arrays by
+    column name (H, K, L, IOBS, SIGMA, ...).
+    """
+    import numpy
+
+    with open(filename, "rb") as fh:
+        try:
+            mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise RuntimeError("%s is empty" % filename)
+
+    with mm:
+        header_lines = []
+        while True:
+            start = mm.tell()
+            line = mm.readline()
+            if not line.startswith(b"!") or line.startswith(b"!END_OF_DATA"):
+                break
+            header_lines.append(line.decode("latin-1").rstrip())
+            if line.startswith(b"!END_OF_HEADER"):
+                start = mm.tell()
+                break
+
+        end = mm.find(b"!END_OF_DATA", start)
+        if end < 0:
+            end = len(mm)
+
+        data = numpy.fromstring(mm[start:end], dtype=numpy.float64, sep=" ")
+
+    header = {}
+    for line in header_lines:
+        for key, value in _keyword.findall(line[1:]):
+            header.setdefault(key, value)
+
+    if "NUMBER_OF_ITEMS_IN_EACH_DATA_RECORD" not in header:
+        raise RuntimeError("%s is not an XDS reflection file" % filename)
+    n_items = int(header["NUMBER_OF_ITEMS_IN_EACH_DATA_RECORD"])
+    if data.size % n_items:
+        raise RuntimeError("%s is truncated" % filename)
+
+    data = data.reshape(-1, n_items)
+    columns = {
+        name: data[:, j] for j, name in enumerate(_column_names(header_lines, n_items))
+    }
+
+    return header, columns
+
+
+def _aligned(offset):
+    return (offset + 63) // 64 * 64
+
+
+def sidecar_filename(hklin):
+    return os.path.splitext(hklin)[0] + ".cols"
+
+
+def write_columns(hklin="XDS_ASCII.HKL", filename=None):
+    """Write the H, K, L, IOBS, SIGMA, XD, YD, ZD columns from hklin, and
+    the image number of each reflection as BATCH, to a binary file of one
+    contiguous array per column, for load_columns. Returns the filename.
+    """
+    import numpy
+
+    filename = filename or sidecar_filename(hklin)
+    source = os.stat(hklin)
+    header, columns = read_xds_hkl(hklin)
+    if "ZD" in columns:
+        columns["BATCH"] = numpy.floor(columns["ZD"]) + 1
+
+    arrays = [
+        (name, numpy.ascontiguousarray(columns[name], dtype=dtype))
+        for name, dtype in _sidecar_columns
+        if name in columns
+    ]
+
+    # each column starts on a 64 byte boundary, counting from the first
+    metadata = {
+        "header": header,
+        "n_reflections": len(arrays[0][1]) if arrays else 0,
+        "source": {"size": source.st_size, "mtime_ns": source.st_mtime_ns},
+        "columns": [],
+    }
+    offset = 0
+    for name, array in arrays:
+        metadata["columns"].append(
+            {"name": name, "dtype": array.dtype.str, "offset": offset}
+        )
+        offset = _aligned(offset + array.nbytes)
+
+    text = json.dumps(metadata).encode()
+    start = _aligned(len(_magic) + 8 + len(text))
+
+    tmp = "%s.%d" % (filename, os.getpid())
+    with open(tmp, "wb") as fh:
+        fh.write(_magic + struct.pack("<Q", len(text)) + text)
+        for column, (_, array) in zip(metadata["columns"], arrays):
+            fh.seek(start + column["offset"])
+            fh.write(array.tobytes())
+    os.replace(tmp, filename)
+
+    return filename
+
+
+def load_columns(filename):
+    """Map the columns written by write_columns, returning the header of
+    the original file and a dictionary of read-only numpy arrays.
+    """
+    import numpy
+
+    with open(filename, "rb") as fh:
+        if fh.read(len(_magic)) != _magic:
+            raise RuntimeError("%s is not a reflection column file" % filename)
+        (length,) = struct.unpack("<Q", fh.read(8))
+        metadata = json.loads(fh.read(length))
+
+    start = _aligned(len(_magic) + 8 + length)
+    n = metadata["n_reflections"]
+    columns = {}
+    for column in metadata["columns"]:
+        if n:
+            columns[column["name"]] = numpy.memmap(
+                filename,
+                dtype=column["dtype"],
+                mode="r",
+                offset=start + column["offset"],
+                shape=(n,),
+            )
+        else:
+            columns[column["name"]] = numpy.zeros(0, dtype=column["dtype"])
+
+    return metadata["header"], columns
+
+
+def columns_current(hklin):
+    """Whether the column file for hklin was written from it as it is now
+    (or hklin has since been removed).
+    """
+    filename = sidecar_filename(hklin)
+    if not os.path.exists(filename):
+        return False
+    if not os.path.exists(hklin):
+        return True
+    try:
+        with open(filename, "rb") as fh:
+            if fh.read(len(_magic)) != _magic:
+                return False
+            (length,) = struct.unpack("<Q", fh.read(8))
+            source = json.loads(fh.read(length))["source"]
+    except (OSError, ValueError, KeyError, struct.error):
+        return False
+    stat = os.stat(hklin)
+    return source == {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def load_reflections(hklin="XDS_ASCII.HKL"):
+    """Return the header and columns of hklin as read_xds_hkl does, from
+    the column file if that is up to date, else from the text.
+    """
+    if columns_current(hklin):
+        return load_columns(sidecar_filename(hklin))
+
+    import numpy
+
+    header, columns = read_xds_hkl(hklin)
+    if "ZD" in columns:
+        columns["BATCH"] = (numpy.floor(columns["ZD"]) + 1).astype(numpy.int32)
+    return header, columns
+
+
+def write_reflection_columns(hklins=("XDS_P1.HKL", "XDS_ASCII.HKL")):
+    """Write the column files for the reflections from CORRECT, reporting
+    rather than failing if this cannot be done, as they are only a cache.
+    """
+    for hklin in hklins:
+        if not os.path.exists(hklin) or columns_current(hklin):
+            continue
+        try:
+            write_columns(hklin)
+        except (ImportError, OSError, RuntimeError) as e:
+            write("Could not write reflection columns for %s: %s" % (hklin, e))
@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import os
+import socket
+import sqlite3
+import statistics
+import time
+
+# a record of every run on this machine - the detector, the number of
+# images, the job layout and how long each stage took - used to choose the
+# job layout for the next run, by fitting the time spent integrating as
+#
+#   wall = overhead + per_job * n_jobs + per_image * images / parallel
+#
+# where parallel is the number of cores actually available to the jobs
+
+__registry_filename = os.path.join(
+    os.environ.get(
+        "XDG_DATA_HOME", os.path.expanduser(os.path.join("~", ".local", "share"))
+    ),
+    "fast_dp",
+    "registry.sqlite",
+)
+
+_schema = """
+create table if not exists runs (
+    id integer primary key,
+    time real,
+    host text,
+    detector text,
+    images integer,
+    n_jobs integer,
+    n_cores integer,
+    cpus integer
+);
+create table if not exists stage_times (
+    run integer references runs(id),
+    stage text,
+    wall_time real
+);
+"""
+
+
+def set_registry(registry_filename):
+    """Keep the registry in registry_filename, or nowhere if this is None."""
+    global __registry_filename
+    __registry_filename = registry_filename
+
+
+def get_registry():
+    return __registry_filename
+
+
+def _connect():
+    os.makedirs(os.path.dirname(os.path.abspath(__registry_filename)), exist_ok=True)
+    connection = sqlite3.connect(__registry_filename, timeout=30)
+    connection.executescript(_schema)
+    return connection
+
+
+def detector_name(xds_inp):
+    """Identify the detector by type and size, from the XDS input."""
+    return "%s %sx%s" % (
+        xds_inp.get("DETECTOR", "unknown"),
+        xds_inp.get("NX", "?"),
+        xds_inp.get("NY", "?"),
+    )
+
+
+def record_run(detector, images, n_jobs, n_cores, resource_usage, cpus=None):
+    """Add a run to the registry, with the wall time of each stage from
+    resource_usage, on a machine with cpus cores (by default this one).
+    Failing to do so is not an error.
+    """
+    if not __registry_filename:
+        return
+
+    try:
+        with _connect() as connection:
+            run = connection.execute(
+                "insert into runs (time, host, detector, images, n_jobs, n_cores, "
+                "cpus) values (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    time.time(),
+                    socket.gethostname(),
+                    detector,
+                    images,
+                    n_jobs,
+                    n_cores,
+                    cpus or os.cpu_count(),
+                ),
+            ).lastrowid
+            connection.executemany(
+                "insert into stage_times (run, stage, wall_time) values (?, ?, ?)",
+                [
+                    (run, stage, usage["wall_time"])
+                    for stage, usage in resource_usage.items()
+                ],
+            )
+        connection.close()
+    except (OSError, sqlite3.Error):
+        pass
+
+
+def history(detector, stage="integrate"):
+    """Return the earlier runs with detector as a list of dictionaries
+    of images, n_jobs, n_cores, cpus and the wall_time for stage.
+    """
+    if not __registry_filename or not os.path.exists(__registry_filename):
+        return []
+
+    try:
+        connection = _connect()
+        rows = connection.execute(
+            "select images, n_jobs, n_cores, cpus, wall_time from runs "
+            "join stage_times on stage_times.run = runs.id "
+            "where detector = ? and stage = ? order by time",
+            (detector, stage),
+        ).fetchall()
+        connection.close()
+    except sqlite3.Error:
+        return []
+
+    return [
+        dict(zip(("images", "n_jobs", "n_cores", "cpus", "wall_time"), row))
+        for row in rows
+    ]
+
+
+def _parallel(n_jobs, n_cores, cpus):
+    return max(1, min(n_jobs * (n_cores or cpus), cpus))
+
+
+def _solve(a, b):
+    """Solve a x = b by Gaussian elimination, returning None if singular."""
+    n = len(b)
+    m = [list(a[j]) + [b[j]] for j in range(n)]
+    for j in range(n):
+        pivot = max(range(j, n), key=lambda k: abs(m[k][j]))
+        if abs(m[pivot][j]) < 1e-9:
+            return None
+        m[j], m[pivot] = m[pivot], m[j]
+        for k in range(n):
+            if k != j:
+                f = m[k][j] / m[j][j]
+                m[k] = [x - f * y for x, y in zip(m[k], m[j])]
+    return [m[j][n] / m[j][j] for j in range(n)]
+
+
+def fit_model(runs):
+    """Fit (overhead, per_job, per_image) to the integration times of runs
+    by least squares, leaving out the per job term if the runs do not vary
+    in number of jobs. Returns None if there is not enough history.
+    """
+    if len(runs) < 2:
+        return None
+
+    rows = [
+        (
+            1.0,
+            float(run["n_jobs"]),
+            run["images"] / _parallel(run["n_jobs"], run["n_cores"], run["cpus"]),
+            run["wall_time"],
+        )
+        for run in runs
+    ]
+
+    use = [0, 1, 2] if len({row[1] for row in rows}) > 1 and len(runs) >= 3 else [0, 2]
+
+    a = [[sum(row[i] * row[j] for row in rows) for j in use] for i in use]
+    b = [sum(row[i] * row[3] for row in rows) for i in use]
+    x = _solve(a, b)
+    if x is None:
+        return None
+
+    model = dict(zip(use, x))
+    overhead, per_job, per_image = model[0], model.get(1, 0.0), model[2]
+
+    # nonsense from too little or too noisy history
+    if per_image <= 0:
+        return None
+
+    return overhead, max(per_job, 0.0), per_image
+
+
+def predict(model, images, n_jobs, n_cores, cpus):
+    overhead, per_job, per_image = model
+    return max(
+        0.0,
+        overhead
+        + per_job * n_jobs
+        + per_image * images / _parallel(n_jobs, n_cores, cpus),
+    )
+
+
+def choose_layout(detector, images, max_n_jobs, cpus, n_cores=0):
+    """Choose the number of jobs and cores per job (unless n_cores is given)
+    to integrate images in the least time, from the history for detector.
+    Returns (n_jobs, n_cores, predicted wall time) or None if there is not
+    enough history.
+    """
+    model = fit_model(history(detector))
+    if model is None:
+        return None
+
+    best = None
+    for n_jobs in range(1, max(1, max_n_jobs) + 1):
+        if n_cores:
+            choices = [n_cores]
+        else:
+            choices = [c for c in range(1, cpus + 1) if n_jobs * c <= cpus] or [1]
+        for cores in choices:
+            wall = predict(model, images, n_jobs, cores, cpus)
+            # prefer fewer jobs (then fewer cores) when no slower
+            if best is None or wall < best[2] - 1e-6:
+                best = (n_jobs, cores, wall)
+
+    return best
+
+
+def predict_stages(detector, images):
+    """Predict the time for each stage other than integration from the
+    median time per image in earlier runs with detector.
+    """
+    if not __registry_filename or not os.path.exists(__registry_filename):
+        return {}
+
+    try:
+        connection = _connect()
+        rows = connection.execute(
+            "select stage, wall_time, images from runs "
+            "join stage_times on stage_times.run = runs.id "
+            "where detector = ? and stage != 'integrate' and images > 0",
+            (detector,),
+        ).fetchall()
+        connection.close()
+    except sqlite3.Error:
+        return {}
+
+    per_image = {}
+    for stage, wall_time, run_images in rows:
+        per_image.setdefault(stage, []).append(wall_time / run_images)
+
+    return {
+        stage: statistics.median(values) * images for stage, values in per_image.items()
+    }
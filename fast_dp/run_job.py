@@ -1,12 +1,171 @@
 from __future__ import annotations
 
+import collections
+import multiprocessing
 import os
+import signal
 import subprocess
+import sys
+import threading
+import time
 
+# per-stage accounting of the resources used by external programs: each
+# call to run_job is recorded against a stage name, and wait4 used to get
+# the resource usage of that child (and everything it waited for) - this is
+# not available on e.g. Windows, in which case only the wall time is kept
 
-def run_job(executable, arguments=[], stdin=[], working_directory=None):
+_resource_usage = {}
+_resource_usage_lock = threading.Lock()
+
+
+# the process groups of the jobs running now: each job is started in a
+# session of its own, so that it and everything it starts can be killed
+# together, which also means signals to fast_dp never reach them - so they
+# are killed here, from run_stages or a signal handler (see
+# stop_jobs_on_signal). Once stopped, no new jobs start until allow_jobs
+
+_jobs = set()
+_jobs_lock = threading.Lock()
+_stopping = threading.Event()
+
+
+def stop_jobs():
+    """Kill every job running, with everything each started, and any worker
+    processes (which kill their own jobs on SIGTERM), and start no more.
+    """
+    _stopping.set()
+    with _jobs_lock:
+        jobs = list(_jobs)
+    for pgid in jobs:
+        try:
+            os.killpg(pgid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    for child in multiprocessing.active_children():
+        child.terminate()
+
+
+def allow_jobs():
+    _stopping.clear()
+
+
+def stop_jobs_on_signal():
+    """Stop the jobs on SIGINT or SIGTERM, then raise KeyboardInterrupt or
+    SystemExit as usual. Call from the main thread.
+    """
+
+    def stop(signum, frame):
+        stop_jobs()
+        if signum == signal.SIGINT:
+            raise KeyboardInterrupt
+        raise SystemExit(128 + signum)
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, stop)
+
+
+def _max_rss_kb(rusage):
+    """ru_maxrss is in kB on Linux but in bytes on macOS."""
+    if sys.platform == "darwin":
+        return rusage.ru_maxrss // 1024
+    return rusage.ru_maxrss
+
+
+def _stage_usage(stage):
+    """The totals for stage, which must be called holding the lock."""
+    return _resource_usage.setdefault(
+        stage,
+        {
+            "calls": 0,
+            "wall_time": 0.0,
+            "user_time": 0.0,
+            "system_time": 0.0,
+            "max_rss_kb": 0,
+        },
+    )
+
+
+def record_resource_usage(stage, wall_time, rusage=None):
+    """Add the resources used by one job to the totals for stage."""
+    with _resource_usage_lock:
+        usage = _stage_usage(stage)
+        usage["calls"] += 1
+        usage["wall_time"] += wall_time
+        if rusage is not None:
+            usage["user_time"] += rusage.ru_utime
+            usage["system_time"] += rusage.ru_stime
+            usage["max_rss_kb"] = max(usage["max_rss_kb"], _max_rss_kb(rusage))
+
+
+def merge_resource_usage(resource_usage):
+    """Add resource usage recorded elsewhere (e.g. in a worker process, from
+    get_resource_usage there) to the totals here.
+    """
+    with _resource_usage_lock:
+        for stage, other in resource_usage.items():
+            usage = _stage_usage(stage)
+            for name in ("calls", "wall_time", "user_time", "system_time"):
+                usage[name] += other[name]
+            usage["max_rss_kb"] = max(usage["max_rss_kb"], other["max_rss_kb"])
+
+
+def get_resource_usage():
+    """Return the resource usage recorded so far, keyed by stage, in the
+    order in which the stages were first run.
+    """
+    with _resource_usage_lock:
+        return {stage: dict(usage) for stage, usage in _resource_usage.items()}
+
+
+def reset_resource_usage():
+    with _resource_usage_lock:
+        _resource_usage.clear()
+
+
+def _wait(popen):
+    """Wait for popen to finish, returning the resource usage of the child
+    if the platform can tell us.
+    """
+    if not hasattr(os, "wait4"):
+        popen.wait()
+        return None
+
+    pid, status, rusage = os.wait4(popen.pid, 0)
+    popen.returncode = os.waitstatus_to_exitcode(status)
+    return rusage
+
+
+def run_job(executable, arguments=[], stdin=[], working_directory=None, stage=None):
     """Run a program with some command-line arguments and some input,
-    then return the standard output when it is finished.
+    then return the standard output when it is finished. The time and
+    resources used are recorded against stage (by default the name of
+    the executable).
+    """
+    return stream_job(
+        executable,
+        arguments=arguments,
+        stdin=stdin,
+        working_directory=working_directory,
+        stage=stage,
+        tail=None,
+    )
+
+
+def stream_job(
+    executable,
+    arguments=[],
+    stdin=[],
+    working_directory=None,
+    stage=None,
+    log_file=None,
+    handlers=(),
+    tail=100,
+):
+    """Run a program as run_job, but write the standard output to log_file
+    as it arrives and pass every record to each of the handlers in turn,
+    keeping only the last tail records in memory: these are returned. If a
+    handler raises an exception the program is terminated and the exception
+    passed on, so errors can be picked up while the program is running.
     """
     if working_directory is None:
         working_directory = os.getcwd()
@@ -15,6 +174,11 @@ def run_job(executable, arguments=[], stdin=[], working_directory=None):
     for arg in arguments:
         command_line += ' "%s"' % arg
 
+    start_time = time.time()
+
+    if _stopping.is_set():
+        raise RuntimeError("stopping, so not running %s" % executable)
+
     popen = subprocess.Popen(
         command_line,
         bufsize=1,
@@ -24,23 +188,54 @@ def run_job(executable, arguments=[], stdin=[], working_directory=None):
         cwd=working_directory,
         universal_newlines=True,
         shell=True,
+        start_new_session=True,
     )
+    with _jobs_lock:
+        _jobs.add(popen.pid)
 
     for record in stdin:
         popen.stdin.write("%s\n" % record)
 
     popen.stdin.close()
 
-    output = []
+    output = collections.deque(maxlen=tail)
+
+    fout = None
+    if log_file:
+        fout = open(os.path.join(working_directory, log_file), "w", buffering=1)
+
+    try:
+        while True:
+            record = popen.stdout.readline()
+            if not record:
+                break
+
+            if fout:
+                fout.write(record)
+            for handler in handlers:
+                handler(record)
+
+            output.append(record)
+
+    except BaseException:
+        # the shell and everything it started, not just the shell
+        try:
+            os.killpg(popen.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        raise
 
-    while True:
-        record = popen.stdout.readline()
-        if not record:
-            break
+    finally:
+        if fout:
+            fout.close()
+        popen.stdout.close()
+        rusage = _wait(popen)
+        with _jobs_lock:
+            _jobs.discard(popen.pid)
 
-        output.append(record)
+        record_resource_usage(stage or executable, time.time() - start_time, rusage)
 
-    return output
+    return list(output)
 
 
 if __name__ == "__main__":
@@ -4,7 +4,15 @@ import shutil
 
 from fast_dp.autoindex import segment_text
 from fast_dp.cell_spacegroup import spacegroup_number_to_name
-from fast_dp.run_job import run_job
+from fast_dp.logger import write
+from fast_dp.lp_parser import LPFile, last_record
+from fast_dp.run_job import stream_job
+from fast_dp.step_cache import (
+    CORRECT_ARTEFACTS,
+    restore_step,
+    step_key,
+    store_step,
+)
 from fast_dp.xds_reader import read_xparm_get_refined_beam
 
 
@@ -41,12 +49,17 @@ def scale(unit_cell, xds_inp, space_group_number, resolution_high=0.0):
 
     shutil.copyfile("CORRECT.INP", "XDS.INP")
 
-    run_job("xds_par")
+    key = step_key("correct", "CORRECT.INP", xds_inp, depends=["INTEGRATE.HKL"])
+
+    if restore_step(key):
+        write("Scaling results restored from cache")
+    else:
+        stream_job("xds_par", stage="CORRECT")
 
     # once again should check on the general happiness of everything...
 
     for step in ["CORRECT"]:
-        lastrecord = open("%s.LP" % step).readlines()[-1]
+        lastrecord = last_record("%s.LP" % step)
         if "!!! ERROR !!!" in lastrecord:
             raise RuntimeError(
                 "error in {}: {}".format(
@@ -54,6 +67,8 @@ def scale(unit_cell, xds_inp, space_group_number, resolution_high=0.0):
                 )
             )
 
+    store_step(key, CORRECT_ARTEFACTS)
+
     # and get the postrefined cell constants from GXPARM.XDS - but continue
     # to work for the old format too...
 
@@ -71,16 +86,19 @@ def scale(unit_cell, xds_inp, space_group_number, resolution_high=0.0):
     # FIXME also get the postrefined mosaic spread out...
 
     # and the total number of good reflections
-    nref = 0
-    for record in open("CORRECT.LP"):
-        if "NUMBER OF ACCEPTED OBSERVATIONS" in record:
-            nref = int(record.split()[-1])
+    with LPFile("CORRECT.LP") as lp:
+        nref = lp.accepted_observations()
 
     refined_beam = read_xparm_get_refined_beam("GXPARM.XDS")
 
-    # hack in xdsstat (but don't cry if it fails)
-    xdsstat_output = run_job("xdsstat", [], ["XDS_ASCII.HKL"])
-    with open("xdsstat.log", "w") as fh:
-        fh.write("".join(xdsstat_output))
-
     return unit_cell, space_group, nref, refined_beam
+
+
+def xdsstat():
+    """Run xdsstat on the scaled reflections from CORRECT - this only writes
+    xdsstat.log so can run alongside merging.
+    """
+    # hack in xdsstat (but don't cry if it fails)
+    stream_job(
+        "xdsstat", [], ["XDS_ASCII.HKL"], stage="xdsstat", log_file="xdsstat.log"
+    )
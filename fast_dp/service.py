@@ -0,0 +1,489 @@
+#!/usr/bin/env python
+# service.py
+#
+# A long running fast_dp, which imports dxtbx, cctbx and iotbx and finds the
+# HDF5 plugin once, then processes each dataset in a worker forked from
+# itself so none of that has to be repeated. Start it with
+#
+#   fast_dp-service --socket /tmp/fast_dp.sock --watch /dls/i04/data/today \
+#       --cores 32 -- [fast_dp options for every dataset]
+#
+# and it will take datasets from two places:
+#
+#   - a line in the format of a fast_dp --batch manifest sent to the socket,
+#     e.g. with fast_dp-service --socket /tmp/fast_dp.sock --submit -a Se
+#     /dls/i04/data/thing_1_00001.cbf, which replies with the name and
+#     working directory of the dataset (or "status" for what is queued,
+#     running and finished);
+#   - a new sweep in one of the watched directories, once nothing has been
+#     written to it for --settle seconds (sweeps already complete when the
+#     service starts are left alone).
+#
+# Each dataset gets its own working directory under the current directory,
+# and the cores and XDS jobs in use are kept within --cores and --jobs as
+# with fast_dp --batch. The outcome of each is added to fast_dp_service.json.
+from __future__ import annotations
+
+import contextlib
+import importlib
+import json
+import os
+import re
+import select
+import shlex
+import signal
+import socket
+import sys
+import time
+import traceback
+from optparse import OptionParser
+
+from fast_dp.batch import (
+    dataset_name,
+    fast_dp_arguments,
+    finish_dataset,
+    fit_budget,
+    next_dataset,
+    parse_dataset,
+    write_summary,
+)
+from fast_dp.fast_dp import main as fast_dp_main
+from fast_dp.image_names import image2image, image2template
+from fast_dp.image_readers import find_hdf5_lib, set_lib_name
+from fast_dp.logger import set_filename, write
+from fast_dp.run_job import stop_jobs_on_signal
+
+# the modules fast_dp imports only when they are needed
+_warm_modules = (
+    "dxtbx.model.experiment_list",
+    "dxtbx.serialize.xds",
+    "cctbx.crystal",
+    "cctbx.miller",
+    "cctbx.sgtbx",
+    "cctbx.sgtbx.bravais_types",
+    "cctbx.uctbx",
+    "iotbx.mtz",
+    "h5py",
+    "numpy",
+)
+
+_image_extensions = (".cbf", ".cbf.gz", ".cbf.bz2", ".img", ".mccd", ".h5")
+
+_hdf5_data = re.compile(r"(.*)_data_[0-9]+\.h5\Z")
+
+
+def warm_up(lib_name=None):
+    """Import everything fast_dp would import for each dataset and find the
+    HDF5 plugin, so the workers forked from this process start with them.
+    """
+    for module in _warm_modules:
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            write("Not preloading %s: %s" % (module, e))
+
+    if lib_name:
+        set_lib_name(lib_name)
+    write("HDF5 plugin: %s" % (find_hdf5_lib(lib_name=lib_name) or "not found"))
+
+
+def completed_sweeps(directory, settle):
+    """Find the sweeps in directory to which nothing has been written for
+    settle seconds, as a dictionary of template (or master file): first
+    image (or master file).
+    """
+    newest = {}
+    first = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            name = entry.name
+            if not name.endswith(_image_extensions) or not entry.is_file():
+                continue
+            data = _hdf5_data.match(name)
+            if name.endswith("_master.h5"):
+                key, number = name, 0
+            elif data:
+                key, number = data.group(1) + "_master.h5", None
+            else:
+                try:
+                    key, number = image2template(name), image2image(name)
+                except (RuntimeError, ValueError):
+                    continue
+            newest[key] = max(newest.get(key, 0.0), entry.stat().st_mtime)
+            if number is not None and (key not in first or number < first[key][0]):
+                first[key] = (number, name)
+
+    settled = time.time() - settle
+    return {
+        os.path.join(directory, key): os.path.join(directory, first[key][1])
+        for key in first
+        if newest[key] < settled
+    }
+
+
+def _worker(dataset, sockets=()):
+    """Run fast_dp for dataset in this process, forked from the service,
+    returning the exit status. The sockets of the service are closed.
+    """
+    try:
+        for sock in sockets:
+            if sock:
+                sock.close()
+        # stopped by the service with SIGTERM, which must reach the XDS jobs
+        stop_jobs_on_signal()
+
+        os.chdir(dataset["directory"])
+        output = os.open("fast_dp.stdout", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(output, 1)
+        os.dup2(output, 2)
+        os.close(devnull)
+        os.close(output)
+
+        set_filename("fast_dp.log")
+        sys.argv = dataset["command"]
+        fast_dp_main()
+        return 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        return 1
+    except BaseException:
+        traceback.print_exc()
+        return 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+
+def serve(
+    socket_path=None,
+    watch=(),
+    settle=10.0,
+    max_cores=1,
+    max_jobs=1,
+    defaults=(),
+    cores_per_job=4,
+    summary="fast_dp_service.json",
+    poll_interval=1.0,
+):
+    """Process the datasets sent to socket_path or found in the directories
+    in watch until interrupted, as described above.
+    """
+    listener = None
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(socket_path)
+        listener.listen(16)
+
+    seen = set()
+    for directory in watch:
+        seen.update(completed_sweeps(directory, settle))
+
+    waiting = []
+    running = {}
+    finished = []
+    free_cores = max_cores
+    free_jobs = max_jobs
+    index = 0
+    service_start = time.time()
+    stopping = []
+
+    # the connections with requests still arriving, and what has of each
+    clients = {}
+
+    def stop(signum, frame):
+        stopping.append(signum)
+
+    previous = {
+        signum: signal.signal(signum, stop)
+        for signum in (signal.SIGINT, signal.SIGTERM)
+    }
+
+    def submit(tokens):
+        nonlocal index
+        while True:
+            index += 1
+            dataset = parse_dataset(tokens, index, defaults, cores_per_job)
+            in_use = [other["name"] for other in waiting + list(running.values())]
+            if dataset["name"] not in in_use and not os.path.exists(dataset["name"]):
+                break
+            if dataset["name"] != dataset_name(index, dataset["image"]):
+                raise RuntimeError("%s already exists" % dataset["name"])
+        fit_budget(dataset, max_cores, max_jobs)
+        dataset["submitted"] = time.time()
+        waiting.append(dataset)
+        waiting.sort(key=lambda dataset: (-dataset["priority"], dataset["index"]))
+        write("%s: queued %s" % (dataset["name"], dataset["image"]))
+        return dataset
+
+    def status():
+        return {
+            "waiting": [dataset["name"] for dataset in waiting],
+            "running": [dataset["name"] for dataset in running.values()],
+            "finished": [
+                {
+                    "name": dataset["name"],
+                    "exit_status": dataset["exit_status"],
+                    "error": dataset["error"],
+                }
+                for dataset in finished
+            ],
+        }
+
+    def handle(connection, request):
+        with connection:
+            try:
+                line = request.decode().strip()
+                try:
+                    if line == "status":
+                        reply = status()
+                    else:
+                        dataset = submit(shlex.split(line))
+                        reply = {
+                            "name": dataset["name"],
+                            "directory": os.path.abspath(dataset["name"]),
+                        }
+                except (RuntimeError, ValueError) as e:
+                    reply = {"error": str(e)}
+                connection.settimeout(5.0)
+                connection.sendall(json.dumps(reply).encode() + b"\n")
+            except OSError as e:
+                write("Request failed: %s" % e)
+
+    def receive(connection):
+        """Read what has arrived from connection, handling the request once
+        all of it has.
+        """
+        try:
+            data = connection.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            write("Request failed: %s" % e)
+            data = b""
+        if data:
+            clients[connection] += data
+            if not clients[connection].endswith(b"\n"):
+                return
+        request = clients.pop(connection)
+        if request.strip():
+            handle(connection, request)
+        else:
+            connection.close()
+
+    def start(dataset):
+        nonlocal free_cores, free_jobs
+        dataset["directory"] = os.path.abspath(dataset["name"])
+        os.makedirs(dataset["directory"], exist_ok=True)
+        dataset["command"] = ["fast_dp"] + fast_dp_arguments(dataset)
+        dataset["start"] = time.time()
+        dataset["queued"] = dataset["start"] - dataset["submitted"]
+
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            os._exit(_worker(dataset, [listener, *clients]))
+
+        write(
+            "%s: started with %d x %d cores"
+            % (dataset["name"], dataset["jobs"], dataset["cores"])
+        )
+        free_cores -= dataset["jobs"] * dataset["cores"]
+        free_jobs -= dataset["jobs"]
+        running[pid] = dataset
+
+    def reap(options):
+        nonlocal free_cores, free_jobs
+        while running:
+            pid, exit_status = os.waitpid(-1, options)
+            if pid == 0:
+                return
+            if pid not in running:
+                continue
+            dataset = running.pop(pid)
+            free_cores += dataset["jobs"] * dataset["cores"]
+            free_jobs += dataset["jobs"]
+            finish_dataset(dataset, os.waitstatus_to_exitcode(exit_status))
+            finished.append(dataset)
+            write_summary(finished, max_cores, max_jobs, service_start, summary)
+
+    try:
+        while not stopping:
+            if listener:
+                readable, _, _ = select.select(
+                    [listener, *clients], [], [], poll_interval
+                )
+                for ready in readable:
+                    if ready is listener:
+                        connection, _ = listener.accept()
+                        connection.setblocking(False)
+                        clients[connection] = b""
+                    else:
+                        receive(ready)
+            else:
+                time.sleep(poll_interval)
+
+            for directory in watch:
+                try:
+                    sweeps = completed_sweeps(directory, settle)
+                except OSError as e:
+                    write("Cannot watch %s: %s" % (directory, e))
+                    continue
+                for key, image in sorted(sweeps.items()):
+                    if key not in seen:
+                        seen.add(key)
+                        submit([image])
+
+            reap(os.WNOHANG)
+
+            while not stopping:
+                dataset = next_dataset(waiting, free_cores, free_jobs)
+                if dataset is None:
+                    break
+                waiting.remove(dataset)
+                start(dataset)
+
+    finally:
+        for connection in clients:
+            connection.close()
+        if listener:
+            listener.close()
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(socket_path)
+
+        # stop what is running, and record what was never started
+        for pid in running:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        reap(0)
+        for dataset in waiting:
+            dataset["exit_status"] = None
+            finished.append(dataset)
+        write_summary(finished, max_cores, max_jobs, service_start, summary)
+
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+
+
+def submit(socket_path, request):
+    """Send request (a line of a manifest, or "status") to the service
+    listening on socket_path, returning the reply.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        connection.sendall(request.encode() + b"\n")
+        reply = b""
+        while not reply.endswith(b"\n"):
+            data = connection.recv(4096)
+            if not data:
+                break
+            reply += data
+    return json.loads(reply)
+
+
+def main():
+    """Main routine for fast_dp-service."""
+    parser = OptionParser(
+        usage="fast_dp-service [options] [-- fast_dp options for every dataset]"
+    )
+    parser.add_option(
+        "--socket", dest="socket", help="Take datasets from this Unix socket"
+    )
+    parser.add_option(
+        "--watch",
+        dest="watch",
+        action="append",
+        default=[],
+        help="Process new sweeps in this directory (may be repeated)",
+    )
+    parser.add_option(
+        "--settle",
+        dest="settle",
+        default="10",
+        help="Seconds after the last image is written that a sweep is complete",
+    )
+    parser.add_option(
+        "--cores",
+        dest="cores",
+        help="Cores to share between the datasets (default all)",
+    )
+    parser.add_option(
+        "--jobs",
+        dest="jobs",
+        help="XDS jobs to run at once (default one per core)",
+    )
+    parser.add_option(
+        "-l",
+        "--lib-name",
+        dest="lib_name",
+        help="HDF5 reader library (i.e. neggia etc.)",
+    )
+    parser.add_option(
+        "--submit",
+        dest="submit",
+        action="store_true",
+        default=False,
+        help="Send the rest of the command line to the service at --socket",
+    )
+    parser.add_option(
+        "--status",
+        dest="status",
+        action="store_true",
+        default=False,
+        help="Print what the service at --socket is doing",
+    )
+
+    # everything after --submit is the manifest line, fast_dp options and all
+    arguments = sys.argv[1:]
+    request = []
+    if "--submit" in arguments:
+        j = arguments.index("--submit")
+        arguments, request = arguments[: j + 1], arguments[j + 1 :]
+
+    (options, args) = parser.parse_args(arguments)
+
+    if options.submit or options.status:
+        if not options.socket:
+            parser.error("--submit and --status need --socket")
+        request = "status" if options.status else shlex.join(args + request)
+        print(json.dumps(submit(options.socket, request), indent=2))
+        sys.exit(0)
+
+    if not options.socket and not options.watch:
+        parser.error("You must give --socket or --watch")
+
+    max_cores = int(options.cores or os.cpu_count() or 1)
+    max_jobs = int(options.jobs or max_cores)
+    if max_cores < 1 or max_jobs < 1:
+        parser.error("--cores and --jobs must be at least 1")
+
+    defaults = list(args)
+    if options.lib_name:
+        defaults = ["--lib-name", options.lib_name] + defaults
+
+    set_filename("fast_dp_service.log")
+    warm_up(options.lib_name)
+    write(
+        "fast_dp-service: %d cores and %d XDS jobs in %s"
+        % (max_cores, max_jobs, os.getcwd())
+    )
+    serve(
+        options.socket and os.path.abspath(options.socket),
+        watch=[os.path.abspath(directory) for directory in options.watch],
+        settle=float(options.settle),
+        max_cores=max_cores,
+        max_jobs=max_jobs,
+        defaults=defaults,
+        cores_per_job=min(4, max_cores),
+    )
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import concurrent.futures
+import os
+
+from fast_dp.run_job import allow_jobs, stop_jobs
+
+
+class Stage:
+    """One step of the processing pipeline: a function to call, the files
+    it reads and the files it writes. A stage which has to follow another
+    without sharing any files (e.g. because it needs results held in
+    memory) can name it in after.
+    """
+
+    def __init__(self, name, function, inputs=(), outputs=(), after=()):
+        self.name = name
+        self.function = function
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.after = tuple(after)
+
+    def __repr__(self):
+        return "Stage(%s)" % self.name
+
+
+def stage_dependencies(stages):
+    """Work out which stages each stage depends on, from the files they
+    read and write and from the explicit orderings, and check that the
+    result is a graph which can actually be run.
+    """
+    names = [stage.name for stage in stages]
+    if len(set(names)) != len(names):
+        raise RuntimeError("duplicate stage names: %s" % " ".join(names))
+
+    producers = {}
+    for stage in stages:
+        for output in stage.outputs:
+            producers.setdefault(output, []).append(stage.name)
+
+    depends = {}
+    for stage in stages:
+        depends[stage.name] = set()
+        for name in stage.after:
+            if name not in names:
+                raise RuntimeError(f"stage {stage.name} after unknown stage {name}")
+            depends[stage.name].add(name)
+        for filename in stage.inputs:
+            for name in producers.get(filename, []):
+                if name != stage.name:
+                    depends[stage.name].add(name)
+
+    # check for cycles: repeatedly peel off stages with nothing outstanding
+    remaining = {name: set(depends[name]) for name in depends}
+    while remaining:
+        ready = [name for name in remaining if not remaining[name]]
+        if not ready:
+            raise RuntimeError("cycle in stages: %s" % " ".join(sorted(remaining)))
+        for name in ready:
+            del remaining[name]
+        for name in remaining:
+            remaining[name].difference_update(ready)
+
+    return depends
+
+
+def completed_stages(stages, completed, working_directory=None):
+    """Return the names of those stages in completed which can be trusted,
+    i.e. all of their outputs still exist and everything they depend on is
+    also complete.
+    """
+    if working_directory is None:
+        working_directory = os.getcwd()
+
+    depends = stage_dependencies(stages)
+
+    valid = set()
+    changed = True
+    while changed:
+        changed = False
+        for stage in stages:
+            if stage.name in valid or stage.name not in completed:
+                continue
+            if not depends[stage.name].issubset(valid):
+                continue
+            if all(
+                os.path.exists(os.path.join(working_directory, filename))
+                for filename in stage.outputs
+            ):
+                valid.add(stage.name)
+                changed = True
+
+    return [stage.name for stage in stages if stage.name in valid]
+
+
+def run_stages(
+    stages, max_workers=4, working_directory=None, completed=(), on_complete=None
+):
+    """Run the stages in a thread pool, starting each one as soon as all of
+    the stages it depends on have finished. Stages named in completed (see
+    completed_stages) are skipped, and on_complete called with the name of
+    each stage as it finishes. Returns a dictionary of the values returned
+    by each stage which was run. If a stage fails (or this is interrupted)
+    no new stages are started, the jobs of those already running are
+    stopped and the first exception raised.
+    """
+    if working_directory is None:
+        working_directory = os.getcwd()
+
+    depends = stage_dependencies(stages)
+    by_name = {stage.name: stage for stage in stages}
+
+    done = set(completed_stages(stages, completed, working_directory))
+    results = {}
+    failure = None
+    running = {}
+
+    def check_files(stage, filenames, what):
+        for filename in filenames:
+            if not os.path.exists(os.path.join(working_directory, filename)):
+                raise RuntimeError(f"stage {stage.name} {what} {filename}")
+
+    def run(stage):
+        check_files(stage, stage.inputs, "missing input")
+        result = stage.function()
+        check_files(stage, stage.outputs, "did not produce")
+        return result
+
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        while True:
+            if failure is None:
+                for stage in stages:
+                    if stage.name in done or stage.name in running.values():
+                        continue
+                    if depends[stage.name].issubset(done):
+                        running[pool.submit(run, by_name[stage.name])] = stage.name
+
+            if not running:
+                break
+
+            finished, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    if failure is None:
+                        failure = e
+                        # rather than waiting for the others to finish
+                        stop_jobs()
+                    continue
+                done.add(name)
+                if on_complete:
+                    on_complete(name)
+
+    except BaseException:
+        stop_jobs()
+        raise
+
+    finally:
+        pool.shutdown(wait=True)
+        allow_jobs()
+
+    if failure is not None:
+        raise failure
+
+    return results
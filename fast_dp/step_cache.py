@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import glob
+import hashlib
+import os
+import shutil
+import threading
+
+# opt-in cache of the results of the expensive XDS steps, keyed on the
+# generated input file, the identity (path, size, mtime) of the frames and
+# the content of any files the step reads from earlier steps - entries are
+# directories in the cache directory, evicted least recently used first
+# once the cache is larger than the maximum size
+
+__cache_directory = None
+__cache_max_size = 0
+
+_lock = threading.Lock()
+_digests = {}
+
+# files to keep for each step - those not written in a given run are skipped
+
+AUTOINDEX_ARTEFACTS = [
+    "XYCORR.LP",
+    "INIT.LP",
+    "COLSPOT.LP",
+    "IDXREF.LP",
+    "XPARM.XDS",
+    "SPOT.XDS",
+    "X-CORRECTIONS.cbf",
+    "Y-CORRECTIONS.cbf",
+    "BKGINIT.cbf",
+    "BLANK.cbf",
+    "GAIN.cbf",
+    "autoindex.log",
+]
+
+INTEGRATE_ARTEFACTS = [
+    "DEFPIX.LP",
+    "INTEGRATE.LP",
+    "INTEGRATE.HKL",
+    "BKGPIX.cbf",
+    "ABS.cbf",
+    "FRAME.cbf",
+]
+
+CORRECT_ARTEFACTS = [
+    "CORRECT.LP",
+    "XDS_ASCII.HKL",
+    "GXPARM.XDS",
+    "ABSORP.cbf",
+    "DECAY.cbf",
+    "MODPIX.cbf",
+]
+
+
+def set_cache_directory(cache_directory, max_size=10 * 1024**3):
+    """Enable the cache in cache_directory, holding up to max_size bytes."""
+    global __cache_directory, __cache_max_size
+    if cache_directory:
+        cache_directory = os.path.abspath(cache_directory)
+        os.makedirs(cache_directory, exist_ok=True)
+    __cache_directory = cache_directory
+    __cache_max_size = max_size
+
+
+def get_cache_directory():
+    return __cache_directory
+
+
+def frame_filenames(xds_inp):
+    """The files holding the frames in DATA_RANGE: the individual images for
+    a template, or the master file and its data files for HDF5.
+    """
+    template = xds_inp["NAME_TEMPLATE_OF_DATA_FRAMES"]
+
+    if template.endswith(".h5"):
+        return [template] + sorted(
+            glob.glob(template.replace("_master.h5", "_data_*.h5"))
+        )
+
+    start, end = map(int, xds_inp["DATA_RANGE"].split())
+    length = template.count("?")
+    format = "%%0%dd" % length
+    return [template.replace("?" * length, format % j) for j in range(start, end + 1)]
+
+
+def file_digest(filename):
+    """sha256 of the content of filename, remembered for as long as the file
+    is unchanged so that large files are only read once.
+    """
+    stat = os.stat(filename)
+    identity = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+
+    with _lock:
+        if identity in _digests:
+            return _digests[identity]
+
+    digest = hashlib.sha256()
+    with open(filename, "rb") as fh:
+        for block in iter(lambda: fh.read(1024 * 1024), b""):
+            digest.update(block)
+
+    with _lock:
+        _digests[identity] = digest.hexdigest()
+
+    return _digests[identity]
+
+
+def step_key(step, inp_file, xds_inp, depends=()):
+    """Compute the cache key for step, from the generated XDS input inp_file,
+    the frames it will read and the content of the files in depends. Returns
+    None if the cache is not enabled.
+    """
+    if not __cache_directory:
+        return None
+
+    key = hashlib.sha256()
+    key.update(step.encode())
+
+    with open(inp_file, "rb") as fh:
+        key.update(fh.read())
+
+    for filename in frame_filenames(xds_inp):
+        if os.path.exists(filename):
+            stat = os.stat(filename)
+            key.update(
+                ("%s %d %d\n" % (filename, stat.st_size, stat.st_mtime_ns)).encode()
+            )
+        else:
+            key.update(("%s missing\n" % filename).encode())
+
+    for filename in depends:
+        key.update(("%s %s\n" % (filename, file_digest(filename))).encode())
+
+    return f"{step}-{key.hexdigest()}"
+
+
+def restore_step(key):
+    """Copy the files saved for key into the working directory, returning
+    True if they were found.
+    """
+    if not key:
+        return False
+
+    entry = os.path.join(__cache_directory, key)
+    if not os.path.isdir(entry):
+        return False
+
+    for filename in os.listdir(entry):
+        shutil.copy2(os.path.join(entry, filename), filename)
+
+    # mark as recently used
+    os.utime(entry)
+
+    return True
+
+
+def store_step(key, artefacts):
+    """Save those of artefacts which exist under key, then trim the cache."""
+    if not key:
+        return
+
+    entry = os.path.join(__cache_directory, key)
+    if os.path.isdir(entry):
+        os.utime(entry)
+        return
+
+    partial = f"{entry}.{os.getpid()}.{threading.get_ident()}"
+    os.makedirs(partial)
+    for filename in artefacts:
+        if os.path.exists(filename):
+            shutil.copy2(filename, os.path.join(partial, filename))
+
+    try:
+        os.rename(partial, entry)
+    except OSError:
+        # someone else stored the same step in the meantime
+        shutil.rmtree(partial, ignore_errors=True)
+
+    evict(__cache_max_size)
+
+
+def _entry_size(entry):
+    return sum(
+        os.path.getsize(os.path.join(entry, filename)) for filename in os.listdir(entry)
+    )
+
+
+def evict(max_size):
+    """Remove the least recently used entries until the cache holds no more
+    than max_size bytes.
+    """
+    if not __cache_directory:
+        return
+
+    entries = []
+    for key in os.listdir(__cache_directory):
+        entry = os.path.join(__cache_directory, key)
+        # skip anything still being written
+        if key.count(".") or not os.path.isdir(entry):
+            continue
+        try:
+            entries.append((os.stat(entry).st_mtime, _entry_size(entry), entry))
+        except OSError:
+            continue
+
+    total = sum(size for _, size, _ in entries)
+
+    for _, size, entry in sorted(entries):
+        if total <= max_size:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# worker_pool.py
+#
+# A pool of long running agents to run the COLSPOT and INTEGRATE tasks
+# from forkxds as soon as they are submitted, rather than paying for the
+# queue wait and start up of a batch job each time. Start one agent per
+# node with
+#
+#   fast_dp-worker /path/to/spool
+#
+# then set FORKXDS_SPOOL=/path/to/spool (or fast_dp --worker-spool) and
+# forkxds will write each task to spool/pending, from where the first
+# agent with cores free claims it by moving it to spool/running, and
+# writes the outcome to spool/done. The spool needs to be on a filesystem
+# shared with the agents, as does the working directory. The time each
+# task waited to be claimed is reported as its latency.
+from __future__ import annotations
+
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from optparse import OptionParser
+
+from fast_dp.forkxds import numa_nodes, preexec, run_tasks, task_error
+
+
+def _spool_directories(spool):
+    directories = [os.path.join(spool, name) for name in ("pending", "running", "done")]
+    for directory in directories:
+        os.makedirs(directory, exist_ok=True)
+    return directories
+
+
+def _write_json(filename, obj):
+    """Write obj to filename atomically, as the agents poll for it."""
+    tmp = os.path.join(
+        os.path.dirname(filename), ".%s.%d" % (os.path.basename(filename), os.getpid())
+    )
+    with open(tmp, "w") as fh:
+        json.dump(obj, fh)
+    os.rename(tmp, filename)
+
+
+def submit_tasks(
+    spool, ntask, maxcpu, main, timeout=60.0, retries=0, poll_interval=0.1
+):
+    """Submit tasks 1 to ntask of main to the agents serving spool and wait
+    for them to finish, running any not claimed within timeout seconds here
+    instead, and submitting any which fail (or whose log ends in an error)
+    again up to retries times.
+    Returns the results as forkxds.run_tasks does, with the time waiting to
+    start of each as latency.
+    """
+    pending, running, done = _spool_directories(spool)
+    executable = os.path.abspath(main) if os.sep in main else main
+
+    batch = "%.6f-%s-%d" % (time.time(), socket.gethostname(), os.getpid())
+    names = {}
+    retried = {}
+
+    def submit(name, task):
+        _write_json(
+            os.path.join(pending, name),
+            {
+                "task": task,
+                "cwd": os.getcwd(),
+                "executable": executable,
+                "maxcpu": maxcpu,
+                "ld_library_path": os.environ.get("LD_LIBRARY_PATH", ""),
+                "submitted": time.time(),
+            },
+        )
+        names[name] = task
+
+    for task in range(1, ntask + 1):
+        submit("%s-%04d.json" % (batch, task), task)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt(signum)
+
+    previous = signal.signal(signal.SIGTERM, stop)
+
+    submitted = time.time()
+    results = []
+    local = []
+
+    try:
+        while names:
+            for name in list(names):
+                try:
+                    with open(os.path.join(done, name)) as fh:
+                        result = json.load(fh)
+                except (OSError, ValueError):
+                    continue
+                os.remove(os.path.join(done, name))
+                task = names.pop(name)
+                error = task_error(task)
+                if error:
+                    result["error"] = error
+                if (result["exit_status"] or error) and retried.get(task, 0) < retries:
+                    retried[task] = retried.get(task, 0) + 1
+                    submit(name, task)
+                    continue
+                if task in retried:
+                    result["retried"] = retried[task]
+                results.append(result)
+
+            if names and time.time() - submitted > timeout:
+                # take back those no agent has claimed and run them here
+                for name in list(names):
+                    try:
+                        os.remove(os.path.join(pending, name))
+                    except FileNotFoundError:
+                        continue
+                    local.append(names.pop(name))
+                if local:
+                    for result in run_tasks(
+                        ntask, maxcpu, main, tasks=local, retries=retries
+                    ):
+                        result["latency"] = result["start"] - submitted
+                        results.append(result)
+                    local = []
+                continue
+
+            time.sleep(poll_interval)
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+        for name in names:
+            try:
+                os.remove(os.path.join(pending, name))
+            except FileNotFoundError:
+                pass
+
+    return sorted(results, key=lambda result: result["task"])
+
+
+def _allocate(nodes, free, maxcpu, busy):
+    """Choose maxcpu of the free cpus, within one NUMA node if possible, or
+    all that are free if nothing else is running. Returns None if the task
+    will have to wait.
+    """
+    for node in nodes:
+        cpus = [cpu for cpu in node if cpu in free]
+        if len(cpus) >= maxcpu:
+            return cpus[:maxcpu]
+    cpus = sorted(free)
+    if len(cpus) >= maxcpu or (cpus and not busy):
+        return cpus[:maxcpu]
+    return None
+
+
+def serve(spool, max_tasks=0, memory_limit=0, poll_interval=0.1):
+    """Run tasks from spool until interrupted, each pinned to the cores it
+    asks for, as many at once as the cores on this machine allow.
+    """
+    pending, running, done = _spool_directories(spool)
+
+    if hasattr(os, "sched_getaffinity"):
+        available = set(os.sched_getaffinity(0))
+        pin = True
+    else:
+        available = set(range(os.cpu_count() or 1))
+        pin = False
+    nodes = numa_nodes(available)
+    free = set(available)
+
+    hostname = socket.gethostname()
+    tasks = {}
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+
+    previous = {
+        signum: signal.signal(signum, stop)
+        for signum in (signal.SIGINT, signal.SIGTERM)
+    }
+
+    def claim():
+        for name in sorted(os.listdir(pending)):
+            if not name.endswith(".json"):
+                continue
+            if max_tasks and len(tasks) >= max_tasks:
+                return
+            try:
+                with open(os.path.join(pending, name)) as fh:
+                    spec = json.load(fh)
+            except (OSError, ValueError):
+                continue
+            cpus = _allocate(nodes, free, max(1, spec["maxcpu"]), tasks)
+            if cpus is None:
+                return
+            try:
+                os.rename(os.path.join(pending, name), os.path.join(running, name))
+            except FileNotFoundError:
+                continue
+
+            env = dict(
+                os.environ,
+                OMP_NUM_THREADS=str(spec["maxcpu"]),
+                LD_LIBRARY_PATH=spec["ld_library_path"],
+            )
+            start = time.time()
+            try:
+                popen = subprocess.Popen(
+                    [spec["executable"]],
+                    cwd=spec["cwd"],
+                    stdin=subprocess.PIPE,
+                    env=env,
+                    preexec_fn=preexec(cpus if pin else None, memory_limit),
+                )
+            except OSError:
+                finish(name, spec, cpus, start, 127, None)
+                continue
+            popen.stdin.write(b"%d\n" % spec["task"])
+            popen.stdin.close()
+            free.difference_update(cpus)
+            tasks[popen.pid] = (name, spec, cpus, start)
+
+    def finish(name, spec, cpus, start, exit_status, rusage):
+        _write_json(
+            os.path.join(done, name),
+            {
+                "task": spec["task"],
+                "host": hostname,
+                "cpus": cpus if pin else None,
+                "start": start,
+                "latency": start - spec["submitted"],
+                "wall_time": time.time() - start,
+                "user_time": rusage.ru_utime if rusage else 0.0,
+                "system_time": rusage.ru_stime if rusage else 0.0,
+                "exit_status": exit_status,
+            },
+        )
+        try:
+            os.remove(os.path.join(running, name))
+        except FileNotFoundError:
+            pass
+
+    def reap(options):
+        while tasks:
+            pid, status, rusage = os.wait4(-1, options)
+            if pid == 0:
+                return
+            if pid not in tasks:
+                continue
+            name, spec, cpus, start = tasks.pop(pid)
+            free.update(cpus)
+            finish(name, spec, cpus, start, os.waitstatus_to_exitcode(status), rusage)
+
+    try:
+        while not stopping:
+            claim()
+            reap(os.WNOHANG)
+            time.sleep(poll_interval)
+    finally:
+        # stop what is running and tell the submitters so they do not wait
+        for pid in tasks:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        reap(0)
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+
+
+def main():
+    """Main routine for fast_dp-worker."""
+    parser = OptionParser(usage="fast_dp-worker [options] spool")
+    parser.add_option(
+        "--max-tasks",
+        dest="max_tasks",
+        default="0",
+        help="Run at most this many tasks at once",
+    )
+    parser.add_option(
+        "--memory-limit",
+        dest="memory_limit",
+        default="0",
+        help="Limit the address space of each task (MB)",
+    )
+
+    (options, args) = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error("You must give the spool directory")
+
+    print(
+        "fast_dp-worker: serving %s on %s" % (args[0], socket.gethostname()),
+        flush=True,
+    )
+    serve(
+        args[0],
+        max_tasks=int(options.max_tasks),
+        memory_limit=int(options.memory_limit),
+    )
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,7 @@
 from __future__ import annotations
 
-import re
-
 from fast_dp.cell_spacegroup import constrain_cell, lattice_to_spacegroup
+from fast_dp.lp_parser import LPFile
 
 
 def read_xds_idxref_lp(idxref_lp_file):
@@ -12,31 +11,25 @@ def read_xds_idxref_lp(idxref_lp_file):
     penalty. N.B. this also works from CORRECT.LP for the autoindexing
     results.
     """
-    # try doing this with regular expression: * int lattice...`
-
-    regexp = re.compile(r"^ \*\ ")
-
     results = {}
 
-    with open(idxref_lp_file) as fh:
-        for record in fh.readlines():
-            if regexp.match(record):
-                tokens = record.split()
-                spacegroup = lattice_to_spacegroup(tokens[2])
-                cell = tuple(map(float, tokens[4:10]))
-                constrained_cell = constrain_cell(tokens[2][0], cell)
-                penalty = float(tokens[3])
+    with LPFile(idxref_lp_file) as lp:
+        lattices = lp.lattices()
+        beam = lp.direct_beam()
 
-                if spacegroup in results:
-                    if penalty < results[spacegroup][0]:
-                        results[spacegroup] = penalty, constrained_cell
-                else:
-                    results[spacegroup] = penalty, constrained_cell
+    for lattice, penalty, cell in lattices:
+        spacegroup = lattice_to_spacegroup(lattice)
+        constrained_cell = constrain_cell(lattice[0], cell)
+
+        if spacegroup in results:
+            if penalty < results[spacegroup][0]:
+                results[spacegroup] = penalty, constrained_cell
+        else:
+            results[spacegroup] = penalty, constrained_cell
 
-            if "DETECTOR COORDINATES (PIXELS) OF DIRECT BEAM" in record:
-                results["beam centre pixels"] = map(float, record.split()[-2:])
+    assert beam is not None
 
-    assert "beam centre pixels" in results
+    results["beam centre pixels"] = beam
 
     return results
 
@@ -45,20 +38,8 @@ def read_xds_correct_lp(correct_lp_file):
     """Read the XDS CORRECT.LP file and get out the spacegroup and
     unit cell constants it decided on.
     """
-    unit_cell = None
-    space_group_number = None
-
-    with open(correct_lp_file) as fh:
-        for record in fh.readlines():
-            if "SPACE_GROUP_NUMBER=" in record:
-                try:
-                    space_group_number = int(record.split()[-1])
-                except Exception:
-                    space_group_number = 0
-            if "UNIT_CELL_CONSTANTS=" in record and "used" not in record:
-                unit_cell = tuple(map(float, record.split()[-6:]))
-
-    return unit_cell, space_group_number
+    with LPFile(correct_lp_file) as lp:
+        return lp.unit_cell(), lp.space_group_number()
 
 
 def read_correct_lp_get_resolution(correct_lp_file):
@@ -66,26 +47,16 @@ def read_correct_lp_get_resolution(correct_lp_file):
     This should then be recycled to a rerun of CORRECT, from which the
     reflections will be merged to get the statistics.
     """
-    with open(correct_lp_file) as fh:
-        correct_lp = fh.readlines()
-
-    rec = -1
+    with LPFile(correct_lp_file) as lp:
+        table = lp.resolution_table()
 
-    for j, record in enumerate(correct_lp):
-        if "RESOLUTION RANGE  I/Sigma  Chi^2  R-FACTOR  R-FACTOR" in record:
-            rec = j + 3
-            break
-
-    if rec < 0:
+    if table is None:
         raise RuntimeError("resolution information not found")
 
-    j = rec
-
-    while "--------" not in correct_lp[j]:
-        isigma = float(correct_lp[j].split()[2])
+    for row in table:
+        isigma = float(row[2])
         if isigma < 1:
-            return float(correct_lp[j].split()[1])
-        j += 1
+            return float(row[1])
 
     # this will assume that strong reflections go to the edge of the detector
     # => do not need to feed back a resolution limit...
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+import fast_dp.batch
+from fast_dp.batch import read_manifest, run_batch, strip_options
+
+
+def test_strip_options():
+    arguments = ["--batch", "m.txt", "-a", "Se", "--batch-cores=8", "-k", "2"]
+    assert strip_options(
+        arguments, {"--batch": True, "--batch-cores": True, "-k": True}
+    ) == ["-a", "Se"]
+
+
+def test_read_manifest(tmp_path):
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text(
+        "# tonight\n"
+        "\n"
+        "/data/insulin_1_00001.cbf\n"
+        "--priority 5 -j 2 -k 3 -a Se /data/thaum_2_master.h5\n"
+        "--name special -k 1 /data/other_00001.cbf  # at the end\n"
+    )
+
+    datasets = read_manifest(str(manifest), defaults=["-k", "4", "-R", "20"])
+
+    assert [dataset["name"] for dataset in datasets] == [
+        "001_insulin_1",
+        "002_thaum_2",
+        "special",
+    ]
+    assert [dataset["priority"] for dataset in datasets] == [0, 5, 0]
+    assert [(dataset["jobs"], dataset["cores"]) for dataset in datasets] == [
+        (1, 4),
+        (2, 3),
+        (1, 1),
+    ]
+    assert datasets[1]["arguments"] == "-k 4 -R 20 -j 2 -k 3 -a Se".split()
+
+
+def test_run_batch(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    fake = tmp_path / "fake_dp.py"
+    fake.write_text(
+        "import json, sys, time\n"
+        "time.sleep(0.3)\n"
+        "if 'fail' in sys.argv[-1]:\n"
+        "    open('fast_dp.log', 'w').write('Fast DP error: no spots\\n')\n"
+        "    sys.exit(1)\n"
+        "json.dump({'arguments': sys.argv[1:]}, open('fast_dp.json', 'w'))\n"
+    )
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text(
+        "-k 2 a_00001.cbf\n"
+        "-k 4 b_00001.cbf\n"
+        "--priority 1 -k 2 c_00001.cbf\n"
+        "-k 8 fail_00001.cbf\n"
+    )
+
+    datasets = read_manifest(str(manifest))
+    n_failed = run_batch(
+        datasets, 4, 2, command=[sys.executable, str(fake)], poll_interval=0.05
+    )
+    assert n_failed == 1
+
+    with open("fast_dp_batch.json") as fh:
+        summary = json.load(fh)
+    datasets = summary["datasets"]
+    assert [dataset["name"] for dataset in datasets] == [
+        "001_a",
+        "002_b",
+        "003_c",
+        "004_fail",
+    ]
+    assert [dataset["exit_status"] for dataset in datasets] == [0, 0, 0, 1]
+    assert datasets[3]["error"] == "no spots"
+    assert datasets[3]["cores"] == 4
+    assert datasets[0]["results"]["arguments"][:4] == ["-j", "1", "-k", "2"]
+
+    # the highest priority first, and never more than 4 cores at once
+    assert min(datasets, key=lambda dataset: dataset["start"])["name"] == "003_c"
+    for dataset in datasets:
+        in_use = sum(
+            other["jobs"] * other["cores"]
+            for other in datasets
+            if other["start"] <= dataset["start"] < other["end"]
+        )
+        assert in_use <= 4
+
+
+def _running(pid):
+    try:
+        with open("/proc/%d/stat" % pid) as fh:
+            return fh.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/stat"), reason="needs /proc")
+def test_stopped_batch_stops_jobs(tmp_path):
+    # a fast_dp which runs one long job, as stream_job runs XDS
+    fake = tmp_path / "fake_dp.py"
+    fake.write_text(
+        "from fast_dp.run_job import stop_jobs_on_signal, stream_job\n"
+        "stop_jobs_on_signal()\n"
+        "stream_job('sleep 60 & echo $! > sleep.pid; wait')\n"
+    )
+    (tmp_path / "manifest.txt").write_text("--name slow a_00001.cbf\n")
+    script = (
+        "import sys\n"
+        "from fast_dp.batch import read_manifest, run_batch\n"
+        "datasets = read_manifest('manifest.txt')\n"
+        "run_batch(datasets, 4, 1, command=[sys.executable, %r])\n" % str(fake)
+    )
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.path.dirname(os.path.dirname(fast_dp.batch.__file__)),
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-c", script],
+        cwd=tmp_path,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    pid_file = tmp_path / "slow" / "sleep.pid"
+    end = time.time() + 30
+    while not (pid_file.exists() and pid_file.read_text().strip()):
+        assert time.time() < end
+        time.sleep(0.05)
+
+    process.send_signal(signal.SIGTERM)
+    process.wait(timeout=10)
+    assert not _running(int(pid_file.read_text()))
+
+    with open(tmp_path / "fast_dp_batch.json") as fh:
+        dataset = json.load(fh)["datasets"][0]
+    assert dataset["exit_status"] == 128 + signal.SIGTERM
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import os
+import time
+
+from fast_dp.candidates import (
+    SpeculativeScale,
+    make_sandbox,
+    promote_sandbox,
+    scale_in_sandboxes,
+)
+
+cell = (57.8, 57.8, 150.0, 90.0, 90.0, 90.0)
+
+
+def test_sandbox_links_and_promotes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for filename in ("INTEGRATE.HKL", "XPARM.XDS"):
+        (tmp_path / filename).write_text(filename)
+
+    directory = make_sandbox("candidate_1_sg19")
+    assert sorted(os.listdir(directory)) == ["INTEGRATE.HKL", "XPARM.XDS"]
+    with open(os.path.join(directory, "INTEGRATE.HKL")) as fh:
+        assert fh.read() == "INTEGRATE.HKL"
+
+    for filename in ("CORRECT.LP", "XDS_ASCII.HKL", "GXPARM.XDS"):
+        with open(os.path.join(directory, filename), "w") as fh:
+            fh.write("sandbox")
+    promote_sandbox(directory)
+
+    for filename in ("CORRECT.LP", "XDS_ASCII.HKL", "GXPARM.XDS"):
+        assert (tmp_path / filename).read_text() == "sandbox"
+    assert (tmp_path / "XPARM.XDS").read_text() == "XPARM.XDS"
+
+    # making the sandbox again starts from scratch
+    directory = make_sandbox("candidate_1_sg19")
+    assert sorted(os.listdir(directory)) == ["INTEGRATE.HKL", "XPARM.XDS"]
+
+
+def _running(pid):
+    try:
+        with open("/proc/%d/stat" % pid) as fh:
+            return fh.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def _fake_xds(tmp_path, monkeypatch, sleep=0):
+    """Put an xds_par on the PATH which fails in CORRECT after sleep
+    seconds, recording its process id.
+    """
+    bin_directory = tmp_path / "bin"
+    bin_directory.mkdir()
+    xds = bin_directory / "xds_par"
+    xds.write_text(
+        "#!/bin/sh\n"
+        "echo $$ > xds.pid\n"
+        "sleep %d\n"
+        "echo ' !!! ERROR !!! STUB CORRECT' > CORRECT.LP\n" % sleep
+    )
+    xds.chmod(0o755)
+    monkeypatch.setenv("PATH", "%s:%s" % (bin_directory, os.environ["PATH"]))
+
+
+def test_scale_in_sandboxes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _fake_xds(tmp_path, monkeypatch)
+    (tmp_path / "INTEGRATE.HKL").write_text("")
+
+    results = scale_in_sandboxes(
+        [("candidate_1_sg19", cell, 19, 0.0), ("candidate_2_sg1", cell, 1, 0.0)],
+        {"DATA_RANGE": "1 10"},
+    )
+
+    assert [result["space_group_number"] for result in results] == [19, 1]
+    assert [result["error"] for result in results] == [
+        "error in CORRECT: STUB CORRECT"
+    ] * 2
+    assert (tmp_path / "candidate_2_sg1" / "xds.pid").exists()
+    assert os.getcwd() == str(tmp_path)
+
+
+def test_speculative_scale(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _fake_xds(tmp_path, monkeypatch)
+
+    speculation = SpeculativeScale(cell, {"DATA_RANGE": "1 10"}, 89)
+    assert speculation.matches(list(cell), 89, 0.0)
+    assert not speculation.matches(cell, 92, 0.0)
+    assert not speculation.matches(cell, 89, 1.5)
+
+    result = speculation.result()
+    assert result["error"] == "error in CORRECT: STUB CORRECT"
+    assert result["directory"] == str(tmp_path / "speculative")
+
+
+def test_discarded_speculation_stops_correct(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _fake_xds(tmp_path, monkeypatch, sleep=60)
+
+    speculation = SpeculativeScale(cell, {"DATA_RANGE": "1 10"}, 89)
+    pid_file = tmp_path / "speculative" / "xds.pid"
+    end = time.time() + 30
+    while not pid_file.exists() and time.time() < end:
+        time.sleep(0.1)
+
+    start = time.time()
+    speculation.discard()
+    assert time.time() - start < 5
+
+    pid = int(pid_file.read_text())
+    end = time.time() + 10
+    while _running(pid) and time.time() < end:
+        time.sleep(0.1)
+    assert not _running(pid)
+    assert not (tmp_path / "speculative" / "CORRECT.LP").exists()
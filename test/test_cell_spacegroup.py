@@ -69,3 +69,9 @@ def test_ersatz_pointgroup(acentric_space_groups):
                 ersatz_pointgroup_old(symbol)
             ).hermann_mauguin()
         )
+
+
+def test_spacegroup_name_to_number():
+    assert cell_spacegroup.spacegroup_name_to_number("P 21 21 21") == 19
+    assert cell_spacegroup.spacegroup_name_to_number("P 43 21 2") == 96
+    assert cell_spacegroup.spacegroup_number_to_name(96) == "P 43 21 2"
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+
+import fast_dp.fast_rdp
+import fast_dp.output
+from fast_dp.fast_rdp import FastRDP
+
+cell = (57.8, 57.8, 150.0, 90.0, 90.0, 90.0)
+
+
+@pytest.fixture
+def sweep(tmp_path, monkeypatch):
+    """A FastRDP ready to sweep, with scaling replaced by one recording the
+    jobs it was given.
+    """
+    monkeypatch.chdir(tmp_path)
+    with open("fast_dp.state", "w") as fh:
+        json.dump(
+            {
+                "_commandline": "fast_dp stub_00001.cbf",
+                "_start_image": "stub_00001.cbf",
+                "_xds_inp": {"QX": "0.172", "QY": "0.172"},
+                "_params": {},
+                "_input_spacegroup": "P 41 21 2",
+            },
+            fh,
+        )
+
+    # the pointgroup pointless found is P 4 2 2
+    def select_pointgroup(results, input_spacegroup=None, **kwargs):
+        if input_spacegroup == "P 2 3":
+            raise RuntimeError(
+                "no indexing solution for spacegroup %s" % input_spacegroup
+            )
+        return cell, 89
+
+    numbers = {"P 41 21 2": 92, "P 43 21 2": 96, "P 2 3": 195}
+
+    jobs = []
+
+    def scale_in_sandboxes(sweep_jobs, xds_inp, **kwargs):
+        jobs.extend(sweep_jobs)
+        return [
+            {"directory": job[0], "space_group_number": job[2], "error": "stub"}
+            for job in sweep_jobs
+        ]
+
+    monkeypatch.setattr(fast_dp.fast_rdp, "select_pointgroup", select_pointgroup)
+    monkeypatch.setattr(fast_dp.fast_rdp, "scale_in_sandboxes", scale_in_sandboxes)
+    monkeypatch.setattr(fast_dp.fast_rdp, "write_candidates", lambda results: None)
+    monkeypatch.setattr(fast_dp.fast_rdp, "spacegroup_name_to_number", numbers.get)
+    monkeypatch.setattr(fast_dp.output, "write_resource_usage", lambda usage: None)
+
+    finst = FastRDP()
+    finst._p1_results = {}
+    finst._unit_cell = cell
+    finst._space_group_number = 92
+    finst._resolution_high = 1.5
+    finst._start_time = 0.0
+    return finst, jobs
+
+
+def test_sweep(sweep):
+    finst, jobs = sweep
+    finst.set_resolution_sweep([1.8, 2.0])
+    finst.set_spacegroup_sweep(["P 41 21 2", "P 43 21 2", "P 2 3"])
+
+    finst._run_sweep()
+
+    # each space group of the pointgroup is scaled as itself, while P 2 3
+    # does not fit the lattice, so is left out rather than scaled in the
+    # space group pointless prefers under its name
+    assert jobs == [
+        ("sweep_r1.80", cell, 92, 1.8),
+        ("sweep_r2.00", cell, 92, 2.0),
+        ("sweep_P41212", cell, 92, 1.5),
+        ("sweep_P43212", cell, 96, 1.5),
+    ]
+    assert finst._xds_inp["FRIEDEL'S_LAW"] == "TRUE"
+
+
+def test_sweep_nothing_fits(sweep):
+    finst, jobs = sweep
+    finst.set_spacegroup_sweep(["P 2 3"])
+
+    with pytest.raises(RuntimeError, match="no spacegroup in the sweep"):
+        finst._run_sweep()
+    assert jobs == []
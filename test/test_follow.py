@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+
+import pytest
+
+from fast_dp import follow
+from fast_dp.integrate import merge_integrate_hkl
+
+
+def write_images(directory, first, last, interval):
+    """Write synthetic images as a detector would, one at a time, each to a
+    temporary name first.
+    """
+    for j in range(first, last + 1):
+        image = os.path.join(directory, "x_%04d.cbf" % j)
+        with open(image + ".tmp", "w") as fh:
+            fh.write("image %d" % j)
+        os.rename(image + ".tmp", image)
+        time.sleep(interval)
+
+
+@pytest.fixture
+def xds_inp(tmp_path):
+    follow.set_follow_timeout(2.0, poll_interval=0.01)
+    yield {
+        "NAME_TEMPLATE_OF_DATA_FRAMES": str(tmp_path / "x_????.cbf"),
+        "DATA_RANGE": "1 20",
+    }
+    follow.set_follow_timeout(600.0)
+
+
+def test_wait_for_images(tmp_path, xds_inp):
+    assert follow.images_available(xds_inp) == 0
+
+    writer = threading.Thread(target=write_images, args=(str(tmp_path), 1, 20, 0.005))
+    writer.start()
+    try:
+        assert follow.wait_for_images(xds_inp, 12) >= 12
+    finally:
+        writer.join()
+
+    assert follow.images_available(xds_inp) == 20
+
+
+def test_wait_for_images_gap(tmp_path, xds_inp):
+    write_images(str(tmp_path), 1, 5, 0)
+    write_images(str(tmp_path), 7, 10, 0)
+    assert follow.images_available(xds_inp) == 5
+
+    with pytest.raises(RuntimeError, match="timed out"):
+        follow.set_follow_timeout(0.05, poll_interval=0.01)
+        follow.wait_for_images(xds_inp, 10)
+
+
+def test_merge_integrate_hkl(tmp_path):
+    for first, last in ((1, 10), (11, 20)):
+        with open(tmp_path / ("%d.HKL" % first), "w") as fh:
+            fh.write("!FORMAT=XDS_ASCII    MERGE=FALSE\n")
+            fh.write("!DATA_RANGE=%6d%6d\n" % (first, last))
+            fh.write("!END_OF_HEADER\n")
+            fh.write(" 1 2 3 %d\n" % first)
+            fh.write("!END_OF_DATA\n")
+
+    hklout = str(tmp_path / "INTEGRATE.HKL")
+    merge_integrate_hkl(
+        [str(tmp_path / "1.HKL"), str(tmp_path / "11.HKL")], 1, 20, hklout=hklout
+    )
+
+    with open(hklout) as fh:
+        assert fh.read() == (
+            "!FORMAT=XDS_ASCII    MERGE=FALSE\n"
+            "!DATA_RANGE=     1    20\n"
+            "!END_OF_HEADER\n"
+            " 1 2 3 1\n"
+            " 1 2 3 11\n"
+            "!END_OF_DATA\n"
+        )
@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+from fast_dp import forkxds
+
+
+def test_parse_cpulist():
+    assert forkxds.parse_cpulist("0-3,8,10-11\n") == [0, 1, 2, 3, 8, 10, 11]
+
+
+def test_cpu_slots_stay_within_nodes():
+    nodes = [list(range(0, 6)), list(range(6, 12))]
+    assert forkxds.cpu_slots(nodes, 4) == [[0, 1, 2, 3], [6, 7, 8, 9], [4, 5, 10, 11]]
+    assert forkxds.cpu_slots(nodes, 16) == [list(range(12))]
+
+
+@pytest.mark.skipif(
+    not hasattr(os, "sched_getaffinity"), reason="needs Linux cpu affinity"
+)
+def test_run_tasks(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    task = tmp_path / "mtask"
+    task.write_text(
+        "#!%s\n"
+        "import os, sys\n"
+        "n = int(sys.stdin.read())\n"
+        "with open('task_%%d' %% n, 'w') as fh:\n"
+        "    fh.write(' '.join(map(str, sorted(os.sched_getaffinity(0)))))\n"
+        "sys.exit(n == 3)\n" % sys.executable
+    )
+    task.chmod(0o755)
+
+    results = forkxds.run_tasks(4, 1, str(task))
+    forkxds.write_results(str(task), results)
+
+    assert [result["task"] for result in results] == [1, 2, 3, 4]
+    assert [result["exit_status"] for result in results] == [0, 0, 1, 0]
+    for result in results:
+        with open("task_%d" % result["task"]) as fh:
+            assert list(map(int, fh.read().split())) == result["cpus"]
+
+    with open("forkxds_mtask.json") as fh:
+        assert len(json.load(fh)) == 4
+
+
+def test_sigterm_stops_tasks(tmp_path):
+    task = tmp_path / "msleep"
+    task.write_text("#!/bin/sh\nread n\nexec sleep 30\n")
+    task.chmod(0o755)
+
+    popen = subprocess.Popen(
+        [sys.executable, "-m", "fast_dp.forkxds", "2", "1", str(task)],
+        cwd=tmp_path,
+        env=dict(
+            os.environ,
+            PYTHONPATH=os.path.dirname(os.path.dirname(forkxds.__file__)),
+        ),
+    )
+    time.sleep(1)
+    t0 = time.time()
+    popen.send_signal(signal.SIGTERM)
+    assert popen.wait(timeout=10) == 128 + signal.SIGTERM
+    assert time.time() - t0 < 5
+
+
+def test_host_slots(monkeypatch):
+    monkeypatch.setattr(forkxds, "local_slots", lambda maxcpu: [[0, 1], [2, 3]])
+    assert forkxds.host_slots([], 2) == [(None, [0, 1]), (None, [2, 3])]
+    assert forkxds.host_slots(["alpha:2", "localhost:3", "beta"], 2) == [
+        ("alpha", None),
+        (None, [0, 1]),
+        ("beta", None),
+        ("alpha", None),
+        (None, [2, 3]),
+        (None, None),
+    ]
+
+
+def test_free_slot_takes_next_task(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rsh = tmp_path / "rsh"
+    rsh.write_text(
+        "#!/bin/sh\n"
+        "host=$1\n"
+        "shift\n"
+        '[ "$host" = slowhost ] && sleep 1\n'
+        'exec sh -c "$*"\n'
+    )
+    rsh.chmod(0o755)
+    monkeypatch.setenv("FORKXDS_RSH", str(rsh))
+    task = tmp_path / "mtask"
+    task.write_text("#!/bin/sh\nread n\ntouch task_$n\n")
+    task.chmod(0o755)
+
+    results = forkxds.run_tasks(8, 1, str(task), hosts=["slowhost", "fasthost:1"])
+
+    assert [result["exit_status"] for result in results] == [0] * 8
+    assert all(os.path.exists("task_%d" % j) for j in range(1, 9))
+    hosts = [result["host"] for result in results]
+    assert hosts.count("slowhost") < hosts.count("fasthost")
+
+
+def test_straggler_is_duplicated(tmp_path, monkeypatch):
+    work = tmp_path / "work"
+    work.mkdir()
+    monkeypatch.chdir(work)
+    rsh = tmp_path / "rsh"
+    rsh.write_text('#!/bin/sh\nshift\nexec sh -c "$*"\n')
+    rsh.chmod(0o755)
+    monkeypatch.setenv("FORKXDS_RSH", str(rsh))
+    (work / "XPARM.XDS").write_text("input\n")
+    # task 2 is slow, except when run as a duplicate in a scratch directory
+    task = tmp_path / "mtask"
+    task.write_text(
+        "#!/bin/sh\n"
+        "read n\n"
+        'case "$PWD" in */.forkxds_*) ;; *) [ $n = 2 ] && sleep 20 ;; esac\n'
+        "cat XPARM.XDS > out_$n\n"
+    )
+    task.chmod(0o755)
+
+    t0 = time.time()
+    results = forkxds.run_tasks(
+        4, 1, str(task), hosts=["alpha", "beta"], straggler_factor=3
+    )
+    forkxds.write_results(str(task), results)
+
+    assert time.time() - t0 < 10
+    assert [result["exit_status"] for result in results] == [0] * 4
+    assert results[1]["duplicate"]["winner"] == "duplicate"
+    assert "duplicate" not in results[0]
+    assert (work / "out_2").read_text() == "input\n"
+    assert not [name for name in os.listdir(work) if name.startswith(".forkxds")]
+
+
+def test_scratch_copy(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for name in ("XDS.INP", "XPARM.XDS", "BKGPIX.cbf", "SPOT.XDS", "COLSPOT.LP"):
+        (tmp_path / name).write_text("")
+    since = time.time() + 10
+
+    # only what INTEGRATE reads, rather than everything in the directory
+    directory, copied = forkxds._scratch_copy(2, since, "/xds/mintegrate_par")
+    assert sorted(os.listdir(directory)) == ["BKGPIX.cbf", "XDS.INP", "XPARM.XDS"]
+    assert sorted(copied) == ["BKGPIX.cbf", "XDS.INP", "XPARM.XDS"]
+
+    directory, copied = forkxds._scratch_copy(2, since, "mcolspot")
+    assert sorted(copied) == ["XDS.INP"]
+
+
+def test_failed_task_is_retried(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rsh = tmp_path / "rsh"
+    rsh.write_text('#!/bin/sh\nshift\nexec sh -c "$*"\n')
+    rsh.chmod(0o755)
+    monkeypatch.setenv("FORKXDS_RSH", str(rsh))
+    # task 3 fails the first time, as if the node had gone away
+    task = tmp_path / "mtask"
+    task.write_text(
+        "#!/bin/sh\n"
+        "read n\n"
+        "[ $n = 3 ] && [ ! -e tried ] && touch tried && exit 255\n"
+        "touch task_$n\n"
+    )
+    task.chmod(0o755)
+
+    results = forkxds.run_tasks(4, 1, str(task), hosts=["alpha", "beta"], retries=2)
+
+    assert [result["exit_status"] for result in results] == [0] * 4
+    assert results[2]["retried"] == 1
+
+    os.remove("tried")
+    results = forkxds.run_tasks(4, 1, str(task), hosts=["alpha", "beta"])
+    assert [result["exit_status"] for result in results] == [0, 0, 255, 0]
+
+
+def test_task_with_error_in_log_is_retried(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # task 3 exits 0 the first time, but its log ends in an error
+    task = tmp_path / "mintegrate"
+    task.write_text(
+        "#!/bin/sh\n"
+        "read n\n"
+        "lp=LP_0$n.tmp\n"
+        "echo ' INTEGRATING' > $lp\n"
+        "[ $n = 3 ] && [ ! -e tried ] && touch tried && "
+        "echo ' !!! ERROR !!! CANNOT READ IMAGE' >> $lp\n"
+        "exit 0\n"
+    )
+    task.chmod(0o755)
+
+    results = forkxds.run_tasks(4, 1, str(task), retries=1)
+    assert [result["exit_status"] for result in results] == [0] * 4
+    assert results[2]["retried"] == 1
+    assert not [result for result in results if "error" in result]
+
+    os.remove("tried")
+    results = forkxds.run_tasks(4, 1, str(task))
+    assert results[2]["error"] == "cannot read image"
+    assert "retried" not in results[2]
+
+
+def test_forkxds_fails_for_error_in_log(tmp_path):
+    # every task exits 0, but the log of task 2 ends in an error
+    task = tmp_path / "mintegrate"
+    task.write_text(
+        "#!/bin/sh\n"
+        "read n\n"
+        "echo ' INTEGRATING' > LP_0$n.tmp\n"
+        "[ $n = 2 ] && echo ' !!! ERROR !!! CANNOT READ IMAGE' >> LP_0$n.tmp\n"
+        "exit 0\n"
+    )
+    task.chmod(0o755)
+
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.path.dirname(os.path.dirname(forkxds.__file__)),
+        FORKXDS_RETRIES="1",
+    )
+    process = subprocess.run(
+        [sys.executable, "-m", "fast_dp.forkxds", "2", "1", str(task)],
+        cwd=tmp_path,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    assert process.returncode == 1
+
+    with open(tmp_path / "forkxds_mintegrate.json") as fh:
+        results = json.load(fh)
+    assert results[1]["exit_status"] == 0
+    assert results[1]["error"] == "cannot read image"
+    assert results[1]["retried"] == 1
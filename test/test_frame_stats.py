@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import pytest
+
+from fast_dp.frame_stats import trim_images, trim_ranges
+
+
+def _integrate_hkl(tmp_path, n_images=20, dead=(), weak=()):
+    lines = [
+        "!OUTPUT_FILE=INTEGRATE.HKL",
+        "!DATA_RANGE=       1      %d" % n_images,
+        "!NUMBER_OF_ITEMS_IN_EACH_DATA_RECORD=8",
+        "!H,K,L,IOBS,SIGMA,XCAL,YCAL,ZCAL,",
+        "!END_OF_HEADER",
+    ]
+    for image in range(1, n_images + 1):
+        if image in dead:
+            continue
+        intensity = 10.0 if image in weak else 1000.0
+        for j in range(10):
+            lines.append(
+                "%6d%6d%6d %10.3E %10.3E %7.1f %7.1f %8.2f"
+                % (j, 1, 2, intensity, 10.0, 100.0, 100.0, image - 0.5)
+            )
+    lines.append("!END_OF_DATA")
+    (tmp_path / "INTEGRATE.HKL").write_text("\n".join(lines) + "\n")
+
+
+def test_trim_ranges():
+    images = list(range(1, 11))
+    unusable = [1, 0, 0, 1, 1, 0, 0, 0, 1, 1]
+    assert trim_ranges(images, unusable) == (2, 8, [(4, 5)])
+    assert trim_ranges(images, [1] * 10) is None
+
+
+def test_trim_images(tmp_path, monkeypatch):
+    pytest.importorskip("numpy")
+    monkeypatch.chdir(tmp_path)
+    # a beam dump part way through, and damage at the end
+    _integrate_hkl(tmp_path, dead=(8, 9), weak=range(15, 21))
+
+    xds_inp = {"DATA_RANGE": "1 20"}
+    assert trim_images(xds_inp)
+
+    assert xds_inp["DATA_RANGE"] == "1 14"
+    assert xds_inp["EXCLUDE_DATA_RANGE"] == ["8 9"]
+    assert (tmp_path / "frame_statistics.json").exists()
+
+
+def test_trim_images_keeps_good_data(tmp_path, monkeypatch):
+    pytest.importorskip("numpy")
+    monkeypatch.chdir(tmp_path)
+    _integrate_hkl(tmp_path)
+
+    xds_inp = {"DATA_RANGE": "1 20"}
+    assert not trim_images(xds_inp)
+    assert xds_inp == {"DATA_RANGE": "1 20"}
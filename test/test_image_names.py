@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import os
+
+from fast_dp.image_names import (
+    FrameSet,
+    find_matching_images,
+    image2image,
+    image2template,
+    image_index,
+)
+
+
+def test_image2template():
+    assert image2template("x_1_0001.cbf") == "x_1_####.cbf"
+    assert image2template("x.0001") == "x.####"
+    assert image2image("x_1_0042.cbf") == 42
+
+
+def test_frame_set():
+    frames = FrameSet()
+    for number in list(range(1, 40)) + list(range(42, 100)):
+        frames.add(number)
+    frames.add(5)
+
+    assert len(frames) == 97
+    assert (frames.first, frames.last) == (1, 99)
+    assert 41 not in frames and 42 in frames and -1 not in frames
+    assert frames.missing() == [40, 41]
+    assert frames.missing(50, 120) == list(range(100, 121))
+    assert list(frames)[:3] == [1, 2, 3]
+    assert frames.contiguous(1) == 39 and frames.contiguous(40) == 39
+
+    frames.add(41)
+    frames.add(40)
+    assert frames.missing() == []
+    assert frames.contiguous(1) == 99
+
+    # a number from a timestamp costs no more than any other
+    frames.add(20261018120000)
+    assert frames.last == 20261018120000
+    assert frames.missing(95, 105) == list(range(100, 106))
+
+
+def test_image_index(tmp_path):
+    for j in (1, 2, 4):
+        (tmp_path / ("x_1_%04d.cbf" % j)).write_text("")
+    for j in (1, 2):
+        (tmp_path / ("x_2_%04d.cbf" % j)).write_text("")
+    (tmp_path / "notes.txt").write_text("")
+    (tmp_path / "snapshot_20261018120000.jpg").write_text("")
+
+    frames = image_index(str(tmp_path), "x_1_####.cbf")
+    assert list(frames) == [1, 2, 4]
+    assert frames.missing() == [3]
+    assert image_index(str(tmp_path), "x_1_####.cbf") is frames
+
+    assert find_matching_images("x_1_####.cbf", str(tmp_path)) == [1, 2, 4]
+    assert find_matching_images("x_#_0001.cbf", str(tmp_path)) == [1, 2]
+
+    # adding an image is noticed
+    (tmp_path / "x_1_0003.cbf").write_text("")
+    os.utime(tmp_path, ns=(0, 0))
+    assert find_matching_images("x_1_####.cbf", str(tmp_path)) == [1, 2, 3, 4]
@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from fast_dp.integrate import cluster_error
+
+
+def test_cluster_error_names_failed_tasks(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert str(cluster_error()) == "integration error: cluster error"
+
+    with open("forkxds_mintegrate_par.json", "w") as fh:
+        json.dump(
+            [
+                {"task": 1, "host": "alpha", "exit_status": 0},
+                {"task": 2, "host": "beta", "exit_status": 255},
+                {
+                    "task": 3,
+                    "host": "alpha",
+                    "exit_status": 0,
+                    "error": "cannot read image",
+                },
+            ],
+            fh,
+        )
+
+    # task 3 exited 0, but its log ended in an error
+    with pytest.raises(
+        RuntimeError, match="cluster error in tasks 2 on beta, 3 on alpha"
+    ):
+        raise cluster_error()
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import pytest
+
+from fast_dp.lp_parser import LPFile, check_lp_error, last_record
+
+integrate_lp = """\
+ ***** INTEGRATE *****
+ PROCESSING OF IMAGES        1 ...       5
+ CRYSTAL MOSAICITY (DEGREES)     0.121
+ PROCESSING OF IMAGES        6 ...      10
+ CRYSTAL MOSAICITY (DEGREES)     0.135
+ !!! ERROR !!! AUTOMATIC DETERMINATION OF SPOT SIZE PARAMETERS HAS FAILED.
+"""
+
+correct_lp = """\
+ LATTICE-  BRAVAIS-   QUALITY  UNIT CELL CONSTANTS (ANGSTROEM & DEGREES)
+ CHARACTER  LATTICE     OF FIT      a      b      c   alpha  beta gamma
+
+ *  44        aP          0.0      57.8   57.8  150.0  90.0  90.0  90.0
+ *  31        aP          1.2      57.8   57.8  150.0  90.0  90.0  90.0
+    25        mC        250.0      81.7   81.8  150.0  90.0  90.0  90.0
+ SPACE_GROUP_NUMBER=   89
+ UNIT_CELL_CONSTANTS=    57.8    57.8   150.0  90.000  90.000  90.000
+ DETECTOR COORDINATES (PIXELS) OF DIRECT BEAM    1230.50   1300.25
+ RESOLUTION RANGE  I/Sigma  Chi^2  R-FACTOR  R-FACTOR  NUMBER ACCEPTED REJECTED
+                                   observed  expected
+ ----
+    10.00   5.00   40.1   1.01    2.5%      2.6%     1000     1000        0
+     5.00   2.00   10.2   0.98    9.5%      9.9%     4000     4000        2
+ --------------------------------------------------------------------------
+ NUMBER OF ACCEPTED OBSERVATIONS (INCLUDING SYSTEMATIC ABSENCES)    4998
+"""
+
+
+def test_last_record(tmp_path):
+    lp = tmp_path / "IDXREF.LP"
+    lp.write_text("".join(" record %d\n" % j for j in range(2000)))
+    assert last_record(str(lp), block=64) == " record 1999"
+    lp.write_text("only")
+    assert last_record(str(lp)) == "only"
+
+
+def test_check_lp_error(tmp_path):
+    (tmp_path / "INTEGRATE.LP").write_text(integrate_lp)
+    with pytest.raises(RuntimeError, match="error in INTEGRATE: automatic"):
+        check_lp_error("INTEGRATE", working_directory=str(tmp_path))
+    check_lp_error("DEFPIX", working_directory=str(tmp_path))
+
+
+def test_integrate_lp(tmp_path):
+    (tmp_path / "INTEGRATE.LP").write_text(integrate_lp)
+    with LPFile(str(tmp_path / "INTEGRATE.LP")) as lp:
+        assert lp.mosaicities() == [0.121, 0.135]
+        assert lp.errors() == [
+            "AUTOMATIC DETERMINATION OF SPOT SIZE PARAMETERS HAS FAILED."
+        ]
+        assert lp.direct_beam() is None
+
+
+def test_correct_lp(tmp_path):
+    (tmp_path / "CORRECT.LP").write_text(correct_lp)
+    with LPFile(str(tmp_path / "CORRECT.LP")) as lp:
+        assert [lattice[:2] for lattice in lp.lattices()] == [
+            ("aP", 0.0),
+            ("aP", 1.2),
+        ]
+        assert lp.space_group_number() == 89
+        assert lp.unit_cell() == (57.8, 57.8, 150.0, 90.0, 90.0, 90.0)
+        assert lp.direct_beam() == (1230.5, 1300.25)
+        table = lp.resolution_table()
+        assert [row[:2] for row in table] == [["10.00", "5.00"], ["5.00", "2.00"]]
+        assert lp.accepted_observations() == 4998
+        assert lp.errors() == []
+
+
+def test_empty_lp(tmp_path):
+    (tmp_path / "XYCORR.LP").write_text("")
+    with LPFile(str(tmp_path / "XYCORR.LP")) as lp:
+        assert lp.mosaicities() == []
+        assert lp.resolution_table() is None
+        assert lp.accepted_observations() == 0
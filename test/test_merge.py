@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+from fast_dp.merge import _aimless_summary, aimless_statistics, parse_aimless_log
+
+aimless_log = """
+  Summary data for        Project: fast_dp Crystal: XTAL Dataset: DATA
+
+                                           Overall  InnerShell  OuterShell
+Low resolution limit                       28.89     28.89      1.37
+High resolution limit                       1.34      5.99      1.34
+
+Rmerge  (within I+/I-)                     0.062     0.024     0.420
+Rmerge  (all I+ and I-)                    0.065     0.025     0.450
+Rmeas (within I+/I-)                       0.075     0.030     0.560
+Rmeas (all I+ & I-)                        0.071     0.027     0.510
+Total number of observations              306284      3922     11217
+Total number unique                        57886       786      4030
+Mean((I)/sd(I))                             13.4      44.7       1.6
+Mn(I) half-set correlation CC(1/2)         0.999     0.999     0.613
+Completeness                                99.6      98.9      96.1
+Multiplicity                                 5.3       5.0       2.8
+
+Anomalous completeness                      96.5     100.0      71.4
+Anomalous multiplicity                       2.6       3.1       1.2
+DelAnom correlation between half-sets      0.021     0.104    -0.010
+Mid-Slope of Anom Normal Probability       1.007       -         -
+  Outlier rejection and statistics
+""".splitlines(keepends=True)
+
+
+def test_aimless_statistics():
+    scaling_statistics, slope = aimless_statistics(aimless_log)
+    assert slope == 1.007
+    assert scaling_statistics["overall"]["r_merge"] == 0.062
+    assert scaling_statistics["outerShell"]["res_lim_high"] == 1.34
+    assert scaling_statistics["innerShell"]["n_tot_unique_obs"] == 786
+    assert scaling_statistics["outerShell"]["cc_half"] == 0.613
+    assert scaling_statistics["overall"]["r_meas_all_iplusi_minus"] == 0.071
+
+
+def test_aimless_summary_keeps_needed_records():
+    summary = _aimless_summary()
+    for record in aimless_log:
+        summary(record)
+    assert len(summary.records) < len(aimless_log)
+    assert aimless_statistics(summary.records) == aimless_statistics(aimless_log)
+
+
+def test_parse_aimless_log(capsys, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    scaling_statistics = parse_aimless_log(aimless_log, anomalous=(0.075, 0.823))
+    assert scaling_statistics["overall"]["completeness"] == 99.6
+    assert "dI/sig(dI)  0.823" in capsys.readouterr().out
@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+import os
+
+from fast_dp import metadata_cache
+
+
+def test_metadata_round_trip(tmp_path):
+    default = metadata_cache.get_metadata_cache_directory()
+    metadata_cache.set_metadata_cache_directory(str(tmp_path / "cache"))
+    try:
+        images = tmp_path / "images"
+        images.mkdir()
+        image = images / "x_0001.cbf"
+        image.write_text("frame")
+
+        key = metadata_cache.metadata_key(str(image))
+        assert metadata_cache.load_metadata(key) is None
+
+        metadata = {"DATA_RANGE": "1 1", "SEGMENT": ["1 1 10 10"]}
+        metadata_cache.save_metadata(key, metadata)
+        assert metadata_cache.load_metadata(key) == metadata
+        assert metadata_cache.metadata_key(str(image)) == key
+
+        # adding a frame or using a different library invalidates the entry
+        (images / "x_0002.cbf").write_text("frame")
+        os.utime(images, ns=(0, 0))
+        assert metadata_cache.metadata_key(str(image)) != key
+        assert metadata_cache.metadata_key(str(image), "durin-plugin.so") != key
+
+        metadata_cache.set_metadata_cache_directory(None)
+        assert metadata_cache.load_metadata(key) is None
+    finally:
+        metadata_cache.set_metadata_cache_directory(default)
@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+from fast_dp.pointgroup import likely_pointgroup, p1_correct_current, p1_inp
+
+cell = (40.0, 50.0, 60.0, 90.0, 90.0, 90.0)
+
+
+def xds_inp(**kwargs):
+    result = {
+        "DATA_RANGE": "1 900",
+        "OSCILLATION_RANGE": "0.1",
+        "NAME_TEMPLATE_OF_DATA_FRAMES": "/data/x_????.cbf",
+    }
+    result.update(kwargs)
+    return result
+
+
+def test_p1_inp_limits_data_range():
+    metadata = xds_inp(OSCILLATION_RANGE="1.0")
+    text = p1_inp(cell, metadata)
+    assert metadata["DATA_RANGE"] == "1 361"
+    assert "DATA_RANGE=1 361\n" in text
+    assert "SPACE_GROUP_NUMBER=1\n" in text
+
+
+def test_p1_correct_current(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for filename in ("P1.LP", "XDS_P1.HKL", "pointless.xml"):
+        (tmp_path / filename).write_text("")
+
+    assert not p1_correct_current(cell, xds_inp())
+
+    (tmp_path / "P1.INP").write_text(p1_inp(cell, xds_inp()))
+    assert p1_correct_current(cell, xds_inp())
+    assert p1_correct_current(cell, xds_inp(**{"FRIEDEL'S_LAW": "FALSE"}))
+    assert not p1_correct_current(cell, xds_inp(DATA_RANGE="1 450"))
+
+    (tmp_path / "pointless.xml").unlink()
+    assert not p1_correct_current(cell, xds_inp())
+
+
+def test_likely_pointgroup():
+    results = {
+        1: (0.0, (40.0, 50.0, 60.0, 89.9, 90.1, 90.0)),
+        16: (1.2, cell),
+        "beam centre pixels": (1000.0, 1000.0),
+    }
+    # the highest symmetry chiral spacegroup of the highest lattice
+    assert likely_pointgroup(results) == (16, cell)
+
+    results[75] = (2.5, (50.0, 50.0, 60.0, 90.0, 90.0, 90.0))
+    assert likely_pointgroup(results) == (89, (50.0, 50.0, 60.0, 90.0, 90.0, 90.0))
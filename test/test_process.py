@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import os
+
+import pytest
+
+import fast_dp.fast_dp
+import fast_dp.output
+from fast_dp.fast_dp import FastDP
+
+cell = (57.8, 57.8, 150.0, 90.0, 90.0, 90.0)
+
+
+def _touch(*filenames):
+    for filename in filenames:
+        with open(filename, "w") as fh:
+            fh.write("stub\n")
+
+
+@pytest.fixture
+def stub_programs(tmp_path, monkeypatch):
+    """Replace each step which would run XDS, pointless or aimless with one
+    writing the files it would, to check the stages of FastDP.process()
+    fit together.
+    """
+    monkeypatch.chdir(tmp_path)
+    recorded = []
+
+    def autoindex(xds_inp, input_cell=None):
+        _touch("XPARM.XDS", "SPOT.XDS")
+        return cell
+
+    def integrate(*args):
+        _touch("INTEGRATE.HKL")
+        return 0.1, 0.2, 0.3
+
+    def p1_correct(p1_unit_cell, xds_inp):
+        _touch("P1.LP", "XDS_P1.HKL", "pointless.xml")
+        return {}, 1.5
+
+    def scale(unit_cell, xds_inp, space_group_number, resolution_high):
+        _touch("XDS_ASCII.HKL", "GXPARM.XDS", "CORRECT.LP")
+        return cell, "P 41 21 2", 1000, (1000.0, 1000.0)
+
+    def run_aimless():
+        _touch("fast_dp.mtz", "aimless.log")
+        return []
+
+    stubs = {
+        "autoindex": autoindex,
+        "integrate": integrate,
+        "p1_correct": p1_correct,
+        "select_pointgroup": lambda results, input_spacegroup=None: (cell, 92),
+        "scale": scale,
+        "xdsstat": lambda: _touch("xdsstat.log"),
+        "run_aimless": run_aimless,
+        "anomalous_signals": lambda mtz: None,
+        "parse_aimless_log": lambda summary, anomalous=None: {},
+        "record_run": lambda *args, **kwargs: recorded.append(args),
+        "choose_layout": lambda *args, **kwargs: (1, 16, 100.0),
+    }
+    for name, stub in stubs.items():
+        monkeypatch.setattr(fast_dp.fast_dp, name, stub)
+
+    monkeypatch.setattr(fast_dp.output, "write_resource_usage", lambda usage: None)
+    monkeypatch.setattr(
+        fast_dp.output, "write_json", lambda *args, **kwargs: _touch("fast_dp.json")
+    )
+    monkeypatch.setattr(
+        fast_dp.output, "write_ispyb_xml", lambda *args: _touch("fast_dp.xml")
+    )
+    return recorded
+
+
+def _fast_dp():
+    finst = FastDP()
+    finst._commandline = "fast_dp stub_00001.cbf"
+    finst._start_image = "stub_00001.cbf"
+    finst._xds_inp = {
+        "DATA_RANGE": "1 100",
+        "OSCILLATION_RANGE": "0.1",
+        "STARTING_ANGLE": "0.0",
+        "NAME_TEMPLATE_OF_DATA_FRAMES": "stub_?????.cbf",
+        "X-RAY_WAVELENGTH": "0.97",
+        "QX": "0.172",
+        "QY": "0.172",
+    }
+    finst.set_trim_images(False)
+    finst.set_speculate(False)
+    return finst
+
+
+@pytest.mark.parametrize("quick_stats", [False, True])
+def test_process_stages(stub_programs, quick_stats):
+    finst = _fast_dp()
+    finst.set_quick_stats(quick_stats)
+
+    finst.process()
+
+    assert os.path.exists("fast_dp.json")
+    assert os.path.exists("fast_dp.xml")
+    assert ("quick_stats" in finst._completed_stages) == quick_stats
+    assert "columns" in finst._completed_stages
+    assert finst._space_group == "P 41 21 2"
+
+
+def test_process_execution_hosts(stub_programs):
+    finst = _fast_dp()
+    finst.set_execution_hosts(["node1:8", "node2:8"])
+
+    finst.process()
+
+    # one job per wedge of 50 images, not the layout for this machine, and
+    # the run is no guide to the next on this machine
+    assert finst._n_jobs == 2
+    assert stub_programs == []
+
+    finst = _fast_dp()
+    finst.process()
+    assert finst._n_jobs == 1
+    assert len(stub_programs) == 1
+
+
+def test_process_trims_only_correct(stub_programs, monkeypatch):
+    def trim_images(xds_inp):
+        xds_inp["DATA_RANGE"] = "1 80"
+        return True
+
+    corrected = []
+
+    def p1_correct(p1_unit_cell, xds_inp):
+        corrected.append(("P1", xds_inp["DATA_RANGE"]))
+        _touch("P1.LP", "XDS_P1.HKL", "pointless.xml")
+        return {}, 1.5
+
+    def scale(unit_cell, xds_inp, space_group_number, resolution_high):
+        corrected.append(("CORRECT", xds_inp["DATA_RANGE"]))
+        _touch("XDS_ASCII.HKL", "GXPARM.XDS", "CORRECT.LP")
+        return cell, "P 41 21 2", 1000, (1000.0, 1000.0)
+
+    monkeypatch.setattr(fast_dp.fast_dp, "trim_images", trim_images)
+    monkeypatch.setattr(fast_dp.fast_dp, "p1_correct", p1_correct)
+    monkeypatch.setattr(fast_dp.fast_dp, "scale", scale)
+
+    finst = _fast_dp()
+    finst.set_trim_images(True)
+    finst.process()
+
+    assert corrected == [("P1", "1 80"), ("CORRECT", "1 80")]
+    # the images integrated are those recorded, and integrated again
+    assert finst._xds_inp["DATA_RANGE"] == "1 100"
+    assert stub_programs[0][1] == 100
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import math
+
+import pytest
+
+from fast_dp.quick_stats import merging_statistics
+
+
+def test_merging_statistics():
+    numpy = pytest.importorskip("numpy")
+
+    # (1,0,0) three times, once as its Friedel mate, and (0,1,0) once
+    hkl = numpy.array([[1, 0, 0], [1, 0, 0], [-1, 0, 0], [0, 1, 0], [0, 0, 1]])
+    intensity = numpy.array([10.0, 12.0, 11.0, 5.0, 1.0])
+    sigma = numpy.array([1.0, 1.0, 1.0, 1.0, -1.0])
+
+    overall = merging_statistics(
+        hkl,
+        intensity,
+        sigma,
+        (10.0, 10.0, 10.0, 90.0, 90.0, 90.0),
+        numpy.identity(3)[numpy.newaxis],
+        possible=numpy.array([10.0, 10.0, 10.0, 5.0]),
+        n_bins=1,
+    )[0]
+
+    assert overall["n_tot_obs"] == 4
+    assert overall["n_tot_unique_obs"] == 2
+    assert overall["multiplicity"] == 2.0
+    assert overall["completeness"] == pytest.approx(200.0 / 3)
+    assert overall["r_merge"] == pytest.approx(2.0 / 33.0)
+    assert overall["r_meas_all_iplusi_minus"] == pytest.approx(
+        math.sqrt(1.5) * 2.0 / 33.0
+    )
+    assert overall["mean_i_sig_i"] == pytest.approx((11.0 * math.sqrt(3) + 5.0) / 2)
+    assert overall["res_lim_high"] == pytest.approx(10.0)
+
+
+def test_symmetry_merges_equivalents():
+    numpy = pytest.importorskip("numpy")
+
+    # a fourfold about c: (1,2,3) and (-2,1,3) are the same reflection
+    fourfold = numpy.array([[0, 1, 0], [-1, 0, 0], [0, 0, 1]])
+    rotations = numpy.array([numpy.linalg.matrix_power(fourfold, j) for j in range(4)])
+    hkl = numpy.array([[1, 2, 3], [-2, 1, 3], [2, -1, 3], [1, 2, 4]])
+
+    shells = merging_statistics(
+        hkl,
+        numpy.array([1.0, 2.0, 3.0, 4.0]),
+        numpy.ones(4),
+        (50.0, 50.0, 80.0, 90.0, 90.0, 90.0),
+        rotations,
+        n_bins=1,
+    )
+
+    assert shells[0]["n_tot_unique_obs"] == 2
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import os
+
+import pytest
+
+from fast_dp.reflections import (
+    load_columns,
+    load_reflections,
+    read_xds_hkl,
+    write_columns,
+)
+
+xds_ascii = """!FORMAT=XDS_ASCII    MERGE=FALSE    FRIEDEL'S_LAW=TRUE
+!SPACE_GROUP_NUMBER=   75
+!UNIT_CELL_CONSTANTS=    57.780    57.780   150.000  90.000  90.000  90.000
+!NUMBER_OF_ITEMS_IN_EACH_DATA_RECORD=8
+!ITEM_H=1
+!ITEM_K=2
+!ITEM_L=3
+!ITEM_IOBS=4
+!ITEM_SIGMA(IOBS)=5
+!ITEM_XD=6
+!ITEM_YD=7
+!ITEM_ZD=8
+!END_OF_HEADER
+     0     0     4  1.234E+02  5.678E+00  1021.3  1040.7     12.5
+    -1     2   -13 -4.000E-01  2.000E+00   800.0   900.1    500.0
+!END_OF_DATA
+"""
+
+integrate_hkl = """!OUTPUT_FILE=INTEGRATE.HKL    DATE=17-Oct-2026
+!NUMBER_OF_ITEMS_IN_EACH_DATA_RECORD=5
+!H,K,L,IOBS,SIGMA,
+!             XCAL
+!END_OF_HEADER
+     1     2     3  1.0E+01  1.0E+00
+!END_OF_DATA
+"""
+
+
+def test_read_xds_ascii(tmp_path):
+    numpy = pytest.importorskip("numpy")
+    (tmp_path / "XDS_ASCII.HKL").write_text(xds_ascii)
+
+    header, columns = read_xds_hkl(str(tmp_path / "XDS_ASCII.HKL"))
+
+    assert header["SPACE_GROUP_NUMBER"] == "75"
+    assert header["FRIEDEL'S_LAW"] == "TRUE"
+    assert header["UNIT_CELL_CONSTANTS"].split()[2] == "150.000"
+    assert sorted(columns) == ["H", "IOBS", "K", "L", "SIGMA", "XD", "YD", "ZD"]
+    assert list(columns["L"]) == [4, -13]
+    assert numpy.allclose(columns["IOBS"], [123.4, -0.4])
+    assert numpy.allclose(columns["ZD"], [12.5, 500.0])
+
+
+def test_read_integrate_hkl_names(tmp_path):
+    pytest.importorskip("numpy")
+    (tmp_path / "INTEGRATE.HKL").write_text(integrate_hkl)
+
+    _, columns = read_xds_hkl(str(tmp_path / "INTEGRATE.HKL"))
+
+    assert list(columns) == ["H", "K", "L", "IOBS", "SIGMA"]
+
+
+def test_truncated(tmp_path):
+    pytest.importorskip("numpy")
+    (tmp_path / "XDS_ASCII.HKL").write_text(xds_ascii.replace("  500.0\n", "\n"))
+
+    with pytest.raises(RuntimeError, match="truncated"):
+        read_xds_hkl(str(tmp_path / "XDS_ASCII.HKL"))
+
+
+def test_columns_round_trip(tmp_path):
+    numpy = pytest.importorskip("numpy")
+    hklin = str(tmp_path / "XDS_ASCII.HKL")
+    (tmp_path / "XDS_ASCII.HKL").write_text(xds_ascii)
+
+    assert write_columns(hklin) == str(tmp_path / "XDS_ASCII.cols")
+    header, columns = load_columns(str(tmp_path / "XDS_ASCII.cols"))
+
+    assert header["SPACE_GROUP_NUMBER"] == "75"
+    assert list(columns) == ["H", "K", "L", "IOBS", "SIGMA", "XD", "YD", "ZD", "BATCH"]
+    assert isinstance(columns["IOBS"], numpy.memmap)
+    assert list(columns["K"]) == [0, 2]
+    assert list(columns["BATCH"]) == [13, 501]
+    assert numpy.allclose(columns["SIGMA"], [5.678, 2.0])
+
+
+def test_load_reflections_prefers_current_columns(tmp_path):
+    numpy = pytest.importorskip("numpy")
+    hklin = str(tmp_path / "XDS_ASCII.HKL")
+    (tmp_path / "XDS_ASCII.HKL").write_text(xds_ascii)
+    write_columns(hklin)
+
+    _, columns = load_reflections(hklin)
+    assert isinstance(columns["IOBS"], numpy.memmap)
+
+    # rewritten by a later CORRECT: back to the text until rewritten
+    (tmp_path / "XDS_ASCII.HKL").write_text(xds_ascii.replace("    -1", "    -2"))
+    _, columns = load_reflections(hklin)
+    assert not isinstance(columns["IOBS"], numpy.memmap)
+    assert list(columns["H"]) == [0, -2]
+    assert list(columns["BATCH"]) == [13, 501]
+
+    os.remove(hklin)
+    _, columns = load_reflections(hklin)
+    assert list(columns["H"]) == [0, -1]
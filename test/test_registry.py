@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import pytest
+
+from fast_dp import registry
+
+
+@pytest.fixture
+def history(tmp_path):
+    default = registry.get_registry()
+    registry.set_registry(str(tmp_path / "registry.sqlite"))
+    yield
+    registry.set_registry(default)
+
+
+def usage(wall_time):
+    return {"calls": 1, "wall_time": wall_time}
+
+
+def test_no_history(history):
+    assert registry.history("PILATUS 2463x2527") == []
+    assert registry.choose_layout("PILATUS 2463x2527", 900, 8, 16) is None
+
+
+def test_choose_layout(history):
+    # integration costing 10 s + 2 s per job + 0.32 core s per image
+    for images, n_jobs, n_cores in ((900, 1, 16), (900, 4, 4), (1800, 8, 2)):
+        wall = 10 + 2 * n_jobs + 0.32 * images / (n_jobs * n_cores)
+        registry.record_run(
+            "EIGER 4148x4362",
+            images,
+            n_jobs,
+            n_cores,
+            {"integrate": usage(wall), "CORRECT": usage(images * 0.01)},
+            cpus=16,
+        )
+    registry.record_run("PILATUS 2463x2527", 900, 1, 16, {"integrate": usage(1)})
+
+    assert len(registry.history("EIGER 4148x4362")) == 3
+
+    overhead, per_job, per_image = registry.fit_model(
+        registry.history("EIGER 4148x4362")
+    )
+    assert overhead == pytest.approx(10)
+    assert per_job == pytest.approx(2)
+    assert per_image == pytest.approx(0.32)
+
+    # with per job overheads, one job using every core is best
+    n_jobs, n_cores, wall = registry.choose_layout("EIGER 4148x4362", 3600, 8, 16)
+    assert (n_jobs, n_cores) == (1, 16)
+    assert wall == pytest.approx(10 + 2 + 0.32 * 3600 / 16)
+
+    assert registry.predict_stages("EIGER 4148x4362", 3600) == {
+        "CORRECT": pytest.approx(36)
+    }
+
+
+def test_registry_disabled(history):
+    registry.set_registry(None)
+    registry.record_run("EIGER 4148x4362", 900, 1, 16, {"integrate": usage(1)})
+    assert registry.history("EIGER 4148x4362") == []
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+from fast_dp import run_job
+
+
+def test_run_job_records_resource_usage():
+    run_job.reset_resource_usage()
+
+    output = run_job.run_job("echo", ["hello"], stage="greeting")
+    assert "".join(output).strip().strip('"') == "hello"
+
+    run_job.run_job("echo", ["again"], stage="greeting")
+
+    usage = run_job.get_resource_usage()
+    assert list(usage) == ["greeting"]
+    assert usage["greeting"]["calls"] == 2
+    assert usage["greeting"]["wall_time"] > 0
+    if hasattr(os, "wait4"):
+        assert usage["greeting"]["max_rss_kb"] > 0
+
+    run_job.reset_resource_usage()
+    assert run_job.get_resource_usage() == {}
+
+
+def test_stream_job_writes_log_and_keeps_tail(tmp_path):
+    records = []
+    script = "import sys\nfor j in range(50):\n    print(j)\n"
+
+    tail = run_job.stream_job(
+        sys.executable,
+        ["-c", script],
+        working_directory=str(tmp_path),
+        log_file="count.log",
+        handlers=[records.append],
+        tail=5,
+    )
+
+    assert [int(record) for record in tail] == list(range(45, 50))
+    assert [int(record) for record in records] == list(range(50))
+    assert (tmp_path / "count.log").read_text().split() == list(map(str, range(50)))
+
+
+def test_stream_job_handler_error_stops_job(tmp_path):
+    script = "import sys, time\nprint('!!! ERROR !!!', flush=True)\ntime.sleep(60)\n"
+
+    def check(record):
+        if "!!! ERROR !!!" in record:
+            raise RuntimeError("error found")
+
+    start = time.time()
+    with pytest.raises(RuntimeError, match="error found"):
+        run_job.stream_job(
+            sys.executable,
+            ["-c", script],
+            working_directory=str(tmp_path),
+            handlers=[check],
+        )
+    assert time.time() - start < 30
+
+
+def _running(pid):
+    try:
+        with open("/proc/%d/stat" % pid) as fh:
+            return fh.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/stat"), reason="needs /proc")
+def test_stream_job_handler_error_stops_children(tmp_path):
+    def check(record):
+        if "!!! ERROR !!!" in record:
+            raise RuntimeError("error found")
+
+    with pytest.raises(RuntimeError, match="error found"):
+        run_job.stream_job(
+            "sleep 60 & echo $! > sleep.pid; echo '!!! ERROR !!!'; wait",
+            working_directory=str(tmp_path),
+            handlers=[check],
+        )
+
+    pid = int((tmp_path / "sleep.pid").read_text())
+    end = time.time() + 10
+    while _running(pid) and time.time() < end:
+        time.sleep(0.1)
+    assert not _running(pid)
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/stat"), reason="needs /proc")
+def test_sigterm_stops_jobs(tmp_path):
+    script = (
+        "from fast_dp.run_job import stop_jobs_on_signal, stream_job\n"
+        "from fast_dp.stages import Stage, run_stages\n"
+        "stop_jobs_on_signal()\n"
+        "job = lambda: stream_job('sleep 60 & echo $! > sleep.pid; wait')\n"
+        "run_stages([Stage('integrate', job)])\n"
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-c", script],
+        cwd=tmp_path,
+        env=dict(
+            os.environ,
+            PYTHONPATH=os.path.dirname(os.path.dirname(run_job.__file__)),
+        ),
+    )
+    pid_file = tmp_path / "sleep.pid"
+    end = time.time() + 30
+    while not (pid_file.exists() and pid_file.read_text().strip()):
+        assert time.time() < end
+        time.sleep(0.05)
+    pid = int(pid_file.read_text())
+
+    # the job is in a session of its own, so is stopped by fast_dp not the
+    # signal, and fast_dp does not wait for it to finish
+    start = time.time()
+    process.send_signal(signal.SIGTERM)
+    assert process.wait(timeout=10) == 128 + signal.SIGTERM
+    assert time.time() - start < 5
+    assert not _running(pid)
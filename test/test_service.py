@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from fast_dp import service
+
+
+def test_completed_sweeps(tmp_path):
+    old = time.time() - 100
+    for name in ("done_1_00001.cbf", "done_1_00002.cbf", "busy_00001.cbf"):
+        (tmp_path / name).write_text("")
+    for name in ("hdf_1_master.h5", "hdf_1_data_000001.h5", "notes_1.txt"):
+        (tmp_path / name).write_text("")
+    for name in ("done_1_00001.cbf", "done_1_00002.cbf", "notes_1.txt"):
+        os.utime(tmp_path / name, (old, old))
+    os.utime(tmp_path / "hdf_1_master.h5", (old, old))
+
+    # the HDF5 data file is still being written
+    assert service.completed_sweeps(str(tmp_path), 10) == {
+        str(tmp_path / "done_1_#####.cbf"): str(tmp_path / "done_1_00001.cbf")
+    }
+
+    os.utime(tmp_path / "hdf_1_data_000001.h5", (old, old))
+    assert str(tmp_path / "hdf_1_master.h5") in service.completed_sweeps(
+        str(tmp_path), 10
+    )
+
+
+def _wait_for(condition, timeout=30):
+    end = time.time() + timeout
+    while time.time() < end:
+        result = condition()
+        if result:
+            return result
+        time.sleep(0.1)
+    raise AssertionError("timed out")
+
+
+def test_service_runs_submitted_dataset(tmp_path):
+    socket_path = str(tmp_path / "fast_dp.sock")
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.path.dirname(os.path.dirname(service.__file__)),
+    )
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "fast_dp.service",
+            "--socket",
+            socket_path,
+            "--cores",
+            "2",
+            "--",
+            "-R",
+            "20",
+        ],
+        cwd=tmp_path,
+        stdout=subprocess.DEVNULL,
+        env=env,
+    )
+    try:
+        _wait_for(lambda: os.path.exists(socket_path))
+
+        # a client yet to finish its request holds up no one else
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as slow:
+            slow.connect(socket_path)
+            slow.sendall(b"sta")
+            start = time.time()
+            reply = service.submit(socket_path, "--name first /nonexistent/x_00001.cbf")
+            assert time.time() - start < 2
+            assert reply == {"name": "first", "directory": str(tmp_path / "first")}
+            reply = service.submit(socket_path, "--name first /nonexistent/y_00001.cbf")
+            assert reply == {"error": "first already exists"}
+            slow.sendall(b"tus\n")
+            reply = json.loads(slow.makefile().readline())
+            assert set(reply) == {"waiting", "running", "finished"}
+
+        # fast_dp options after --submit are for the dataset
+        output = subprocess.check_output(
+            [
+                sys.executable,
+                "-m",
+                "fast_dp.service",
+                "--socket",
+                socket_path,
+                "--submit",
+                "--name",
+                "second",
+                "-a",
+                "Se",
+                "/nonexistent/z_00001.cbf",
+            ],
+            env=env,
+        )
+        assert json.loads(output) == {
+            "name": "second",
+            "directory": str(tmp_path / "second"),
+        }
+
+        def finished():
+            status = service.submit(socket_path, "status")
+            return status if len(status["finished"]) == 2 else None
+
+        status = _wait_for(finished)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=10) == 0
+
+    assert sorted(status["finished"], key=lambda dataset: dataset["name"]) == [
+        {
+            "name": "first",
+            "exit_status": 1,
+            "error": "/nonexistent/x_00001.cbf does not exist",
+        },
+        {
+            "name": "second",
+            "exit_status": 1,
+            "error": "/nonexistent/z_00001.cbf does not exist",
+        },
+    ]
+    assert (tmp_path / "first" / "fast_dp.log").exists()
+    assert not os.path.exists(socket_path)
+
+    with open(tmp_path / "fast_dp_service.json") as fh:
+        datasets = json.load(fh)["datasets"]
+    assert datasets[0]["command"][:5] == ["fast_dp", "-j", "1", "-k", "2"]
+    assert datasets[0]["command"][5:] == ["-R", "20", "/nonexistent/x_00001.cbf"]
+    assert datasets[1]["command"][5:] == [
+        "-R",
+        "20",
+        "-a",
+        "Se",
+        "/nonexistent/z_00001.cbf",
+    ]
+
+
+def _running(pid):
+    try:
+        with open("/proc/%d/stat" % pid) as fh:
+            return fh.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/stat"), reason="needs /proc")
+def test_stopped_worker_stops_jobs(tmp_path):
+    # a worker whose fast_dp runs one long job, as stream_job runs XDS
+    script = (
+        "import sys\n"
+        "from fast_dp import service\n"
+        "from fast_dp.run_job import stream_job\n"
+        "service.fast_dp_main = lambda: stream_job(\n"
+        "    'sleep 60 & echo $! > sleep.pid; wait'\n"
+        ")\n"
+        "sys.exit(service._worker({'directory': %r, 'command': ['fast_dp']}))\n"
+        % str(tmp_path)
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-c", script],
+        env=dict(
+            os.environ,
+            PYTHONPATH=os.path.dirname(os.path.dirname(service.__file__)),
+        ),
+    )
+
+    pid_file = tmp_path / "sleep.pid"
+    _wait_for(lambda: pid_file.exists() and pid_file.read_text().strip())
+
+    process.send_signal(signal.SIGTERM)
+    assert process.wait(timeout=10) == 128 + signal.SIGTERM
+    assert not _running(int(pid_file.read_text()))
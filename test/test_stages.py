@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+
+import pytest
+
+from fast_dp.run_job import run_job, stream_job
+from fast_dp.stages import (
+    Stage,
+    completed_stages,
+    run_stages,
+    stage_dependencies,
+)
+
+
+def test_stage_dependencies_from_files():
+    stages = [
+        Stage("correct", None, outputs=["XDS_ASCII.HKL"]),
+        Stage("xdsstat", None, inputs=["XDS_ASCII.HKL"]),
+        Stage("merge", None, inputs=["XDS_ASCII.HKL"], outputs=["fast_dp.mtz"]),
+        Stage("report", None, after=["merge", "xdsstat"]),
+    ]
+    depends = stage_dependencies(stages)
+    assert depends == {
+        "correct": set(),
+        "xdsstat": {"correct"},
+        "merge": {"correct"},
+        "report": {"merge", "xdsstat"},
+    }
+
+
+def test_stage_dependencies_cycle():
+    stages = [
+        Stage("a", None, inputs=["b.txt"], outputs=["a.txt"]),
+        Stage("b", None, inputs=["a.txt"], outputs=["b.txt"]),
+    ]
+    with pytest.raises(RuntimeError, match="cycle"):
+        stage_dependencies(stages)
+
+
+def test_run_stages_overlaps_independent_stages(tmp_path):
+    # both branches must be running at the same time for either to finish
+    barrier = threading.Barrier(2, timeout=10)
+    order = []
+
+    def make(name, wait=False):
+        def function():
+            if wait:
+                barrier.wait()
+            (tmp_path / name).write_text(name)
+            order.append(name)
+            return name
+
+        return function
+
+    stages = [
+        Stage("first", make("first"), outputs=["first"]),
+        Stage("left", make("left", True), inputs=["first"], outputs=["left"]),
+        Stage("right", make("right", True), inputs=["first"], outputs=["right"]),
+        Stage("last", make("last"), inputs=["left", "right"]),
+    ]
+
+    results = run_stages(stages, working_directory=str(tmp_path))
+    assert results == {name: name for name in ("first", "left", "right", "last")}
+    assert order[0] == "first" and order[-1] == "last"
+
+
+def test_run_stages_failure_stops_later_stages(tmp_path):
+    ran = []
+
+    def fail():
+        raise RuntimeError("integration error")
+
+    stages = [
+        Stage("integrate", fail),
+        Stage("scale", lambda: ran.append("scale"), after=["integrate"]),
+    ]
+    with pytest.raises(RuntimeError, match="integration error"):
+        run_stages(stages, working_directory=str(tmp_path))
+    assert ran == []
+
+
+def _running(pid):
+    try:
+        with open("/proc/%d/stat" % pid) as fh:
+            return fh.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/stat"), reason="needs /proc")
+def test_run_stages_failure_stops_running_jobs(tmp_path):
+    pid_file = tmp_path / "sleep.pid"
+
+    def fail():
+        while not pid_file.exists():
+            time.sleep(0.05)
+        raise RuntimeError("integration error")
+
+    stages = [
+        Stage(
+            "xdsstat",
+            lambda: stream_job(
+                "sleep 60 & echo $! > sleep.pid; wait",
+                working_directory=str(tmp_path),
+            ),
+        ),
+        Stage("integrate", fail),
+    ]
+    start = time.time()
+    with pytest.raises(RuntimeError, match="integration error"):
+        run_stages(stages, working_directory=str(tmp_path))
+    assert time.time() - start < 10
+    assert not _running(int(pid_file.read_text()))
+
+    # and jobs may be run again afterwards
+    assert "".join(run_job("echo", ["again"])).strip().strip('"') == "again"
+
+
+def test_run_stages_missing_output(tmp_path):
+    stages = [Stage("autoindex", lambda: None, outputs=["XPARM.XDS"])]
+    with pytest.raises(RuntimeError, match="did not produce XPARM.XDS"):
+        run_stages(stages, working_directory=str(tmp_path))
+
+
+def test_run_stages_resume(tmp_path):
+    ran = []
+
+    def make(name):
+        def function():
+            (tmp_path / name).write_text(name)
+            ran.append(name)
+
+        return function
+
+    stages = [
+        Stage("autoindex", make("XPARM.XDS"), outputs=["XPARM.XDS"]),
+        Stage(
+            "integrate",
+            make("INTEGRATE.HKL"),
+            inputs=["XPARM.XDS"],
+            outputs=["INTEGRATE.HKL"],
+        ),
+        Stage("scale", make("XDS_ASCII.HKL"), inputs=["INTEGRATE.HKL"]),
+    ]
+
+    checkpoints = []
+    run_stages(stages, working_directory=str(tmp_path), on_complete=checkpoints.append)
+    assert checkpoints == ["autoindex", "integrate", "scale"]
+
+    # integration output lost: must redo integrate and everything after it
+    (tmp_path / "INTEGRATE.HKL").unlink()
+    assert completed_stages(stages, checkpoints, str(tmp_path)) == ["autoindex"]
+
+    del ran[:]
+    run_stages(stages, working_directory=str(tmp_path), completed=checkpoints)
+    assert ran == ["INTEGRATE.HKL", "XDS_ASCII.HKL"]
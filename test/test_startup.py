@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import os
+import subprocess
+import sys
+
+import fast_dp
+
+# the scientific libraries are only needed once processing starts, so
+# should not be imported just to parse the command line
+
+heavy = ("cctbx", "dxtbx", "iotbx", "scitbx", "numpy", "h5py")
+
+
+def imported_after(statement):
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys\n%s\nprint(' '.join(sorted(sys.modules)))" % statement,
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout.split()
+
+
+def test_entry_points_do_not_import_scientific_libraries():
+    for module in ("fast_dp.fast_dp", "fast_dp.fast_rdp"):
+        modules = imported_after("import %s" % module)
+        assert module in modules
+        assert not [m for m in modules if m.split(".")[0] in heavy]
+
+
+def test_version_is_quick(tmp_path):
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "from fast_dp.fast_dp import main; main()",
+            "--version",
+        ],
+        cwd=tmp_path,
+        env=dict(
+            os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(fast_dp.__file__))
+        ),
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0
+    assert fast_dp.__version__ in result.stdout
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import os
+
+import pytest
+
+from fast_dp import step_cache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    frames = tmp_path / "frames"
+    frames.mkdir()
+    for j in range(1, 4):
+        (frames / ("x_%04d.cbf" % j)).write_bytes(b"frame %d" % j)
+
+    work = tmp_path / "work"
+    work.mkdir()
+    monkeypatch.chdir(work)
+
+    step_cache.set_cache_directory(str(tmp_path / "cache"), max_size=1024)
+    yield {
+        "NAME_TEMPLATE_OF_DATA_FRAMES": str(frames / "x_????.cbf"),
+        "DATA_RANGE": "1 3",
+    }
+    step_cache.set_cache_directory(None)
+
+
+def test_step_cache_disabled():
+    assert step_cache.get_cache_directory() is None
+    assert step_cache.step_key("autoindex", "AUTOINDEX.INP", {}) is None
+    assert not step_cache.restore_step(None)
+
+
+def test_step_cache_store_restore(cache):
+    with open("AUTOINDEX.INP", "w") as fh:
+        fh.write("JOB=XYCORR INIT COLSPOT IDXREF\n")
+    with open("XPARM.XDS", "w") as fh:
+        fh.write("xparm\n")
+
+    key = step_cache.step_key("autoindex", "AUTOINDEX.INP", cache)
+    assert not step_cache.restore_step(key)
+    step_cache.store_step(key, ["XPARM.XDS", "SPOT.XDS"])
+
+    os.remove("XPARM.XDS")
+    assert step_cache.step_key("autoindex", "AUTOINDEX.INP", cache) == key
+    assert step_cache.restore_step(key)
+    with open("XPARM.XDS") as fh:
+        assert fh.read() == "xparm\n"
+    assert not os.path.exists("SPOT.XDS")
+
+    # changing the input gives a different key
+    with open("AUTOINDEX.INP", "a") as fh:
+        fh.write("SPOT_RANGE=1 2\n")
+    assert step_cache.step_key("autoindex", "AUTOINDEX.INP", cache) != key
+
+
+def test_step_cache_frame_touched(cache):
+    with open("AUTOINDEX.INP", "w") as fh:
+        fh.write("JOB=XYCORR INIT COLSPOT IDXREF\n")
+    with open("XPARM.XDS", "w") as fh:
+        fh.write("xparm\n")
+
+    key = step_cache.step_key("autoindex", "AUTOINDEX.INP", cache)
+    step_cache.store_step(key, ["XPARM.XDS"])
+
+    # a frame rewritten in place (same name and size) since it was cached
+    frame = cache["NAME_TEMPLATE_OF_DATA_FRAMES"].replace("????", "0002")
+    stat = os.stat(frame)
+    os.utime(frame, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    touched = step_cache.step_key("autoindex", "AUTOINDEX.INP", cache)
+    assert touched != key
+    assert not step_cache.restore_step(touched)
+
+
+def test_step_cache_evicts_least_recently_used(cache):
+    keys = []
+    for j in range(3):
+        with open("CORRECT.INP", "w") as fh:
+            fh.write("run %d\n" % j)
+        with open("CORRECT.LP", "wb") as fh:
+            fh.write(b"x" * 400)
+        keys.append(step_cache.step_key("correct", "CORRECT.INP", cache))
+        step_cache.store_step(keys[-1], ["CORRECT.LP"])
+        # make sure the entries have distinct times
+        entry = os.path.join(step_cache.get_cache_directory(), keys[-1])
+        os.utime(entry, (j, j))
+
+    # three entries of 400 bytes do not fit in 1024 so the oldest went
+    assert not step_cache.restore_step(keys[0])
+    assert step_cache.restore_step(keys[1])
+    assert step_cache.restore_step(keys[2])
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import os
+import signal
+import subprocess
+import sys
+
+from fast_dp import worker_pool
+
+
+def _task(tmp_path):
+    task = tmp_path / "mtask"
+    task.write_text("#!/bin/sh\nread n\ntouch task_$n\nexit $((n == 3))\n")
+    task.chmod(0o755)
+    return str(task)
+
+
+def test_agent_runs_tasks(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    spool = tmp_path / "spool"
+    task = _task(tmp_path)
+
+    agent = subprocess.Popen(
+        [sys.executable, "-m", "fast_dp.worker_pool", str(spool)],
+        env=dict(
+            os.environ,
+            PYTHONPATH=os.path.dirname(os.path.dirname(worker_pool.__file__)),
+        ),
+    )
+    try:
+        results = worker_pool.submit_tasks(str(spool), 4, 1, task, timeout=30)
+    finally:
+        agent.send_signal(signal.SIGTERM)
+        assert agent.wait(timeout=10) == 0
+
+    assert [result["task"] for result in results] == [1, 2, 3, 4]
+    assert [result["exit_status"] for result in results] == [0, 0, 1, 0]
+    assert all(result["latency"] >= 0 for result in results)
+    assert all(os.path.exists("task_%d" % j) for j in range(1, 5))
+    assert not os.listdir(spool / "pending")
+    assert not os.listdir(spool / "done")
+
+
+def test_unclaimed_tasks_run_here(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    spool = tmp_path / "spool"
+    task = _task(tmp_path)
+
+    results = worker_pool.submit_tasks(str(spool), 2, 1, task, timeout=0.2)
+
+    assert [result["task"] for result in results] == [1, 2]
+    assert all(result["latency"] >= 0.2 for result in results)
+    assert not os.listdir(spool / "pending")
+
+
+def test_allocate_within_node():
+    nodes = [[0, 1, 2, 3], [4, 5, 6, 7]]
+    assert worker_pool._allocate(nodes, {1, 2, 4, 5, 6}, 3, {}) == [4, 5, 6]
+    assert worker_pool._allocate(nodes, {1, 2, 4, 5}, 3, {}) == [1, 2, 4]
+    assert worker_pool._allocate(nodes, {1}, 2, {1: None}) is None
+    assert worker_pool._allocate(nodes, {1}, 2, {}) == [1]